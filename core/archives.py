@@ -0,0 +1,295 @@
+import io
+import lzma
+import os
+import tarfile
+import threading
+import zipfile
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import NamedTuple, Optional
+
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+# Separates an archive's path from the name of a member inside it.
+MEMBER_SEPARATOR = "!/"
+# Archives kept open between reads, and members of a compressed TAR kept in
+# memory after the stream passed them, for readers that asked out of order.
+# Member listings are kept for every archive until close_archives().
+OPEN_ARCHIVES = 8
+SKIPPED_MEMBERS = 32
+
+# zipfile raises NotImplementedError for unsupported compression methods
+# such as Deflate64, and RuntimeError for encrypted members.
+_ARCHIVE_ERRORS = (
+    zipfile.BadZipFile,
+    zipfile.LargeZipFile,
+    tarfile.TarError,
+    EOFError,
+    zlib.error,
+    lzma.LZMAError,
+    NotImplementedError,
+    RuntimeError,
+)
+
+
+class MemberStat(NamedTuple):
+    """The parts of os.stat_result scans use, for a member inside an archive.
+
+    A member takes its size from the archive listing and its modification
+    time and identity from the archive, so rewriting the archive marks
+    every member as changed.
+    """
+
+    st_size: int
+    st_mtime_ns: int
+    st_dev: int
+    st_ino: int
+
+
+def is_archive(path) -> bool:
+    return os.fspath(path).lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def member_path(archive_path: str, member: str) -> str:
+    """Return the virtual path of a member, such as ``photos.zip!/2019/beach.jpg``."""
+    return f"{archive_path}{MEMBER_SEPARATOR}{member}"
+
+
+def split_member(path: str) -> tuple[str, Optional[str]]:
+    """Return ``(archive, member)`` for a virtual path, or ``(path, None)`` for a file on disk."""
+    start = path.find(MEMBER_SEPARATOR)
+    while start != -1:
+        if is_archive(path[:start]):
+            return path[:start], path[start + len(MEMBER_SEPARATOR):]
+        start = path.find(MEMBER_SEPARATOR, start + 1)
+    return path, None
+
+
+def is_member(path) -> bool:
+    return isinstance(path, str) and split_member(path)[1] is not None
+
+
+@contextmanager
+def _archive_errors(archive_path):
+    # Corrupt archives surface as OSError so scans report them as skipped files.
+    try:
+        yield
+    except _ARCHIVE_ERRORS as error:
+        raise OSError(f"cannot read archive {archive_path!r}: {error}") from error
+
+
+class _Listing(NamedTuple):
+    """The members of one archive as it was on disk when listed."""
+
+    stat: os.stat_result
+    # Member name, as used in virtual paths, mapped to its size and stored name.
+    members: dict
+    # "zip", "tar" for an uncompressed TAR, or "stream" for a compressed one.
+    kind: str
+
+    @property
+    def signature(self):
+        return self.stat.st_size, self.stat.st_mtime_ns
+
+
+def _list_archive(archive_path: str, stat) -> _Listing:
+    members = {}
+    with _archive_errors(archive_path):
+        if zipfile.is_zipfile(archive_path):
+            with zipfile.ZipFile(archive_path) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        members[_Archive._name(info.filename)] = (info.file_size, info.filename)
+            return _Listing(stat, members, "zip")
+        try:
+            with tarfile.open(archive_path, "r:") as tar:
+                infos = [info for info in tar.getmembers() if info.isfile()]
+            kind = "tar"
+        except tarfile.ReadError:
+            # Compressed; listing it decompresses all of it, which is why listings are kept.
+            with tarfile.open(archive_path, "r:*") as tar:
+                infos = [info for info in tar if info.isfile()]
+            kind = "stream"
+    for info in infos:
+        members[_Archive._name(info.name)] = (info.size, info.name)
+    return _Listing(stat, members, kind)
+
+
+class _Archive:
+    """One open archive whose members are read by any number of threads.
+
+    ZIP members and those of uncompressed TARs are read by offset. A
+    compressed TAR can only be decompressed from the start, so its members
+    are streamed in archive order and the stream is reopened only when a
+    member behind it is asked for.
+    """
+
+    def __init__(self, archive_path: str, listing: _Listing):
+        self.archive_path = archive_path
+        self.signature = listing.signature
+        self.stat = listing.stat
+        self.lock = threading.Lock()
+        self.members = listing.members
+        self._zip = self._tar = self._stream = None
+        self._infos = {}
+        self._skipped = OrderedDict()
+        self.closed = False
+        with _archive_errors(archive_path):
+            if listing.kind == "zip":
+                self._zip = zipfile.ZipFile(archive_path)
+            elif listing.kind == "tar":
+                # Reading an uncompressed TAR's headers seeks from one to the next.
+                self._tar = tarfile.open(archive_path, "r:")
+                self._infos = {info.name: info for info in self._tar.getmembers() if info.isfile()}
+
+    @staticmethod
+    def _name(stored_name: str) -> str:
+        while stored_name.startswith("./"):
+            stored_name = stored_name[2:]
+        return stored_name.lstrip("/")
+
+    def read(self, member: str) -> Optional[bytes]:
+        """Return a member's contents, or None once the archive has been closed."""
+        if member not in self.members:
+            raise FileNotFoundError(f"{member!r} is not in {self.archive_path!r}")
+        stored_name = self.members[member][1]
+        with self.lock, _archive_errors(self.archive_path):
+            if self.closed:
+                return None
+            if self._zip is not None:
+                return self._zip.read(stored_name)
+            if self._tar is not None:
+                return self._tar.extractfile(self._infos[stored_name]).read()
+            return self._read_streamed(stored_name)
+
+    def _read_streamed(self, stored_name: str) -> bytes:
+        if stored_name in self._skipped:
+            return self._skipped.pop(stored_name)
+        from core.scanner import IMAGE_EXTENSIONS
+
+        for _ in range(2):
+            if self._stream is None:
+                self._stream = tarfile.open(self.archive_path, "r|*")
+                self._stream_infos = iter(self._stream)
+            for info in self._stream_infos:
+                if not info.isfile():
+                    continue
+                if info.name == stored_name:
+                    return self._stream.extractfile(info).read()
+                # Parallel readers ask for members slightly out of order; keep
+                # the images passed on the way so they need not be reread.
+                # Other members, such as videos, are skipped without reading them.
+                if os.path.splitext(info.name)[1].lower() in IMAGE_EXTENSIONS:
+                    self._skipped[info.name] = self._stream.extractfile(info).read()
+                    if len(self._skipped) > SKIPPED_MEMBERS:
+                        self._skipped.popitem(last=False)
+            self._close_stream()
+        raise FileNotFoundError(f"{stored_name!r} is not in {self.archive_path!r}")
+
+    def _close_stream(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self._close_stream()
+            self._skipped.clear()
+            for handle in (self._zip, self._tar):
+                if handle is not None:
+                    handle.close()
+
+
+_open_archives = OrderedDict()
+_listings = {}
+_open_lock = threading.Lock()
+
+
+def _listing(archive_path: str) -> _Listing:
+    """Return the members of the archive at ``archive_path``, listing it again only if it changed."""
+    stat = os.stat(archive_path)
+    key = os.path.normcase(os.path.abspath(archive_path))
+    with _open_lock:
+        listing = _listings.get(key)
+    if listing is not None and listing.signature == (stat.st_size, stat.st_mtime_ns):
+        return listing
+    # Listing a compressed archive reads all of it, so it runs outside the lock.
+    listing = _list_archive(archive_path, stat)
+    with _open_lock:
+        _listings[key] = listing
+    return listing
+
+
+def _archive(archive_path: str) -> _Archive:
+    """Return the open archive at ``archive_path``, reopening it if it changed on disk."""
+    listing = _listing(archive_path)
+    key = os.path.normcase(os.path.abspath(archive_path))
+    with _open_lock:
+        archive = _open_archives.get(key)
+        if archive is not None and archive.signature == listing.signature:
+            _open_archives.move_to_end(key)
+            return archive
+    opened = _Archive(archive_path, listing)
+    with _open_lock:
+        stale = _open_archives.pop(key, None)
+        _open_archives[key] = opened
+        evicted = [stale] if stale is not None else []
+        while len(_open_archives) > OPEN_ARCHIVES:
+            evicted.append(_open_archives.popitem(last=False)[1])
+    for archive in evicted:
+        archive.close()
+    return opened
+
+
+def close_archives() -> None:
+    """Close every archive kept open by earlier reads, so the files can be moved or deleted.
+
+    The member listings are dropped too, so the next scan lists archives afresh.
+    """
+    with _open_lock:
+        archives = list(_open_archives.values())
+        _open_archives.clear()
+        _listings.clear()
+    for archive in archives:
+        archive.close()
+
+
+def list_members(archive_path: str) -> list[str]:
+    """Return the virtual paths of the files in an archive, in archive order."""
+    return [member_path(archive_path, member) for member in _listing(archive_path).members]
+
+
+def file_stat(path: str):
+    """Return os.stat() of a file, or a MemberStat for a member inside an archive."""
+    archive_path, member = split_member(path)
+    if member is None:
+        return os.stat(path)
+    listing = _listing(archive_path)
+    if member not in listing.members:
+        raise FileNotFoundError(f"{member!r} is not in {archive_path!r}")
+    size = listing.members[member][0]
+    return MemberStat(size, listing.stat.st_mtime_ns, listing.stat.st_dev, listing.stat.st_ino)
+
+
+def file_size(path: str) -> int:
+    return file_stat(path).st_size
+
+
+def read_bytes(path: str) -> bytes:
+    """Return the contents of a file or of a member inside an archive, without extracting it."""
+    archive_path, member = split_member(path)
+    if member is None:
+        with open(path, "rb") as source:
+            return source.read()
+    while True:
+        # Another thread may close the archive to make room for others; reopen it then.
+        data = _archive(archive_path).read(member)
+        if data is not None:
+            return data
+
+
+def image_source(path):
+    """Return what Image.open() needs for ``path``: the path itself, or a member's contents."""
+    return io.BytesIO(read_bytes(path)) if is_member(path) else path
@@ -0,0 +1,92 @@
+import time
+
+
+# Tile sides tried when choosing the comparison tile size.
+BLOCK_SIZES = (128, 256, 512, 1024)
+# Settings reported in scan metrics and accepted by ImageScanner.apply_tuning().
+TUNED_SETTINGS = ("read_ahead_threads", "read_ahead_depth", "comparison_block_size")
+
+
+class ReadAheadTuner:
+    """Adjust a ReadAhead's reader count and depth while a scan runs.
+
+    Throughput and the share of time the scan waited for reads are measured
+    over windows of ``window`` files. While the scan
+    waits on reads, the readers are doubled: more requests in flight help
+    SSDs and network shares. When a step lowers throughput, as the extra
+    seeking does on a hard drive, the best setting seen is restored. Tuning
+    stops at the first setting that no longer waits on reads, or after
+    ``sample_files`` files.
+    """
+
+    def __init__(self, window=32, sample_files=512, max_readers=16):
+        self.window = window
+        self.sample_files = sample_files
+        self.max_readers = max_readers
+        self.settled = False
+        self.images_per_second = None
+        self.io_wait_share = None
+        self._best = None
+        self._window_start = None
+
+    def _sample(self, read_ahead):
+        return time.perf_counter(), read_ahead.consumer_wait_seconds, read_ahead.consumed
+
+    def file_consumed(self, read_ahead):
+        """Called by ReadAhead after each file is handed to the scan."""
+        if self.settled:
+            return
+        now = self._sample(read_ahead)
+        if self._window_start is None:
+            # The first file includes thread start-up; measure from here.
+            self._window_start = now
+            return
+        wall, waited, consumed = (value - start for value, start in zip(now, self._window_start))
+        if consumed < self.window:
+            return
+        self._window_start = now
+        wall = max(wall, 1e-9)
+        self.images_per_second = consumed / wall
+        self.io_wait_share = waited / wall
+
+        current = (read_ahead.readers, read_ahead.depth)
+        if self._best is None or self.images_per_second > self._best[0]:
+            self._best = (self.images_per_second, *current)
+        if self.images_per_second < self._best[0] * 0.9:
+            self._settle(read_ahead, *self._best[1:])
+        elif now[2] >= self.sample_files or self.io_wait_share < 0.1 or current[0] >= self.max_readers:
+            self._settle(read_ahead, *current)
+        else:
+            readers = min(self.max_readers, read_ahead.readers * 2)
+            read_ahead.resize(readers, max(read_ahead.depth, readers * 8))
+
+    def _settle(self, read_ahead, readers, depth):
+        read_ahead.resize(readers, depth)
+        self.settled = True
+
+    def stats(self) -> dict:
+        stats = {"autotune_settled": self.settled}
+        if self.images_per_second is not None:
+            stats["images_per_second"] = round(self.images_per_second, 1)
+            stats["io_wait_share"] = round(self.io_wait_share, 2)
+        return stats
+
+
+def fastest_block_size(score_block, rows, positions, candidates=BLOCK_SIZES):
+    """Return the tile side at which ``score_block`` scores pairs fastest.
+
+    Each candidate is timed on the scan's own packed fingerprints, so the
+    choice reflects this machine's caches and memory bandwidth. Returns
+    ``None`` when there are too few fingerprints to fill the smallest tile.
+    """
+    best_size, best_rate = None, 0.0
+    for size in candidates:
+        if size > len(positions):
+            break
+        sample = rows[positions[:size]]
+        started = time.perf_counter()
+        score_block(sample, sample)
+        rate = size * size / max(time.perf_counter() - started, 1e-9)
+        if rate > best_rate:
+            best_size, best_rate = size, rate
+    return best_size
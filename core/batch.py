@@ -0,0 +1,183 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pywt
+import scipy.fftpack
+from PIL import Image
+
+from core.decode import DecodeScheduler
+
+
+# Hash sizes used by ImageScanner.calculate_visual_fingerprint().
+HASH_SIZE = 16
+PHASH_SIDE = HASH_SIZE * 4
+COLOR_BINBITS = 3
+
+# Peak bytes per wavelet pixel while the wavelet hashes of a batch are
+# computed, matching the allowance in DecodeScheduler.estimate_bytes().
+WAVELET_BYTES_PER_PIXEL = 17
+
+# Colour categories counted per image: black, gray, colours of exactly the
+# saturation colorhash leaves unbinned, then six faint and six bright hues.
+_BLACK, _GRAY, _UNBINNED, _FAINT, _BRIGHT = 0, 1, 2, 3, 9
+_CATEGORIES = 15
+
+
+def _category_table() -> np.ndarray:
+    """Return the category of every ``saturation << 8 | hue`` for pixels that are not black."""
+    # Hue sub-bins use the edges of imagehash.colorhash().
+    hue_bins = np.searchsorted(np.linspace(0, 255, 7)[1:-1], np.arange(256), side="right")
+    saturation = np.arange(256)[:, None]
+    table = np.where(
+        saturation < 256 * 2 // 3,
+        _FAINT + hue_bins,
+        np.where(saturation > 256 * 2 // 3, _BRIGHT + hue_bins, _UNBINNED),
+    )
+    table[saturation[:, 0] < 256 // 3] = _GRAY
+    return table.astype(np.uint8).ravel()
+
+
+_CATEGORY_TABLE = _category_table()
+
+
+@dataclass(frozen=True)
+class FingerprintInput:
+    """The reduced buffers one image contributes to fingerprint_batch().
+
+    ``phash_pixels`` is the 64x64 grayscale image phash transforms,
+    ``wavelet_pixels`` the square grayscale image whash transforms and
+    ``colour_counts`` the pixel count followed by the colorhash category
+    counts. They are taken while the full decode is still in memory.
+    """
+
+    phash_pixels: np.ndarray
+    wavelet_pixels: np.ndarray
+    colour_counts: np.ndarray
+
+
+def reduce_image(image: Image.Image) -> FingerprintInput:
+    """Reduce a normalised RGB image to the buffers its fingerprint is computed from."""
+    gray = image.convert("L")
+    # whash resizes to the largest power of two that fits the short side.
+    scale = max(2 ** int(np.log2(min(image.size))), HASH_SIZE)
+    intensity = np.asarray(gray).ravel()
+    hsv = np.asarray(image.convert("HSV"))
+    category = _CATEGORY_TABLE[(hsv[..., 1].astype(np.intp) << 8 | hsv[..., 0]).ravel()]
+    category[intensity < 256 // 8] = _BLACK
+    counts = np.bincount(category, minlength=_CATEGORIES)
+    return FingerprintInput(
+        phash_pixels=np.asarray(gray.resize((PHASH_SIDE, PHASH_SIDE), Image.Resampling.LANCZOS)),
+        wavelet_pixels=np.asarray(gray.resize((scale, scale), Image.Resampling.LANCZOS)),
+        colour_counts=np.concatenate(([intensity.size], counts)).astype(np.int64),
+    )
+
+
+def _above_median(values: np.ndarray) -> np.ndarray:
+    """Return, per batch entry, which values exceed that entry's median."""
+    medians = np.median(values.reshape(len(values), -1), axis=1)
+    return values > medians.reshape((-1,) + (1,) * (values.ndim - 1))
+
+
+def _phash_bits(inputs) -> np.ndarray:
+    pixels = np.stack([item.phash_pixels for item in inputs])
+    dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=1), axis=2)
+    return _above_median(dct[:, :HASH_SIZE, :HASH_SIZE]).reshape(len(inputs), -1)
+
+
+def _whash_bits(inputs) -> np.ndarray:
+    bits = np.empty((len(inputs), HASH_SIZE * HASH_SIZE), dtype=bool)
+    # Only images whose wavelet buffers have the same side can share a transform.
+    scales = np.array([len(item.wavelet_pixels) for item in inputs])
+    for scale in np.unique(scales).tolist():
+        members = np.flatnonzero(scales == scale)
+        pixels = np.stack([inputs[member].wavelet_pixels for member in members]) / 255.
+        levels = int(np.log2(scale))
+        # Remove the lowest Haar frequency, then hash the LL band of HASH_SIZE sides.
+        coeffs = pywt.wavedec2(pixels, "haar", level=levels, axes=(-2, -1))
+        coeffs[0] *= 0
+        pixels = pywt.waverec2(coeffs, "haar", axes=(-2, -1))
+        low = pywt.wavedec2(pixels, "haar", level=levels - int(np.log2(HASH_SIZE)), axes=(-2, -1))[0]
+        bits[members] = _above_median(low).reshape(len(members), -1)
+    return bits
+
+
+def _colorhash_bits(inputs) -> np.ndarray:
+    counts = np.stack([item.colour_counts for item in inputs])
+    pixels, counts = counts[:, :1], counts[:, 1:]
+    maxvalue = 2 ** COLOR_BINBITS
+    black = counts[:, [_BLACK]]
+    gray = counts[:, [_GRAY]]
+    colours = counts[:, _UNBINNED:].sum(axis=1, keepdims=True)
+    hues = counts[:, _FAINT:]
+    values = np.concatenate(
+        (
+            (black / pixels * maxvalue).astype(np.int64),
+            (gray / pixels * maxvalue).astype(np.int64),
+            (hues * maxvalue * 1. / np.maximum(1, colours)).astype(np.int64),
+        ),
+        axis=1,
+    )
+    values = np.minimum(maxvalue - 1, values)
+    shifts = np.arange(COLOR_BINBITS)
+    bits = (values[:, :, None] // 2 ** (COLOR_BINBITS - shifts - 1)) % 2 ** (COLOR_BINBITS - shifts) > 0
+    return bits.reshape(len(inputs), -1)
+
+
+def fingerprint_batch(inputs) -> np.ndarray:
+    """Return the packed fingerprints of a batch of reduced images, one 70-byte row each.
+
+    The DCT, wavelet transform, median thresholds and colour binning run as
+    single array operations over the batch. The bits are those
+    ImageScanner.calculate_visual_fingerprint() computes one image at a time.
+    """
+    if not inputs:
+        return np.empty((0, 70), dtype=np.uint8)
+    bits = np.concatenate((_phash_bits(inputs), _whash_bits(inputs), _colorhash_bits(inputs)), axis=1)
+    return np.packbits(bits, axis=1)
+
+
+class FingerprintBatcher:
+    """Queue reduced images and fingerprint them together.
+
+    add() and flush() return ``(key, packed)`` for every fingerprint that
+    completed, in the order the images were added. Batches are flushed at
+    ``batch_size`` images or ``max_pixels`` wavelet pixels, and the
+    transform holds its memory in the decode budget of ``scheduler``.
+    """
+
+    def __init__(
+        self,
+        scheduler: Optional[DecodeScheduler] = None,
+        batch_size: int = 64,
+        max_pixels: int = 8 * 1024 ** 2,
+    ):
+        self.scheduler = scheduler
+        self.batch_size = batch_size
+        self.max_pixels = max_pixels
+        self._keys = []
+        self._inputs = []
+        self._pixels = 0
+
+    def __len__(self):
+        return len(self._inputs)
+
+    def add(self, key, prepared: FingerprintInput) -> list:
+        self._keys.append(key)
+        self._inputs.append(prepared)
+        self._pixels += prepared.wavelet_pixels.size
+        if len(self._inputs) >= self.batch_size or self._pixels >= self.max_pixels:
+            return self.flush()
+        return []
+
+    def flush(self) -> list:
+        if not self._inputs:
+            return []
+        if self.scheduler is not None:
+            with self.scheduler.admit(self._pixels * WAVELET_BYTES_PER_PIXEL):
+                rows = fingerprint_batch(self._inputs)
+        else:
+            rows = fingerprint_batch(self._inputs)
+        finished = [(key, row.tobytes()) for key, row in zip(self._keys, rows)]
+        self._keys, self._inputs, self._pixels = [], [], 0
+        return finished
@@ -0,0 +1,147 @@
+import os
+import time
+
+import numpy as np
+
+from core.archives import file_stat
+from core.storage import read_records, write_records
+
+
+CHECKPOINT_KIND = "scan-checkpoint"
+
+
+def discard_checkpoint(checkpoint_path: str) -> None:
+    """Delete a checkpoint so the next scan of its folder starts afresh."""
+    try:
+        os.remove(checkpoint_path)
+    except FileNotFoundError:
+        pass
+
+
+class ScanCheckpoint:
+    """Progress of one scan, saved to a file so the scan can be resumed.
+
+    The file records the discovered images, the digest, fingerprint or
+    pixel hash of every processed file with the size and modification time it had, and
+    the pair scores of finished comparison blocks. A resumed scan reuses
+    results only for files that are unchanged, and pair scores only when
+    the fingerprints being compared are the same, so it gives the same
+    groups as an uninterrupted scan. Failed files are retried on resume.
+
+    The scan options are recorded too. A checkpoint saved with other
+    options, or one that cannot be read, is ignored and replaced by the
+    next save; ``ignored`` then says why.
+    """
+
+    def __init__(self, checkpoint_path: str, roots: list[str], interval: float = 60.0, options=None):
+        self.checkpoint_path = checkpoint_path
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.interval = interval
+        self.options = dict(options or {})
+        self.ignored = None
+        self.image_files = None
+        self.results = {}
+        self.pair_key = None
+        self.pair_next = 0
+        self.pair_blocks = []
+        self.block_size = None
+        self._saved_at = time.monotonic()
+        if os.path.exists(checkpoint_path):
+            self._load()
+
+    def _load(self):
+        try:
+            header, records = read_records(self.checkpoint_path, CHECKPOINT_KIND)
+        except ValueError as error:
+            self.ignored = f"{error} Starting the scan afresh."
+            return
+        if list(map(os.path.normcase, header["roots"])) != list(map(os.path.normcase, self.roots)):
+            folders = ", ".join(header["roots"])
+            raise ValueError(f"{self.checkpoint_path} is a checkpoint of other folders ({folders}).")
+        if header.get("options", {}) != self.options:
+            self.ignored = (
+                f"{self.checkpoint_path} was saved with other scan options. Starting the scan afresh."
+            )
+            return
+        image_files, results, pair_blocks = [], {}, []
+        try:
+            for record in records:
+                if record[0] == "file":
+                    image_files.append(record[1])
+                elif record[0] == "result":
+                    _, position, size, mtime_ns, digest, packed, pixels = record
+                    results[position] = (size, mtime_ns, digest, packed, pixels)
+                elif record[0] == "pairs":
+                    _, scores, lefts, rights = record
+                    pair_blocks.append(
+                        (np.array(scores, dtype=np.float64), np.array(lefts, dtype=np.int64),
+                         np.array(rights, dtype=np.int64))
+                    )
+        except (OSError, EOFError, ValueError) as error:
+            # A checkpoint cut short, for example by a full disk, is of no use.
+            self.ignored = f"{self.checkpoint_path} is damaged ({error}). Starting the scan afresh."
+            return
+        self.image_files = image_files
+        self.results = results
+        self.pair_blocks = pair_blocks
+        self.pair_key = header["pair_key"]
+        self.pair_next = header["pair_next"]
+        self.block_size = header.get("block_size")
+
+    def restored(self):
+        """Yield ``(position, digest, packed, pixels)`` for recorded files that are unchanged."""
+        for position, (size, mtime_ns, digest, packed, pixels) in sorted(self.results.items()):
+            try:
+                stat = file_stat(self.image_files[position])
+            except OSError:
+                continue
+            if (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns):
+                yield position, digest, packed, pixels
+
+    def record(self, position: int, path: str, digest=None, fingerprint=None, pixels=None) -> None:
+        """Record the digest, fingerprint and pixel hash computed for one file."""
+        try:
+            stat = file_stat(path)
+        except OSError:
+            return
+        packed = fingerprint.pack().hex() if fingerprint is not None else None
+        self.results[position] = (stat.st_size, stat.st_mtime_ns, digest, packed, pixels)
+
+    def resume_pairs(self, pair_key: str):
+        """Return the first block still to compare and the scores of earlier blocks."""
+        if pair_key != self.pair_key:
+            self.pair_key, self.pair_next, self.pair_blocks = pair_key, 0, []
+        return self.pair_next, list(self.pair_blocks)
+
+    def record_pairs(self, next_block: int, scores, lefts, rights) -> None:
+        """Record the pairs of a finished comparison block."""
+        self.pair_blocks.append((scores, lefts, rights))
+        self.pair_next = next_block
+
+    def save_if_due(self) -> None:
+        if time.monotonic() - self._saved_at >= self.interval:
+            self.save()
+
+    def save(self) -> None:
+        if self.image_files is None:
+            return
+        header = {
+            "roots": self.roots,
+            "options": self.options,
+            "pair_key": self.pair_key,
+            "pair_next": self.pair_next,
+            "block_size": self.block_size,
+        }
+        write_records(self.checkpoint_path, CHECKPOINT_KIND, header, self._records())
+        self._saved_at = time.monotonic()
+
+    def _records(self):
+        for path in self.image_files:
+            yield ["file", path]
+        for position, (size, mtime_ns, digest, packed, pixels) in self.results.items():
+            yield ["result", position, size, mtime_ns, digest, packed, pixels]
+        for scores, lefts, rights in self.pair_blocks:
+            yield ["pairs", scores.tolist(), lefts.tolist(), rights.tolist()]
+
+    def discard(self) -> None:
+        discard_checkpoint(self.checkpoint_path)
@@ -0,0 +1,298 @@
+"""Headless command-line interface.
+
+Examples::
+
+    python -m core.cli scan D:\\Photos --similarity 85
+    python -m core.cli scan D:\\Photos --pixels
+    python -m core.cli scan D:\\Photos E:\\Backup\\Photos --similarity 85
+    python -m core.cli scan D:\\Incoming D:\\Archive --similarity 85 --scope cross-folder
+    python -m core.cli scan D:\\Photos --similarity 85 --checkpoint photos.twinstate
+    python -m core.cli scan \\\\nas\\photos --similarity 85 --tuning nas.twintune
+    python -m core.cli scan D:\\Photos --similarity 85 --dry-run
+    python -m core.cli build-index D:\\Archive archive.twinidx
+    python -m core.cli import-digests archived.twindigests archived-sha256.txt
+    python -m core.cli scan D:\\Photos --known archived.twindigests
+    python -m core.cli query archive.twinidx D:\\Incoming --similarity 90
+    python -m core.cli scan-shard D:\\Photos photos-0.twinshard --shard 0/4
+    python -m core.cli merge-shards photos-*.twinshard --similarity 85
+    python -m core.cli serve --index archive.twinidx --port 8765
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+from core.digestset import DigestSet
+from core.index import ReferenceIndex
+from core.scanner import COMPARISON_SCOPES, PROCESSING_ORDERS, ImageScanner, ScanCancelled
+from core.service import DEFAULT_PORT, LookupService, make_server
+from core.shards import merge_shards, scan_shard
+
+
+def _print_groups(duplicates, skipped_files, as_json):
+    if as_json:
+        json.dump({"groups": duplicates, "skipped": skipped_files}, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return
+    for group_id, paths in duplicates.items():
+        print(group_id)
+        for path in paths:
+            print(f"  {path}")
+    if skipped_files:
+        print(f"{len(skipped_files)} unreadable files skipped", file=sys.stderr)
+
+
+def _progress(current, total, path):
+    if current == total or current % 500 == 0:
+        print(f"{current:,} / {total:,}", file=sys.stderr)
+
+
+def _shard_spec(value):
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected INDEX/COUNT, for example 0/4") from None
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError("shard index must be below the shard count")
+    return index, count
+
+
+def _serve(args):
+    if args.folders:
+        service = LookupService.build(
+            args.folders, exact=not args.visual_only, visual=not args.exact_only, index_path=args.index,
+            callback=_progress,
+        )
+        service.modified = True
+    elif args.index:
+        service = LookupService.load(args.index)
+    else:
+        raise ValueError("Give folders to index or an --index to serve.")
+    server = make_server(service, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"Serving {len(service.index):,} images on http://{host}:{port}; Ctrl+C stops", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if service.modified:
+            service.save()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="twinhunter", description="Find duplicate and similar images.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan = commands.add_parser("scan", help="find duplicates within one or more folders")
+    scan.add_argument("folders", nargs="+", metavar="folder")
+    scan.add_argument("--similarity", type=int, default=100)
+    scan.add_argument(
+        "--pixels", action="store_true", help="match identical decoded pixels, ignoring metadata and encoding"
+    )
+    scan.add_argument("--json", action="store_true", help="print results as JSON")
+    scan.add_argument("--matrix", help="keep visual fingerprints in this memory-mapped file and reuse it")
+    scan.add_argument("--metrics", action="store_true", help="print scan metrics such as I/O stalls")
+    scan.add_argument(
+        "--aspect-blocking",
+        action="store_true",
+        help="compare only images of similar aspect ratio; faster, but misses crops and stretched copies",
+    )
+    scan.add_argument(
+        "--coarse-to-fine",
+        action="store_true",
+        help="compare embedded thumbnails or draft decodes first and fully decode only likely matches",
+    )
+    scan.add_argument(
+        "--archives",
+        action="store_true",
+        help="also scan images inside ZIP and TAR archives, reported as archive.zip!/member paths",
+    )
+    scan.add_argument(
+        "--scope",
+        choices=COMPARISON_SCOPES,
+        default="all",
+        help="compare all pairs, only pairs in different folders or roots, or only pairs in the same folder",
+    )
+    scan.add_argument(
+        "--order",
+        choices=PROCESSING_ORDERS,
+        default="discovery",
+        help="order in which files are read; inode or directory order reduces seeking on hard drives",
+    )
+    scan.add_argument(
+        "--checkpoint",
+        help="save progress to this file; press Ctrl+C to pause and run the same command to resume",
+    )
+    scan.add_argument(
+        "--tuning",
+        help="start from the read-ahead and tile settings saved in this file, and save the tuned ones to it",
+    )
+    scan.add_argument(
+        "--no-autotune", action="store_true", help="keep the default read-ahead and tile settings"
+    )
+    scan.add_argument(
+        "--known",
+        action="append",
+        default=[],
+        metavar="SET",
+        help="also report files whose SHA-256 is in this digest set from import-digests; may be repeated",
+    )
+    scan.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="predict the scan's time, memory and pair comparisons from a sample of files, then stop",
+    )
+
+    build = commands.add_parser("build-index", help="index a reference library for later queries")
+    build.add_argument("folder")
+    build.add_argument("index")
+    kinds = build.add_mutually_exclusive_group()
+    kinds.add_argument("--exact-only", action="store_true", help="store digests only")
+    kinds.add_argument("--visual-only", action="store_true", help="store fingerprints only")
+
+    digests = commands.add_parser("import-digests", help="import SHA-256 lists into a set for scan --known")
+    digests.add_argument("output")
+    digests.add_argument("lists", nargs="+", metavar="list", help="text file of digests, optionally sizes")
+    digests.add_argument("--name", help="name shown on matching groups; defaults to the output file name")
+
+    query = commands.add_parser("query", help="match a folder against a reference index")
+    query.add_argument("index")
+    query.add_argument("folder")
+    query.add_argument("--similarity", type=int, default=100)
+    query.add_argument("--json", action="store_true", help="print results as JSON")
+
+    shard = commands.add_parser("scan-shard", help="hash and fingerprint one shard of a folder")
+    shard.add_argument("folder")
+    shard.add_argument("output")
+    shard.add_argument("--shard", type=_shard_spec, default=(0, 1), help="INDEX/COUNT split by path hash")
+    kinds = shard.add_mutually_exclusive_group()
+    kinds.add_argument("--exact-only", action="store_true", help="store digests only")
+    kinds.add_argument("--visual-only", action="store_true", help="store fingerprints only")
+
+    merge = commands.add_parser("merge-shards", help="group the files of several shard files")
+    merge.add_argument("shards", nargs="+")
+    merge.add_argument("--similarity", type=int, default=100)
+    merge.add_argument("--json", action="store_true", help="print results as JSON")
+    merge.add_argument(
+        "--scope",
+        choices=COMPARISON_SCOPES,
+        default="all",
+        help="compare all pairs, only pairs in different folders or roots, or only pairs in the same folder",
+    )
+    merge.add_argument(
+        "--known",
+        action="append",
+        default=[],
+        metavar="SET",
+        help="also report files whose SHA-256 is in this digest set from import-digests; may be repeated",
+    )
+
+    serve = commands.add_parser("serve", help="answer duplicate lookups over HTTP from an in-memory index")
+    serve.add_argument("folders", nargs="*", metavar="folder", help="index these folders on start-up")
+    serve.add_argument("--index", help="serve this reference index and save updates to it on exit")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    kinds = serve.add_mutually_exclusive_group()
+    kinds.add_argument("--exact-only", action="store_true", help="answer byte-identical lookups only")
+    kinds.add_argument("--visual-only", action="store_true", help="answer similar lookups only")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        if args.command == "scan":
+            scanner = ImageScanner()
+            scanner.processing_order = args.order
+            scanner.comparison_scope = args.scope
+            scanner.aspect_blocking = args.aspect_blocking
+            scanner.scan_archives = args.archives
+            scanner.coarse_to_fine = args.coarse_to_fine
+            scanner.autotune = not args.no_autotune
+            scanner.known_digests = [DigestSet.open(set_path) for set_path in args.known]
+            if args.tuning and os.path.exists(args.tuning):
+                with open(args.tuning, encoding="utf-8") as tuning_file:
+                    scanner.apply_tuning(json.load(tuning_file))
+            if args.dry_run:
+                plan = scanner.plan_scan(
+                    args.folders,
+                    similarity=args.similarity,
+                    pixel_identical=args.pixels,
+                    matrix_path=args.matrix,
+                )
+                if args.json:
+                    json.dump(plan.as_dict(), sys.stdout, indent=2)
+                    sys.stdout.write("\n")
+                else:
+                    print("\n".join(plan.describe()))
+                return 0
+            duplicates = scanner.scan_directory(
+                args.folders,
+                _progress,
+                similarity=args.similarity,
+                matrix_path=args.matrix,
+                checkpoint_path=args.checkpoint,
+                pixel_identical=args.pixels,
+            )
+            if "checkpoint_ignored" in scanner.metrics:
+                print(f"warning: {scanner.metrics['checkpoint_ignored']}", file=sys.stderr)
+            _print_groups(duplicates, scanner.skipped_files, args.json)
+            if args.metrics:
+                print(json.dumps(scanner.metrics), file=sys.stderr)
+            if args.tuning:
+                with open(args.tuning, "w", encoding="utf-8") as tuning_file:
+                    json.dump(scanner.tuning(), tuning_file)
+        elif args.command == "build-index":
+            index = ReferenceIndex.build(
+                args.folder, _progress, exact=not args.visual_only, visual=not args.exact_only
+            )
+            index.save(args.index)
+            print(f"Indexed {len(index):,} images ({len(index.skipped_files)} skipped)", file=sys.stderr)
+        elif args.command == "import-digests":
+            digest_set = DigestSet.build(args.output, args.lists, name=args.name)
+            sizes = "with" if digest_set.sizes_known else "without"
+            print(f"Imported {len(digest_set):,} digests {sizes} sizes as {digest_set.name}", file=sys.stderr)
+        elif args.command == "query":
+            index = ReferenceIndex.load(args.index)
+            duplicates = index.query_directory(args.folder, _progress, similarity=args.similarity)
+            _print_groups(duplicates, index.skipped_files, args.json)
+        elif args.command == "scan-shard":
+            shard_index, shard_count = args.shard
+            count = scan_shard(
+                args.folder,
+                args.output,
+                shard_index,
+                shard_count,
+                exact=not args.visual_only,
+                visual=not args.exact_only,
+                callback=_progress,
+            )
+            print(f"Recorded {count:,} images in shard {shard_index}/{shard_count}", file=sys.stderr)
+        elif args.command == "merge-shards":
+            # Expand patterns here because Windows shells pass them through unexpanded.
+            shard_paths = [
+                path for pattern in args.shards for path in sorted(glob.glob(pattern)) or [pattern]
+            ]
+            scanner = ImageScanner()
+            scanner.comparison_scope = args.scope
+            scanner.known_digests = [DigestSet.open(set_path) for set_path in args.known]
+            duplicates = merge_shards(shard_paths, similarity=args.similarity, scanner=scanner)
+            _print_groups(duplicates, scanner.skipped_files, args.json)
+        elif args.command == "serve":
+            _serve(args)
+    except (ValueError, OSError) as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 2
+    except (ScanCancelled, KeyboardInterrupt):
+        if getattr(args, "checkpoint", None):
+            print(f"Paused; progress saved to {args.checkpoint}", file=sys.stderr)
+        return 130
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
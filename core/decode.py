@@ -0,0 +1,314 @@
+import io
+import math
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from PIL import ExifTags, Image, ImageOps, JpegImagePlugin, TiffImagePlugin
+
+
+# Default decode budget shared by every scanner in the process.
+DEFAULT_DECODE_BUDGET = 2 * 1024 ** 3
+
+# Rough bytes per pixel held while normalising and hashing a decoded image:
+# the RGB conversion, an orientation copy and colorhash's HSV and mask arrays.
+WORKING_BYTES_PER_PIXEL = 20
+
+_ORIENTATION_TAG = 0x0112
+_TRANSPOSE_METHODS = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+_PLANAR_CONFIGURATION_TAG = 0x011C
+# Modes Image.reduce() accepts; others are converted to RGB first.
+_REDUCE_MODES = ("L", "RGB", "RGBA", "CMYK", "I", "F")
+# Largest reduction of each side in open_normalized().
+REDUCED_DECODE_SCALE = 64
+# JPEG draft mode scales each side by up to 1/8 while decoding.
+_DRAFT_SCALE = 8
+
+# Requested side of draft decodes in open_preview(); JPEG draft mode decodes
+# at 1/2, 1/4 or 1/8 scale, at least this large.
+PREVIEW_SIDE = 160
+_THUMBNAIL_OFFSET_TAG = 0x0201
+_THUMBNAIL_LENGTH_TAG = 0x0202
+
+
+def _reduced_pixel_limit() -> Optional[int]:
+    """Return the largest image, in pixels, that may be opened for a reduced decode."""
+    if Image.MAX_IMAGE_PIXELS is None:
+        return None
+    # A draft decode holds at most 1/64 of the pixels, which stays within Pillow's own limit.
+    return _DRAFT_SCALE * _DRAFT_SCALE * 2 * Image.MAX_IMAGE_PIXELS
+
+
+def _raw_tiles(image: Image.Image) -> Optional[dict]:
+    """Return ``{offset: byte count}`` for an uncompressed tiled TIFF, or None for any other image.
+
+    Such tiles can be decoded one at a time, so the whole image is never
+    held in memory.
+    """
+    if image.format != "TIFF" or getattr(image, "use_load_libtiff", True) or len(image.tile) < 2:
+        return None
+    tags = image.tag_v2
+    if TiffImagePlugin.TILEOFFSETS not in tags or tags.get(_PLANAR_CONFIGURATION_TAG, 1) != 1:
+        return None
+    return dict(zip(tags[TiffImagePlugin.TILEOFFSETS], tags[TiffImagePlugin.TILEBYTECOUNTS]))
+
+
+def _decodes_reduced(image: Image.Image) -> bool:
+    """Return whether ``image`` can be decoded at reduced size without decoding it in full."""
+    return image.format == "JPEG" or _raw_tiles(image) is not None
+
+
+def _open_header(image_path, reduced: bool = True):
+    """Open an image lazily, reading only its header.
+
+    Pillow rejects very large images before they are decoded. With
+    ``reduced`` such an image is still opened when its format can be decoded
+    at reduced size (JPEG draft mode or an uncompressed tiled TIFF) and the
+    reduced decode stays within Pillow's limit; any other image over the
+    limit raises DecompressionBombError as before. Pillow's limit itself is
+    never changed.
+    """
+    try:
+        return Image.open(image_path)
+    except Image.DecompressionBombError as error:
+        if not reduced:
+            raise
+        limit = _reduced_pixel_limit()
+        # The format plugins are opened directly because they skip Pillow's check.
+        for plugin in (JpegImagePlugin.JpegImageFile, TiffImagePlugin.TiffImageFile):
+            if hasattr(image_path, "seek"):
+                image_path.seek(0)
+            try:
+                image = plugin(image_path)
+            except (SyntaxError, ValueError, OSError):
+                continue
+            if _decodes_reduced(image) and (limit is None or image.width * image.height <= limit):
+                return image
+            image.close()
+        raise error
+
+
+def _reduce_tiles(image: Image.Image, tiles: dict, factor: int) -> Image.Image:
+    """Decode an uncompressed tiled TIFF one tile at a time, reducing each tile by ``factor``."""
+    tile_width = image.tag_v2[TiffImagePlugin.TILEWIDTH]
+    tile_length = image.tag_v2[TiffImagePlugin.TILELENGTH]
+    # Tiles are reduced on their own, so the factor has to divide the tile size.
+    while factor > 1 and (tile_width % factor or tile_length % factor):
+        factor //= 2
+    mode = image.mode if image.mode in _REDUCE_MODES else "RGB"
+    reduced = Image.new(mode, (-(-image.width // factor), -(-image.height // factor)))
+    for codec, (left, top, right, bottom), offset, args in image.tile:
+        tile = Image.new(image.mode, (right - left, bottom - top))
+        image.fp.seek(offset)
+        data = image.fp.read(tiles[offset])
+        if len(data) < tiles[offset]:
+            raise OSError("image file is truncated")
+        decoder = Image._getdecoder(image.mode, codec, args, image.decoderconfig)
+        try:
+            decoder.setimage(tile.im, (0, 0) + tile.size)
+            decoder.decode(data)
+        finally:
+            decoder.cleanup()
+        reduced.paste(tile.convert(mode).reduce(factor), (left // factor, top // factor))
+    return reduced
+
+
+def _embedded_thumbnail(image: Image.Image) -> Optional[Image.Image]:
+    """Return the JPEG thumbnail stored in an image's EXIF data, cropped to the image's shape.
+
+    Cameras letterbox thumbnails whose shape differs from the photo's; the
+    bars are cropped so the thumbnail compares like the photo itself.
+    """
+    exif = image.info.get("exif")
+    if not exif:
+        return None
+    try:
+        thumbnail_tags = image.getexif().get_ifd(ExifTags.IFD.IFD1)
+        start = 6 + int(thumbnail_tags[_THUMBNAIL_OFFSET_TAG])
+        data = exif[start:start + int(thumbnail_tags[_THUMBNAIL_LENGTH_TAG])]
+        thumbnail = Image.open(io.BytesIO(data))
+        thumbnail.load()
+    except (KeyError, TypeError, ValueError, OSError, SyntaxError):
+        return None
+    ratio = image.width / max(1, image.height)
+    width, height = thumbnail.size
+    if width / max(1, height) > ratio:
+        cropped = max(1, round(height * ratio))
+        thumbnail = thumbnail.crop(((width - cropped) // 2, 0, (width + cropped) // 2, height))
+    else:
+        cropped = max(1, round(width / ratio))
+        thumbnail = thumbnail.crop((0, (height - cropped) // 2, width, (height + cropped) // 2))
+    return thumbnail
+
+
+def oriented_size(image_path) -> tuple[int, int]:
+    """Return an image's width and height after camera orientation, from its header alone."""
+    with _open_header(image_path) as image:
+        width, height = image.size
+        if image.getexif().get(_ORIENTATION_TAG) in (5, 6, 7, 8):
+            width, height = height, width
+    return width, height
+
+
+class DecodeScheduler:
+    """Admit image decodes only while they fit in a shared memory budget.
+
+    Each file's header is read first to estimate its decoded footprint.
+    Decodes wait while the images already in flight would push the total
+    over budget. Images that exceed the budget on their own are decoded at
+    reduced size, using JPEG draft mode where available, and run alone.
+    """
+
+    def __init__(self, budget_bytes: int = DEFAULT_DECODE_BUDGET):
+        if budget_bytes <= 0:
+            raise ValueError("The decode budget must be positive.")
+        self.budget_bytes = budget_bytes
+        self.in_flight_bytes = 0
+        self.reduced_decodes = 0
+        self.waits = 0
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def estimate_bytes(size, mode) -> int:
+        """Estimate the peak memory of decoding and fingerprinting one image."""
+        width, height = size
+        pixels = width * height
+        # Pillow stores multi-band and 32-bit images with four bytes per pixel.
+        if mode.startswith("I;16"):
+            decoded = 2
+        elif mode in ("1", "L", "P"):
+            decoded = 1
+        else:
+            decoded = 4
+        # whash resamples to the largest power of two that fits the short side
+        # and keeps float copies of that square during the wavelet transform.
+        scale = 2 ** int(math.log2(max(1, min(width, height))))
+        return pixels * (decoded + WORKING_BYTES_PER_PIXEL) + scale * scale * 17
+
+    @contextmanager
+    def admit(self, estimate: int):
+        """Hold ``estimate`` bytes of the budget while the block runs.
+
+        An estimate above the whole budget waits until nothing else is in
+        flight and then runs alone.
+        """
+        with self._condition:
+            if self.in_flight_bytes and self.in_flight_bytes + estimate > self.budget_bytes:
+                self.waits += 1
+            while self.in_flight_bytes and self.in_flight_bytes + estimate > self.budget_bytes:
+                self._condition.wait()
+            self.in_flight_bytes += estimate
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight_bytes -= estimate
+                self._condition.notify_all()
+
+    def _reduction(self, size, mode) -> int:
+        """Return the smallest power-of-two reduction that fits the budget."""
+        factor = 1
+        while factor < REDUCED_DECODE_SCALE:
+            reduced_size = (size[0] // factor, size[1] // factor)
+            if self.estimate_bytes(reduced_size, mode) <= self.budget_bytes:
+                break
+            factor *= 2
+        return factor
+
+    @contextmanager
+    def open_normalized(self, image_path):
+        """Yield the orientation-corrected RGB image of ``image_path``.
+
+        Images within budget are normalised exactly as before. Oversized
+        JPEGs and uncompressed tiled TIFFs are reduced while decoding, so they
+        get a fingerprint instead of being skipped or exhausting memory; other
+        formats are decoded in full, alone, and reduced afterwards, which
+        Pillow's pixel limit keeps bounded.
+        """
+        with _open_header(image_path) as image:
+            factor = self._reduction(image.size, image.mode)
+            if factor == 1:
+                with self.admit(self.estimate_bytes(image.size, image.mode)):
+                    yield ImageOps.exif_transpose(image).convert("RGB")
+                return
+
+            with self._condition:
+                self.reduced_decodes += 1
+            orientation = image.getexif().get(_ORIENTATION_TAG)
+            target = (max(1, image.width // factor), max(1, image.height // factor))
+            tiles = _raw_tiles(image)
+            if image.format == "JPEG":
+                # Draft mode makes the JPEG decoder itself scale by up to _DRAFT_SCALE.
+                image.draft(image.mode, target)
+            with self.admit(self.budget_bytes):
+                if tiles is not None:
+                    reduced = _reduce_tiles(image, tiles, factor)
+                else:
+                    remaining = max(1, min(image.width // target[0], image.height // target[1]))
+                    if image.mode not in _REDUCE_MODES:
+                        image = image.convert("RGB")
+                    reduced = image.reduce(remaining) if remaining > 1 else image
+                method = _TRANSPOSE_METHODS.get(orientation)
+                if method is not None:
+                    reduced = reduced.transpose(method)
+                yield reduced.convert("RGB")
+
+    @contextmanager
+    def open_preview(self, image_path):
+        """Yield ``(image, kind)``: a small orientation-corrected RGB view of ``image_path``.
+
+        ``kind`` is ``"thumbnail"`` when the EXIF thumbnail embedded in the
+        file is used and ``"draft"`` when a JPEG is decoded at reduced scale.
+        Formats that cannot be decoded partially yield ``"full"`` with
+        exactly the image open_normalized() yields.
+        """
+        with _open_header(image_path) as image:
+            method = _TRANSPOSE_METHODS.get(image.getexif().get(_ORIENTATION_TAG))
+            preview = _embedded_thumbnail(image)
+            kind = "thumbnail"
+            if preview is None and image.format == "JPEG":
+                image.draft("RGB", (PREVIEW_SIDE, PREVIEW_SIDE))
+                preview, kind = image, "draft"
+            if preview is not None:
+                with self.admit(self.estimate_bytes(preview.size, preview.mode)):
+                    if method is not None:
+                        preview = preview.transpose(method)
+                    yield preview.convert("RGB"), kind
+                return
+        if hasattr(image_path, "seek"):
+            image_path.seek(0)
+        with self.open_normalized(image_path) as normalized:
+            yield normalized, "full"
+
+    @contextmanager
+    def open_oriented(self, image_path):
+        """Yield the orientation-corrected image of ``image_path`` at full size.
+
+        Unlike open_normalized() the image is never reduced and keeps its
+        mode, so callers can compare exact pixels. Images above the budget
+        run alone.
+        """
+        with _open_header(image_path, reduced=False) as image:
+            with self.admit(self.estimate_bytes(image.size, image.mode)):
+                yield ImageOps.exif_transpose(image)
+
+
+_default_scheduler: Optional[DecodeScheduler] = None
+_default_scheduler_lock = threading.Lock()
+
+
+def default_scheduler() -> DecodeScheduler:
+    """Return the scheduler shared by scanners that are not given their own."""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = DecodeScheduler()
+        return _default_scheduler
@@ -0,0 +1,196 @@
+import gzip
+import json
+import math
+import os
+import re
+import struct
+from typing import Iterable, Optional
+
+import numpy as np
+
+
+DIGEST_SET_KIND = "digest-set"
+DIGEST_SET_VERSION = 1
+MAGIC = b"TWINDSET"
+DIGEST_BYTES = 32
+# Digests are bucketed by their first two bytes, so a lookup reads one bucket.
+PREFIX_BUCKETS = 1 << 16
+BLOOM_BITS_PER_DIGEST = 10
+# Groups of files matching a digest set are keyed "known:<set name>:<digest>".
+KNOWN_GROUP_PREFIX = "known:"
+
+_SEPARATORS = re.compile(r"[\s,;]+")
+
+
+def known_group_id(set_name: str, digest: str) -> str:
+    return f"{KNOWN_GROUP_PREFIX}{set_name}:{digest}"
+
+
+def known_set_name(group_id: str) -> Optional[str]:
+    """Return the digest set a result group matched, or None for an ordinary group."""
+    if not group_id.startswith(KNOWN_GROUP_PREFIX):
+        return None
+    return group_id[len(KNOWN_GROUP_PREFIX):].rpartition(":")[0]
+
+
+def _bloom_probes(first: int, second: int, bits: int, hashes: int) -> list[int]:
+    # SHA-256 digests are uniform, so their own bytes seed double hashing.
+    first %= bits
+    second %= bits
+    return [(first + probe * second) % bits for probe in range(hashes)]
+
+
+def read_digest_lists(list_paths: Iterable[str]) -> tuple[bytes, list[Optional[int]]]:
+    """Return the digests and sizes listed in text files, ``.gz`` compressed or not.
+
+    Each line holds a hex SHA-256 digest, optionally followed by the file
+    size in bytes, separated by spaces, commas or semicolons; lines such as
+    ``sha256sum`` output give no size. Blank lines and lines starting with
+    ``#`` are ignored.
+    """
+    digests = bytearray()
+    sizes = []
+    for list_path in list_paths:
+        opener = gzip.open if list_path.lower().endswith(".gz") else open
+        with opener(list_path, "rt", encoding="utf-8", errors="replace") as listing:
+            for number, line in enumerate(listing, start=1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                fields = [field.strip("\"'") for field in _SEPARATORS.split(line)]
+                try:
+                    digest = bytes.fromhex(fields[0])
+                except ValueError:
+                    digest = b""
+                if len(digest) != DIGEST_BYTES:
+                    raise ValueError(f"{list_path}, line {number}: {fields[0]!r} is not a SHA-256 digest.")
+                digests += digest
+                sizes.append(int(fields[1]) if len(fields) > 1 and fields[1].isdigit() else None)
+    return bytes(digests), sizes
+
+
+class DigestSet:
+    """A large set of SHA-256 digests kept in one memory-mapped file.
+
+    The file holds a Bloom filter, the digests sorted into buckets by their
+    first two bytes, and the sorted file sizes when every entry came with
+    one. Only the Bloom filter is loaded into memory; a digest it does not
+    rule out is confirmed by reading its bucket, so lookups take constant
+    time however many millions of digests the set holds.
+    """
+
+    def __init__(self, set_path: str, header: dict, bloom, offsets, sizes, digests):
+        self.set_path = set_path
+        self.name = header["name"]
+        self.bloom_hashes = header["bloom_hashes"]
+        self.bloom_bits = header["bloom_bits"]
+        self.bloom = bloom
+        self.offsets = offsets
+        self.sizes = sizes
+        self.digests = digests
+
+    def __len__(self):
+        return len(self.digests)
+
+    @property
+    def sizes_known(self) -> bool:
+        return self.sizes is not None
+
+    def may_contain_size(self, size: int) -> bool:
+        """Return False only if no listed file has ``size`` bytes."""
+        if self.sizes is None:
+            return True
+        position = int(np.searchsorted(self.sizes, size))
+        return position < len(self.sizes) and int(self.sizes[position]) == size
+
+    def __contains__(self, digest) -> bool:
+        data = bytes.fromhex(digest) if isinstance(digest, str) else bytes(digest)
+        if len(data) != DIGEST_BYTES:
+            return False
+        first = int.from_bytes(data[:8], "little")
+        second = int.from_bytes(data[8:16], "little")
+        for bit in _bloom_probes(first, second, self.bloom_bits, self.bloom_hashes):
+            if not self.bloom[bit >> 3] & (1 << (bit & 7)):
+                return False
+        prefix = (data[0] << 8) | data[1]
+        bucket = self.digests[int(self.offsets[prefix]):int(self.offsets[prefix + 1])]
+        return bool((bucket == np.frombuffer(data, dtype=np.uint8)).all(axis=1).any())
+
+    @classmethod
+    def build(cls, set_path: str, list_paths: Iterable[str], name: Optional[str] = None):
+        """Import digest lists (see read_digest_lists()) into a new set at ``set_path``."""
+        digests, sizes = read_digest_lists(list_paths)
+        rows = np.frombuffer(digests, dtype=np.uint8).reshape(-1, DIGEST_BYTES)
+        rows = np.unique(rows.view(f"V{DIGEST_BYTES}").ravel()).view(np.uint8).reshape(-1, DIGEST_BYTES)
+        sizes_known = bool(sizes) and all(size is not None for size in sizes)
+        unique_sizes = np.unique(np.array(sizes, dtype="<i8")) if sizes_known else np.zeros(0, dtype="<i8")
+
+        bloom_bits = max(64, math.ceil(len(rows) * BLOOM_BITS_PER_DIGEST / 64) * 64)
+        bloom_hashes = max(1, round(BLOOM_BITS_PER_DIGEST * math.log(2)))
+        words = rows[:, :16].copy().view("<u8")
+        first, second = words[:, 0] % bloom_bits, words[:, 1] % bloom_bits
+        bits = np.zeros(bloom_bits, dtype=bool)
+        for probe in range(bloom_hashes):
+            bits[(first + probe * second) % bloom_bits] = True
+        bloom = np.packbits(bits, bitorder="little")
+
+        prefixes = (rows[:, 0].astype(np.int64) << 8) | rows[:, 1]
+        offsets = np.searchsorted(prefixes, np.arange(PREFIX_BUCKETS + 1)).astype("<u8")
+
+        header = {
+            "kind": DIGEST_SET_KIND,
+            "version": DIGEST_SET_VERSION,
+            "name": name or os.path.splitext(os.path.basename(set_path))[0],
+            "count": len(rows),
+            "sizes": len(unique_sizes) if sizes_known else None,
+            "bloom_bits": bloom_bits,
+            "bloom_hashes": bloom_hashes,
+        }
+        encoded = json.dumps(header).encode("utf-8")
+        # Sections start on 8-byte boundaries so they can be mapped as arrays.
+        encoded += b" " * (-(len(MAGIC) + 4 + len(encoded)) % 8)
+        temporary_path = f"{set_path}.partial"
+        with open(temporary_path, "wb") as output:
+            output.write(MAGIC + struct.pack("<I", len(encoded)) + encoded)
+            for section in (bloom, offsets, unique_sizes, rows):
+                output.write(section.tobytes())
+        os.replace(temporary_path, set_path)
+        return cls.open(set_path)
+
+    @classmethod
+    def open(cls, set_path: str):
+        with open(set_path, "rb") as source:
+            start = source.read(len(MAGIC) + 4)
+            if len(start) < len(MAGIC) + 4 or not start.startswith(MAGIC):
+                raise ValueError(f"{set_path} is not a TwinHunter {DIGEST_SET_KIND} file.")
+            try:
+                header = json.loads(source.read(struct.unpack("<I", start[len(MAGIC):])[0]))
+            except ValueError as error:
+                raise ValueError(f"{set_path} is not a TwinHunter {DIGEST_SET_KIND} file.") from error
+            offset = source.tell()
+        if not isinstance(header, dict) or header.get("kind") != DIGEST_SET_KIND:
+            raise ValueError(f"{set_path} is not a TwinHunter {DIGEST_SET_KIND} file.")
+        if header.get("version") != DIGEST_SET_VERSION:
+            raise ValueError(f"{set_path} uses unsupported format version {header.get('version')}.")
+
+        sections = []
+        for dtype, shape in (
+            (np.uint8, (header["bloom_bits"] // 8,)),
+            ("<u8", (PREFIX_BUCKETS + 1,)),
+            ("<i8", (header["sizes"] or 0,)),
+            (np.uint8, (header["count"], DIGEST_BYTES)),
+        ):
+            if not math.prod(shape):
+                sections.append(np.zeros(shape, dtype=dtype))
+                continue
+            sections.append(np.memmap(set_path, dtype=dtype, mode="r", offset=offset, shape=shape))
+            offset += sections[-1].nbytes
+        bloom, offsets, sizes, digests = sections
+        if header["sizes"] is None:
+            sizes = None
+        # The Bloom filter answers most lookups, so it is the one section read into memory.
+        return cls(set_path, header, np.array(bloom), offsets, sizes, digests)
+
+    def close(self):
+        # Dropping the memory maps releases the file so it can be replaced on Windows.
+        self.offsets = self.sizes = self.digests = None
@@ -0,0 +1,287 @@
+import itertools
+import os
+from collections import defaultdict
+from typing import Callable, Optional
+
+import numpy as np
+from PIL import Image
+
+from core.archives import file_size
+from core.batch import FingerprintBatcher
+from core.scanner import ImageScanner, VisualFingerprint
+from core.storage import read_records, write_records
+
+
+INDEX_KIND = "reference-index"
+
+
+class ReferenceIndex:
+    """Digest and fingerprint index of a reference library.
+
+    Similar lookups use multi-index hashing. The phash is split into
+    ``CHUNKS`` equal chunks; any image within phash distance ``d`` of a query
+    differs from it by at most ``d // CHUNKS`` bits in at least one chunk, so
+    only those buckets are probed rather than the whole library. Probing is
+    capped at ``MAX_PROBE_RADIUS`` bits per chunk, which covers thresholds
+    down to about 89% similarity; broader thresholds score the query against
+    every fingerprint instead, so lookups are exact at any threshold.
+    """
+
+    CHUNKS = 16
+    MAX_PROBE_RADIUS = 2
+
+    def __init__(self):
+        self.paths = []
+        self.sizes = []
+        self.digests = []
+        self.fingerprints = []
+        self.skipped_files = []
+        self._by_path = {}
+        self._by_digest = defaultdict(list)
+        self._by_size = defaultdict(int)
+        self._tables = [defaultdict(list) for _ in range(self.CHUNKS)]
+        self._probe_masks = {}
+        # Packed fingerprints for broad lookups, rebuilt after the index changes.
+        self._packed = None
+
+    def __len__(self):
+        return len(self._by_path)
+
+    @property
+    def has_digests(self) -> bool:
+        return bool(self._by_digest)
+
+    @property
+    def has_fingerprints(self) -> bool:
+        return any(self._tables)
+
+    def add(
+        self,
+        path: str,
+        size: Optional[int] = None,
+        digest: Optional[str] = None,
+        fingerprint: Optional[VisualFingerprint] = None,
+    ) -> int:
+        """Add one reference image and return its position in the index.
+
+        Adding a path that is already indexed replaces its entry.
+        """
+        self.remove(path)
+        self._packed = None
+        position = len(self.paths)
+        self._by_path[os.path.normcase(path)] = position
+        self.paths.append(path)
+        self.sizes.append(size)
+        self.digests.append(digest)
+        self.fingerprints.append(fingerprint)
+        if size is not None:
+            self._by_size[size] += 1
+        if digest is not None:
+            self._by_digest[digest].append(position)
+        if fingerprint is not None:
+            for table, key in zip(self._tables, self._chunks(fingerprint)):
+                table[key].append(position)
+        return position
+
+    def remove(self, path: str) -> bool:
+        """Remove one reference image; return whether it was indexed.
+
+        The entry's position is left empty so later positions stay valid.
+        """
+        position = self._by_path.pop(os.path.normcase(path), None)
+        if position is None:
+            return False
+        self._packed = None
+        size, digest, fingerprint = self.sizes[position], self.digests[position], self.fingerprints[position]
+        if size is not None:
+            self._by_size[size] -= 1
+            if not self._by_size[size]:
+                del self._by_size[size]
+        buckets = [(self._by_digest, digest)] if digest is not None else []
+        if fingerprint is not None:
+            buckets.extend(zip(self._tables, self._chunks(fingerprint)))
+        for table, key in buckets:
+            table[key].remove(position)
+            if not table[key]:
+                del table[key]
+        for entries in (self.paths, self.sizes, self.digests, self.fingerprints):
+            entries[position] = None
+        return True
+
+    @classmethod
+    def _chunks(cls, fingerprint: VisualFingerprint) -> list[int]:
+        data = np.packbits(fingerprint.phash.hash.ravel()).tobytes()
+        width = len(data) // cls.CHUNKS
+        return [
+            int.from_bytes(data[start:start + width], "big") for start in range(0, len(data), width)
+        ]
+
+    def _masks(self, radius: int, chunk_bits: int) -> list[int]:
+        """Return every XOR mask of ``chunk_bits`` bits with at most ``radius`` bits set."""
+        key = (radius, chunk_bits)
+        if key not in self._probe_masks:
+            masks = []
+            for flipped in range(radius + 1):
+                for bits in itertools.combinations(range(chunk_bits), flipped):
+                    masks.append(sum(1 << bit for bit in bits))
+            self._probe_masks[key] = masks
+        return self._probe_masks[key]
+
+    @classmethod
+    def build(
+        cls,
+        folder_path,
+        callback=None,
+        exact=True,
+        visual=True,
+        cancel_check: Optional[Callable[[], bool]] = None,
+        discovery_callback=None,
+    ):
+        """Index every image below ``folder_path`` for later queries."""
+        if not (exact or visual):
+            raise ValueError("An index needs digests, fingerprints, or both.")
+        index = cls()
+        image_files = ImageScanner._collect_images(folder_path, discovery_callback, cancel_check)
+        entries = []
+        fingerprints = {}
+        batch = FingerprintBatcher()
+        for position, path in enumerate(image_files, start=1):
+            ImageScanner._check_cancelled(cancel_check)
+            if callback:
+                callback(position, len(image_files), path)
+            try:
+                size = file_size(path)
+                digest = ImageScanner.calculate_exact_hash(path) if exact else None
+                prepared = ImageScanner.prepare_fingerprint_input(path) if visual else None
+            except (OSError, ValueError, Image.DecompressionBombError) as error:
+                index.skipped_files.append((path, str(error)))
+                continue
+            entries.append((path, size, digest))
+            if visual:
+                fingerprints.update(batch.add(len(entries) - 1, prepared))
+        fingerprints.update(batch.flush())
+        for entry, (path, size, digest) in enumerate(entries):
+            packed = fingerprints.get(entry)
+            index.add(path, size, digest, VisualFingerprint.unpack(packed) if packed is not None else None)
+        return index
+
+    def save(self, index_path: str) -> None:
+        header = {"count": len(self), "exact": self.has_digests, "visual": self.has_fingerprints}
+        records = (
+            [path, size, digest, fingerprint.pack().hex() if fingerprint is not None else None]
+            for path, size, digest, fingerprint in zip(self.paths, self.sizes, self.digests, self.fingerprints)
+            if path is not None
+        )
+        write_records(index_path, INDEX_KIND, header, records)
+
+    @classmethod
+    def load(cls, index_path: str):
+        _, records = read_records(index_path, INDEX_KIND)
+        index = cls()
+        for path, size, digest, packed in records:
+            fingerprint = VisualFingerprint.unpack(bytes.fromhex(packed)) if packed else None
+            index.add(path, size, digest, fingerprint)
+        return index
+
+    def _check_similarity(self, similarity: float) -> None:
+        if not 0 <= similarity <= 100:
+            raise ValueError("Similarity must be between 0 and 100.")
+        if similarity == 100 and not self.has_digests:
+            raise ValueError("This reference index was built without digests.")
+        if similarity < 100 and not self.has_fingerprints:
+            raise ValueError("This reference index was built without visual fingerprints.")
+
+    def match_exact(self, path: str, digest: Optional[str] = None) -> list[str]:
+        """Return reference files byte-identical to ``path``."""
+        if digest is None:
+            # Only hash query files whose size occurs in the reference library.
+            if not self._by_size.get(file_size(path)):
+                return []
+            digest = ImageScanner.calculate_exact_hash(path)
+        return [self.paths[position] for position in self._by_digest.get(digest, ())]
+
+    def _packed_fingerprints(self) -> tuple[list[int], np.ndarray]:
+        """Return the positions of indexed fingerprints and their packed rows."""
+        if self._packed is None:
+            positions = [position for position, item in enumerate(self.fingerprints) if item is not None]
+            data = b"".join(self.fingerprints[position].pack() for position in positions)
+            rows = np.frombuffer(data, dtype=np.uint8).reshape(len(positions), len(data) // max(1, len(positions)))
+            self._packed = positions, rows
+        return self._packed
+
+    def match_similar(self, fingerprint: VisualFingerprint, similarity: float) -> list[tuple[str, float]]:
+        """Return ``(path, score)`` for reference images at or above ``similarity``."""
+        phash_bits = fingerprint.phash.hash.size
+        chunk_bits = phash_bits // self.CHUNKS
+        max_distance = ImageScanner.max_phash_distance(similarity, phash_bits)
+        radius = min(max_distance // self.CHUNKS, chunk_bits)
+
+        matches = []
+        if radius > self.MAX_PROBE_RADIUS:
+            # Probing this many bits would cost more than scoring every fingerprint.
+            positions, rows = self._packed_fingerprints()
+            query = np.frombuffer(fingerprint.pack(), dtype=np.uint8)[None, :]
+            scores = ImageScanner.similarity_scores(query, rows)[0] if positions else ()
+            for position, score in zip(positions, scores):
+                if score >= similarity:
+                    matches.append((self.paths[position], float(score)))
+        else:
+            candidates = set()
+            for table, key in zip(self._tables, self._chunks(fingerprint)):
+                for mask in self._masks(radius, chunk_bits):
+                    candidates.update(table.get(key ^ mask, ()))
+            for position in sorted(candidates):
+                score = ImageScanner.similarity_score(fingerprint, self.fingerprints[position])
+                if score >= similarity:
+                    matches.append((self.paths[position], score))
+        matches.sort(key=lambda match: -match[1])
+        return matches
+
+    def query_directory(
+        self,
+        folder_path,
+        callback=None,
+        similarity=100,
+        cancel_check: Optional[Callable[[], bool]] = None,
+        discovery_callback=None,
+    ):
+        """Match every image below ``folder_path`` against the reference library.
+
+        Each group starts with the query file followed by its reference
+        matches. ``similarity=100`` uses digests; lower values use fingerprints.
+        """
+        self._check_similarity(similarity)
+        query_files = ImageScanner._collect_images(folder_path, discovery_callback, cancel_check)
+        self.skipped_files = []
+        duplicates = {}
+        batch = FingerprintBatcher()
+
+        def record(path, matches):
+            matches = [match for match in matches if os.path.normcase(match) != os.path.normcase(path)]
+            if matches:
+                duplicates[f"match_{len(duplicates) + 1}"] = [path, *matches]
+
+        def match_batch(finished):
+            # Batches complete in query order, so groups keep their numbering.
+            for path, packed in finished:
+                fingerprint = VisualFingerprint.unpack(packed)
+                record(path, [match for match, _ in self.match_similar(fingerprint, similarity)])
+
+        for position, path in enumerate(query_files, start=1):
+            ImageScanner._check_cancelled(cancel_check)
+            if callback:
+                callback(position, len(query_files), path)
+            try:
+                if similarity == 100:
+                    matches = self.match_exact(path)
+                else:
+                    prepared = ImageScanner.prepare_fingerprint_input(path)
+            except (OSError, ValueError, Image.DecompressionBombError) as error:
+                self.skipped_files.append((path, str(error)))
+                continue
+            if similarity == 100:
+                record(path, matches)
+            else:
+                match_batch(batch.add(path, prepared))
+        match_batch(batch.flush())
+        return duplicates
@@ -0,0 +1,166 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+from core.archives import file_stat
+from core.scanner import VisualFingerprint
+from core.storage import read_records, write_records
+
+
+MATRIX_KIND = "fingerprint-matrix"
+ROW_BYTES = 70
+
+
+def _sidecar_path(matrix_path: str) -> str:
+    return f"{matrix_path}.paths"
+
+
+class FingerprintMatrix:
+    """Packed visual fingerprints in a memory-mapped ``.npy`` file.
+
+    The matrix behaves like the ``(path, fingerprint)`` list of an in-memory
+    scan, but fingerprints stay on disk as packed rows and are read through
+    the page cache. A sidecar file records every row's path and stat
+    signature so later scans can reuse the rows of unchanged files.
+    """
+
+    def __init__(self, matrix_path: str, rows, paths: list[str], signatures: list[tuple[int, int]]):
+        self.matrix_path = matrix_path
+        self.rows = rows
+        self.paths = paths
+        self.signatures = signatures
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        return self.paths[index], VisualFingerprint.unpack(self.rows[index].tobytes())
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @classmethod
+    def open(cls, matrix_path: str):
+        header, records = read_records(_sidecar_path(matrix_path), MATRIX_KIND)
+        paths = []
+        signatures = []
+        for path, size, mtime_ns in records:
+            paths.append(path)
+            signatures.append((size, mtime_ns))
+        rows = np.load(matrix_path, mmap_mode="r")[: header["rows"]]
+        return cls(matrix_path, rows, paths, signatures)
+
+    def close(self):
+        # Dropping the memmap releases the file so it can be replaced on Windows.
+        self.rows = None
+
+
+class FingerprintMatrixWriter:
+    """Append fingerprints to a new matrix, reusing rows from an earlier one.
+
+    Rows are written to a partial file that replaces ``matrix_path`` only
+    when ``finish()`` is called, so an interrupted scan leaves the previous
+    matrix intact.
+    """
+
+    def __init__(self, matrix_path: str, capacity: int):
+        self.matrix_path = matrix_path
+        self.partial_path = f"{matrix_path}.partial"
+        self.previous = None
+        self.previous_rows = {}
+        if os.path.exists(matrix_path) and os.path.exists(_sidecar_path(matrix_path)):
+            try:
+                self.previous = FingerprintMatrix.open(matrix_path)
+            except (OSError, ValueError):
+                self.previous = None
+            else:
+                rows = enumerate(zip(self.previous.paths, self.previous.signatures))
+                self.previous_rows = {path: (signature, row) for row, (path, signature) in rows}
+        self.rows = np.lib.format.open_memmap(
+            self.partial_path, mode="w+", dtype=np.uint8, shape=(max(capacity, 1), ROW_BYTES)
+        )
+        self.paths = []
+        self.signatures = []
+        self._stats = {}
+        self.reused = 0
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        return self.paths[index], VisualFingerprint.unpack(self.rows[index].tobytes())
+
+    @staticmethod
+    def _signature(path: str) -> tuple[int, int]:
+        stat = file_stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def lookup(self, path: str) -> Optional[VisualFingerprint]:
+        """Return the earlier fingerprint of ``path`` if the file is unchanged."""
+        previous = self.previous_rows.get(path)
+        if previous is None:
+            return None
+        signature = self._stats[path] = self._signature(path)
+        if tuple(previous[0]) != signature:
+            return None
+        self.reused += 1
+        return VisualFingerprint.unpack(self.previous.rows[previous[1]].tobytes())
+
+    def append(self, item) -> None:
+        path, fingerprint = item
+        signature = self._stats.pop(path, None) or self._signature(path)
+        self.rows[len(self.paths)] = np.frombuffer(fingerprint.pack(), dtype=np.uint8)
+        self.paths.append(path)
+        self.signatures.append(signature)
+
+    def stage(self, position: int, fingerprint: VisualFingerprint) -> None:
+        """Write a fingerprint at its discovery position before rows are assembled."""
+        self.rows[position] = np.frombuffer(fingerprint.pack(), dtype=np.uint8)
+
+    def append_staged(self, path: str, position: int) -> None:
+        """Append the row staged at ``position``.
+
+        Rows are appended in discovery order and never overtake the staged
+        position being read, so staged rows are compacted in place.
+        """
+        signature = self._stats.pop(path, None) or self._signature(path)
+        self.rows[len(self.paths)] = self.rows[position]
+        self.paths.append(path)
+        self.signatures.append(signature)
+
+    def finish(self) -> FingerprintMatrix:
+        """Move the written rows into place and reopen them read-only."""
+        self.rows.flush()
+        self.rows = None
+        if self.previous is not None:
+            self.previous.close()
+            self.previous = None
+        os.replace(self.partial_path, self.matrix_path)
+        records = ([path, size, mtime_ns] for path, (size, mtime_ns) in zip(self.paths, self.signatures))
+        write_records(_sidecar_path(self.matrix_path), MATRIX_KIND, {"rows": len(self.paths)}, records)
+        return FingerprintMatrix.open(self.matrix_path)
+
+
+class PackedEdges:
+    """Scored pairs held in NumPy arrays, sorted by descending score."""
+
+    def __init__(self, scores=None, lefts=None, rights=None):
+        self.scores = np.empty(0, dtype=np.float64) if scores is None else scores
+        self.lefts = np.empty(0, dtype=np.int64) if lefts is None else lefts
+        self.rights = np.empty(0, dtype=np.int64) if rights is None else rights
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __iter__(self):
+        for score, left, right in zip(self.scores.tolist(), self.lefts.tolist(), self.rights.tolist()):
+            yield score, left, right
+
+    def above(self, similarity, chunk_size=65536):
+        """Yield ``(left, right)`` for every pair scoring at least ``similarity``."""
+        count = int(np.searchsorted(-self.scores, -similarity, side="right"))
+        for start in range(0, count, chunk_size):
+            stop = min(start + chunk_size, count)
+            yield from zip(self.lefts[start:stop].tolist(), self.rights[start:stop].tolist())
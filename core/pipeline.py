@@ -0,0 +1,187 @@
+import threading
+import time
+
+from core.archives import file_size, is_member, read_bytes
+
+
+def _read_error(path, error):
+    # Readers report every failure as OSError so scans skip the file; any
+    # other exception would otherwise leave the consumer waiting forever.
+    if isinstance(error, OSError):
+        return error
+    wrapped = OSError(f"cannot read {path!r}: {type(error).__name__}: {error}")
+    wrapped.__cause__ = error
+    return wrapped
+
+
+class ReadAhead:
+    """Prefetch file contents on reader threads while the caller processes them.
+
+    Files are returned in their original order as ``(path, data, error)``.
+    Reader threads stay at most ``depth`` files and ``max_bytes`` bytes ahead
+    of the consumer. Files larger than ``max_bytes`` are not prefetched and
+    come back with ``data=None`` so the caller streams them from disk. With
+    ``readers=0`` nothing is prefetched. Members of archives (see
+    core.archives) are read like files. A ``tuner`` such as
+    core.autotune.ReadAheadTuner is told about every consumed file and may
+    resize() the readers and depth while files are being read.
+
+    A file that cannot be read comes back with ``data=None`` and an OSError,
+    whatever exception the read raised.
+
+    Time the consumer spends waiting for data means the scan is I/O-bound;
+    time readers spend waiting for buffer space means it is CPU-bound.
+    """
+
+    def __init__(self, paths, readers=2, depth=16, max_bytes=256 * 1024 * 1024, tuner=None):
+        self.paths = list(paths)
+        self.depth = max(1, depth)
+        self.readers = readers if depth > 0 else 0
+        self.max_bytes = max_bytes
+        self.tuner = tuner if self.readers else None
+        self.consumer_wait_seconds = 0.0
+        self.reader_wait_seconds = 0.0
+        self.bytes_read = 0
+        self._condition = threading.Condition()
+        self._results = {}
+        self._next_claim = 0
+        self._consumed = 0
+        self._bytes_in_flight = 0
+        self._closed = False
+        self._started = False
+        self._threads = []
+        self._running = set()
+
+    @property
+    def consumed(self) -> int:
+        return self._consumed
+
+    def __enter__(self):
+        with self._condition:
+            self._started = True
+            threads = self._start_readers()
+        for thread in threads:
+            thread.start()
+        return self
+
+    def _start_readers(self):
+        # Called with the condition held. Readers numbered at or above
+        # self.readers leave on their own; missing ones below it are started.
+        threads = []
+        for number in range(self.readers):
+            if number not in self._running:
+                self._running.add(number)
+                thread = threading.Thread(
+                    target=self._read_loop, args=(number,), name=f"twinhunter-reader-{number}", daemon=True
+                )
+                self._threads.append(thread)
+                threads.append(thread)
+        return threads
+
+    def resize(self, readers, depth):
+        """Change the number of reader threads and how far ahead they read."""
+        if not self.readers:
+            return
+        with self._condition:
+            self.readers = max(1, readers)
+            self.depth = max(1, depth)
+            self._condition.notify_all()
+            threads = self._start_readers() if self._started and not self._closed else []
+        for thread in threads:
+            thread.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        index = self._consumed
+        if index >= len(self.paths):
+            raise StopIteration
+        path = self.paths[index]
+        if not self.readers:
+            self._consumed += 1
+            if is_member(path):
+                # Archive members are read once here rather than by every stage.
+                try:
+                    return path, read_bytes(path), None
+                except Exception as error:
+                    return path, None, _read_error(path, error)
+            return path, None, None
+
+        with self._condition:
+            started = time.perf_counter()
+            while index not in self._results:
+                self._condition.wait()
+            self.consumer_wait_seconds += time.perf_counter() - started
+            data, error, reserved = self._results.pop(index)
+            self._bytes_in_flight -= reserved
+            self._consumed = index + 1
+            self._condition.notify_all()
+        if self.tuner is not None:
+            self.tuner.file_consumed(self)
+        return path, data, error
+
+    def _wait(self, blocked):
+        started = time.perf_counter()
+        while not self._closed and blocked():
+            self._condition.wait()
+        self.reader_wait_seconds += time.perf_counter() - started
+
+    def _read_loop(self, number):
+        while True:
+            with self._condition:
+                self._wait(lambda: number < self.readers and self._next_claim < len(self.paths)
+                           and self._next_claim >= self._consumed + self.depth)
+                if self._closed or number >= self.readers or self._next_claim >= len(self.paths):
+                    self._running.discard(number)
+                    return
+                index = self._next_claim
+                self._next_claim += 1
+
+            path = self.paths[index]
+            data = error = None
+            reserved = 0
+            try:
+                size = file_size(path)
+                if size <= self.max_bytes:
+                    with self._condition:
+                        # The file the consumer needs next may always be read,
+                        # otherwise later files could hold the budget forever.
+                        self._wait(lambda: index != self._consumed
+                                   and self._bytes_in_flight + size > self.max_bytes)
+                        if self._closed:
+                            return
+                        self._bytes_in_flight += size
+                        reserved = size
+                    data = read_bytes(path)
+            except Exception as read_error:
+                error = _read_error(path, read_error)
+
+            with self._condition:
+                self._results[index] = (data, error, reserved)
+                self.bytes_read += len(data) if data is not None else 0
+                self._condition.notify_all()
+
+    def stats(self) -> dict:
+        """Return stall statistics showing whether the scan was I/O- or CPU-bound."""
+        reader_wait = self.reader_wait_seconds / max(1, self.readers)
+        stats = {
+            "read_ahead_bytes": self.bytes_read,
+            "io_wait_seconds": round(self.consumer_wait_seconds, 3),
+            "reader_blocked_seconds": round(reader_wait, 3),
+            "bottleneck": "io" if self.consumer_wait_seconds > reader_wait else "cpu",
+        }
+        if self.tuner is not None:
+            stats.update(self.tuner.stats())
+        return stats
@@ -0,0 +1,266 @@
+import hashlib
+import io
+import os
+import random
+import time
+import tracemalloc
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import numpy as np
+from PIL import Image
+
+from core.archives import file_size, read_bytes
+from core.batch import fingerprint_batch
+from core.matrix import ROW_BYTES
+from core.scanner import EDGE_FLOOR, ImageScanner, VisualFingerprint
+from core.utils import format_duration, format_size
+
+
+# Every format with files gets at least this many samples, if it has them.
+MIN_SAMPLES_PER_FORMAT = 3
+# Bytes of one scored pair while edges are concatenated and sorted.
+EDGE_BYTES = 48
+
+
+@dataclass
+class ScanPlan:
+    """Predicted cost of a scan, measured on a sample of its files.
+
+    ``phase_seconds`` maps each phase (``discovery``, ``hashing``,
+    ``fingerprinting`` or ``pixel hashing``, and ``comparison``) to its
+    predicted wall time; discovery is measured, not predicted. ``formats``
+    maps each file extension to its file count, bytes, samples taken and
+    measured seconds per megabyte.
+    """
+
+    mode: str
+    files: int
+    total_bytes: int
+    sampled_files: int
+    formats: dict = field(default_factory=dict)
+    phase_seconds: dict = field(default_factory=dict)
+    pair_comparisons: int = 0
+    peak_memory_bytes: int = 0
+    notes: list = field(default_factory=list)
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(self.phase_seconds.values())
+
+    def as_dict(self) -> dict:
+        return {
+            "mode": self.mode,
+            "files": self.files,
+            "total_bytes": self.total_bytes,
+            "sampled_files": self.sampled_files,
+            "formats": self.formats,
+            "phase_seconds": {phase: round(seconds, 2) for phase, seconds in self.phase_seconds.items()},
+            "total_seconds": round(self.total_seconds, 2),
+            "pair_comparisons": self.pair_comparisons,
+            "peak_memory_bytes": self.peak_memory_bytes,
+            "notes": self.notes,
+        }
+
+    def describe(self) -> list[str]:
+        """Return the plan as lines of text for the command line and the desktop app."""
+        lines = [
+            f"{self.mode.capitalize()} scan of {self.files:,} images ({format_size(self.total_bytes)}), "
+            f"estimated from {self.sampled_files} sampled files",
+        ]
+        for phase, seconds in self.phase_seconds.items():
+            lines.append(f"  {phase:<15} {format_duration(seconds)}")
+        lines.append(f"  {'total':<15} {format_duration(self.total_seconds)}")
+        if self.pair_comparisons:
+            lines.append(f"Pair comparisons: {self.pair_comparisons:,}")
+        lines.append(f"Peak memory: {format_size(self.peak_memory_bytes)}")
+        lines.extend(self.notes)
+        return lines
+
+
+def _extension(path: str) -> str:
+    return os.path.splitext(path)[1].lower()
+
+
+def _sample(paths_by_format, sample_files, rng):
+    """Pick about ``sample_files`` paths, in proportion to each format's share of the files."""
+    total = sum(len(paths) for paths in paths_by_format.values())
+    sample = []
+    for extension in sorted(paths_by_format):
+        paths = paths_by_format[extension]
+        wanted = max(MIN_SAMPLES_PER_FORMAT, round(sample_files * len(paths) / max(1, total)))
+        sample.extend(rng.sample(paths, min(len(paths), wanted)))
+    return sample
+
+
+def plan_scan(
+    scanner: ImageScanner,
+    folder_path,
+    similarity=100,
+    pixel_identical=False,
+    collapse_exact=True,
+    matrix_path=None,
+    sample_files=32,
+    seed=0,
+    discovery_callback=None,
+    cancel_check=None,
+) -> ScanPlan:
+    """Predict the cost of ``scanner.scan_directory()`` with the same arguments, without running it.
+
+    Files are discovered and stat-ed as the scan would, then a random
+    sample, stratified by format, is read, hashed and decoded to measure
+    per-format rates. Those rates are scaled to every file's size, and the
+    comparison stage is timed on the sample's fingerprints and scaled to
+    the predicted number of pairs.
+    """
+    if not 0 <= similarity <= 100:
+        raise ValueError("Similarity must be between 0 and 100.")
+    if pixel_identical and similarity != 100:
+        raise ValueError("Pixel-identical matching requires a similarity of 100.")
+    started = time.perf_counter()
+    image_files = scanner._collect_images(
+        folder_path, discovery_callback, cancel_check, scanner.scan_archives
+    )
+    sizes = {}
+    for path in image_files:
+        try:
+            sizes[path] = file_size(path)
+        except OSError:
+            continue
+    discovery_seconds = time.perf_counter() - started
+
+    visual = similarity < 100
+    mode = "visual" if visual else "pixel" if pixel_identical else "exact"
+    partitions = scanner.scope_partitions(list(sizes), scanner.scan_roots(folder_path))
+    # Only files sharing their size with another in scope, or with a known digest, are hashed.
+    hashed = scanner._size_candidates(list(sizes), False, scanner.known_digests, partitions)
+    paths_by_format = defaultdict(list)
+    for path in sizes:
+        paths_by_format[_extension(path)].append(path)
+
+    measurements = defaultdict(lambda: {"io": 0.0, "cpu": 0.0, "bytes": 0, "files": 0})
+    ratios = []
+    prepared = []
+    peak_decode = 0
+    for path in _sample(paths_by_format, sample_files, random.Random(seed)):
+        scanner._check_cancelled(cancel_check)
+        measured = measurements[_extension(path)]
+        try:
+            read_started = time.perf_counter()
+            data = read_bytes(path)
+            compute_started = time.perf_counter()
+            hashlib.sha256(data).digest()
+            if visual:
+                prepared.append(scanner.prepare_fingerprint_input(path, scanner.decode_scheduler, data))
+                ratios.append(scanner.aspect_ratio(path, data))
+            elif pixel_identical:
+                scanner.calculate_pixel_hash(path, scanner.decode_scheduler, data)
+            finished = time.perf_counter()
+            if visual or pixel_identical:
+                with Image.open(io.BytesIO(data)) as image:
+                    estimate = scanner.decode_scheduler.estimate_bytes(image.size, image.mode)
+                peak_decode = max(peak_decode, estimate)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            continue
+        measured["io"] += compute_started - read_started
+        measured["cpu"] += finished - compute_started
+        measured["bytes"] += len(data)
+        measured["files"] += 1
+
+    sampled = sum(measured["files"] for measured in measurements.values())
+    overall = {
+        key: sum(measured[key] for measured in measurements.values()) for key in ("io", "cpu", "bytes")
+    }
+    io_seconds = cpu_seconds = 0.0
+    formats = {}
+    for extension, paths in sorted(paths_by_format.items()):
+        measured = measurements[extension] if measurements[extension]["files"] else overall
+        format_bytes = sum(sizes[path] for path in paths)
+        work_bytes = format_bytes
+        if not (visual or pixel_identical):
+            work_bytes = sum(sizes[path] for path in paths if path in hashed)
+        per_byte_io = measured["io"] / max(1, measured["bytes"])
+        per_byte_cpu = measured["cpu"] / max(1, measured["bytes"])
+        io_seconds += work_bytes * per_byte_io
+        cpu_seconds += work_bytes * per_byte_cpu
+        formats[extension] = {
+            "files": len(paths),
+            "bytes": format_bytes,
+            "sampled": measurements[extension]["files"],
+            "seconds_per_mb": round((per_byte_io + per_byte_cpu) * 1024 ** 2, 4),
+        }
+    # With read-ahead, reads overlap decoding and the slower of the two sets the pace.
+    overlapped = scanner.read_ahead_depth > 0 and scanner.read_ahead_threads > 0
+    processing_seconds = max(io_seconds, cpu_seconds) if overlapped else io_seconds + cpu_seconds
+    read_ahead_bytes = 0
+    if overlapped and sampled:
+        mean_bytes = overall["bytes"] // sampled
+        read_ahead_bytes = min(scanner.read_ahead_bytes, scanner.read_ahead_depth * mean_bytes)
+
+    plan = ScanPlan(mode, len(sizes), sum(sizes.values()), sampled, formats)
+    plan.phase_seconds["discovery"] = discovery_seconds
+    if not visual:
+        plan.phase_seconds["pixel hashing" if pixel_identical else "hashing"] = processing_seconds
+        plan.peak_memory_bytes = read_ahead_bytes + min(peak_decode, scanner.decode_scheduler.budget_bytes)
+        return plan
+
+    if prepared:
+        batch_started = time.perf_counter()
+        rows = fingerprint_batch(prepared)
+        processing_seconds += (time.perf_counter() - batch_started) * len(sizes) / len(prepared)
+    else:
+        rows = np.zeros((0, ROW_BYTES), dtype=np.uint8)
+    plan.phase_seconds["fingerprinting"] = processing_seconds
+
+    # Pairs are compared within aspect buckets, so the sample's share of
+    # comparable pairs scales the n * (n - 1) / 2 pairs in scope.
+    files = len(sizes)
+    all_pairs = files * (files - 1) // 2
+    if partitions is not None:
+        counts = np.bincount(np.asarray(partitions, dtype=np.int64))
+        within = int((counts * (counts - 1) // 2).sum())
+        all_pairs = within if scanner.comparison_scope == "within-folder" else all_pairs - within
+    comparable = 1.0
+    if scanner.aspect_blocking and len(ratios) > 1:
+        buckets = np.floor(np.log(np.array(ratios)) / np.log1p(scanner.aspect_tolerance))
+        adjacent = np.abs(buckets[:, None] - buckets[None, :]) <= 1
+        comparable = (adjacent.sum() - len(ratios)) / (len(ratios) * (len(ratios) - 1))
+    plan.pair_comparisons = int(all_pairs * comparable)
+
+    block = min(scanner.comparison_block_size, 256)
+    tile = rows[np.arange(block) % len(rows)] if len(rows) else np.zeros((block, ROW_BYTES), dtype=np.uint8)
+    tile_started = time.perf_counter()
+    scores = scanner.similarity_scores(tile, tile)
+    pairs_per_second = block * block / max(time.perf_counter() - tile_started, 1e-9)
+    plan.phase_seconds["comparison"] = plan.pair_comparisons / pairs_per_second
+
+    # Share of sampled pairs kept as edges for regrouping.
+    floor = similarity if matrix_path else min(EDGE_FLOOR, similarity)
+    kept = 0.0
+    if len(rows) > 1:
+        sample_scores = scores[: len(rows), : len(rows)]
+        kept = (np.count_nonzero(sample_scores >= floor) - len(rows)) / (len(rows) * (len(rows) - 1))
+    edge_bytes = int(plan.pair_comparisons * max(0.0, kept) * EDGE_BYTES)
+    tile_bytes = scanner.comparison_block_size ** 2 * (ROW_BYTES + 8 * 4)
+    fingerprint_bytes = files * ROW_BYTES
+    if not matrix_path and len(rows):
+        # Scans keep one VisualFingerprint object per image in memory.
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        kept_fingerprints = [VisualFingerprint.unpack(row.tobytes()) for row in rows]
+        per_fingerprint = (tracemalloc.get_traced_memory()[0] - baseline) / len(kept_fingerprints)
+        tracemalloc.stop()
+        del kept_fingerprints
+        fingerprint_bytes += int(files * per_fingerprint)
+    fingerprinting_peak = read_ahead_bytes + min(peak_decode, scanner.decode_scheduler.budget_bytes)
+    plan.peak_memory_bytes = fingerprint_bytes + max(fingerprinting_peak, tile_bytes + edge_bytes)
+    if matrix_path:
+        plan.notes.append("Fingerprints stay in the memory-mapped matrix and are not counted in peak memory.")
+    if collapse_exact and hashed:
+        plan.notes.append(
+            f"{len(hashed):,} files share their size with another; identical copies among them are "
+            "fingerprinted and compared once, so the scan may be faster."
+        )
+    if scanner.coarse_to_fine:
+        plan.notes.append("The thumbnail pre-pass is not modelled; every image is counted as fully decoded.")
+    return plan
@@ -1,15 +1,39 @@
 import hashlib
+import io
 import os
+import threading
+from array import array
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import Any, Callable, Optional
 
 import imagehash
-from PIL import Image, ImageOps
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+from core.archives import close_archives, file_size, file_stat, image_source, is_archive, is_member
+from core.archives import list_members, read_bytes, split_member
+from core.batch import FingerprintBatcher
+from core.decode import DecodeScheduler, default_scheduler, oriented_size
+from core.pipeline import ReadAhead
 
 
 IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff", ".webp"}
 
+# Pair scores at or above this floor are kept after a visual scan so the
+# threshold can be lowered to the slider minimum without rescanning.
+EDGE_FLOOR = 70
+
+# Orders in which files can be read. Results always follow discovery order.
+PROCESSING_ORDERS = ("discovery", "inode", "directory")
+
+# Which pairs of files are compared; see ImageScanner.comparison_scope.
+COMPARISON_SCOPES = ("all", "cross-folder", "within-folder")
+
+# Number of set bits in every byte value, used to score packed fingerprints.
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
 
 class ScanCancelled(Exception):
     """Raised when the user cancels a running scan."""
@@ -23,16 +47,98 @@ class VisualFingerprint:
     whash: Any
     colorhash: Any
 
+    # Hash shapes produced by calculate_visual_fingerprint().
+    SHAPES = ((16, 16), (16, 16), (14, 3))
+
+    def pack(self) -> bytes:
+        """Return the fingerprint as 70 bytes for storage in index files."""
+        bits = np.concatenate([self.phash.hash.ravel(), self.whash.hash.ravel(), self.colorhash.hash.ravel()])
+        return np.packbits(bits).tobytes()
+
+    @classmethod
+    def unpack(cls, data: bytes) -> "VisualFingerprint":
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8)).astype(bool)
+        hashes = []
+        offset = 0
+        for shape in cls.SHAPES:
+            size = shape[0] * shape[1]
+            hashes.append(imagehash.ImageHash(bits[offset:offset + size].reshape(shape)))
+            offset += size
+        return cls(*hashes)
+
 
 class ImageScanner:
     """Find byte-identical files or visually similar images."""
 
-    def __init__(self):
+    # Weights of the phash, whash and colorhash similarities in similarity_score().
+    SCORE_WEIGHTS = (0.60, 0.25, 0.15)
+    # Byte range and bit count of each hash in VisualFingerprint.pack().
+    PACKED_SEGMENTS = ((0, 32, 256), (32, 64, 256), (64, 70, 42))
+
+    # Fingerprints compared per tile side in the pairwise stage.
+    comparison_block_size = 512
+    # Order in which files are hashed and fingerprinted; see _processing_order().
+    processing_order = "discovery"
+    # Files read ahead of hashing and decoding; a depth of 0 disables read-ahead.
+    read_ahead_threads = 2
+    read_ahead_depth = 16
+    read_ahead_bytes = 256 * 1024 * 1024
+    # With aspect blocking, visual scans compare only images whose aspect
+    # ratios fall in the same or adjacent buckets; ratios within the tolerance
+    # of each other are always compared. It is faster but misses crops and
+    # stretched copies that change the aspect ratio, so it is opt-in.
+    aspect_blocking = False
+    aspect_tolerance = 0.1
+    # Look inside ZIP and TAR archives and scan their images in place, under
+    # virtual paths such as ``photos.zip!/2019/beach.jpg``; see core.archives.
+    scan_archives = False
+    # Coarse-to-fine visual scans first fingerprint every image from its
+    # embedded EXIF thumbnail or a draft decode and group those at
+    # ``coarse_margin`` points below the threshold; only images left in a
+    # pair are then fully decoded and scored.
+    coarse_to_fine = False
+    coarse_margin = 10
+    # core.digestset.DigestSet objects checked by exact scans. Files whose
+    # digest is in a set are reported in their own ``known:`` groups, and
+    # files whose size no set lists are not hashed for them.
+    known_digests = ()
+    # Compare ``"all"`` pairs, only pairs ``"cross-folder"`` (in different
+    # roots, or different top-level folders of a single root), or only pairs
+    # ``"within-folder"`` (in the same folder). Out-of-scope pairs are never
+    # compared, and identical copies are grouped only within the scope.
+    comparison_scope = "all"
+    # Images fingerprinted together by core.batch.fingerprint_batch().
+    fingerprint_batch_size = 64
+    # Seconds between checkpoint saves when scan_directory() is given a checkpoint path.
+    checkpoint_interval = 60.0
+    # Measure each scan and adjust the read-ahead threads and depth and the
+    # comparison tile size to the disk and CPU; see core.autotune.
+    autotune = False
+
+    def __init__(self, decode_scheduler: Optional[DecodeScheduler] = None):
+        # Shared by default so concurrent scans stay within one decode budget.
+        self.decode_scheduler = decode_scheduler or default_scheduler()
         self.duplicates = {}
         self.skipped_files = []
+        self.metrics = {}
+        # Retained from the last visual scan for regroup() and pair_score().
+        self.fingerprints = []
+        self.representatives = []
+        self.edges = []
+        self.edge_floor = None
+        # The scope of the last visual scan and each fingerprint's folder label in it.
+        self.partition_scope = "all"
+        self.partitions = None
+        self._edge_scores = None
+        self._fingerprint_index = None
 
     @staticmethod
-    def calculate_exact_hash(image_path: str) -> str:
+    def calculate_exact_hash(image_path: str, data: Optional[bytes] = None) -> str:
+        """Return the SHA-256 of a file, or of ``data`` already read from it."""
+        if data is None and is_member(image_path):
+            data = read_bytes(image_path)
+        if data is not None:
+            return hashlib.sha256(data).hexdigest()
         digest = hashlib.sha256()
         with open(image_path, "rb") as image_file:
             for chunk in iter(lambda: image_file.read(1024 * 1024), b""):
@@ -40,15 +146,77 @@ class ImageScanner:
         return digest.hexdigest()
 
     @staticmethod
-    def calculate_visual_fingerprint(image_path: str) -> VisualFingerprint:
-        with Image.open(image_path) as image:
+    def calculate_visual_fingerprint(
+        image_path: str, scheduler=None, data: Optional[bytes] = None
+    ) -> VisualFingerprint:
+        """Fingerprint one image, decoding it within the scheduler's memory budget.
+
+        ``data`` holds the file contents when they were already read ahead.
+        Images too large for the budget are fingerprinted from a reduced decode.
+        """
+        scheduler = scheduler or default_scheduler()
+        source = io.BytesIO(data) if data is not None else image_source(image_path)
+        try:
             # Apply camera orientation and ignore animation frames after the first.
-            normalized = ImageOps.exif_transpose(image).convert("RGB")
-            return VisualFingerprint(
-                phash=imagehash.phash(normalized, hash_size=16),
-                whash=imagehash.whash(normalized, hash_size=16),
-                colorhash=imagehash.colorhash(normalized, binbits=3),
-            )
+            with scheduler.open_normalized(source) as normalized:
+                return VisualFingerprint(
+                    phash=imagehash.phash(normalized, hash_size=16),
+                    whash=imagehash.whash(normalized, hash_size=16),
+                    colorhash=imagehash.colorhash(normalized, binbits=3),
+                )
+        except UnidentifiedImageError:
+            if source is image_path:
+                raise
+            # Report the file rather than the in-memory buffer it was read into.
+            raise UnidentifiedImageError(f"cannot identify image file {image_path!r}") from None
+
+    @staticmethod
+    def prepare_fingerprint_input(image_path: str, scheduler=None, data: Optional[bytes] = None):
+        """Decode one image and reduce it to the buffers core.batch.fingerprint_batch() hashes.
+
+        Fingerprints computed in batches have the same bits as
+        calculate_visual_fingerprint(); only the reduced buffers outlive the
+        decode, so a batch holds little memory.
+        """
+        from core.batch import reduce_image
+
+        scheduler = scheduler or default_scheduler()
+        source = io.BytesIO(data) if data is not None else image_source(image_path)
+        try:
+            with scheduler.open_normalized(source) as normalized:
+                return reduce_image(normalized)
+        except UnidentifiedImageError:
+            if source is image_path:
+                raise
+            raise UnidentifiedImageError(f"cannot identify image file {image_path!r}") from None
+
+    @staticmethod
+    def calculate_pixel_hash(image_path: str, scheduler=None, data: Optional[bytes] = None) -> str:
+        """Return the SHA-256 of an image's orientation-corrected pixels.
+
+        The dimensions and mode are hashed with the pixels, so files that
+        differ only in metadata or in lossless encoding share a hash. Palette
+        images are hashed as colours so palette order does not matter.
+        """
+        scheduler = scheduler or default_scheduler()
+        source = io.BytesIO(data) if data is not None else image_source(image_path)
+        try:
+            with scheduler.open_oriented(source) as image:
+                if image.mode == "P":
+                    image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+                digest = hashlib.sha256(f"{image.mode}:{image.width}x{image.height}:".encode("ascii"))
+                digest.update(image.tobytes())
+                return digest.hexdigest()
+        except UnidentifiedImageError:
+            if source is image_path:
+                raise
+            raise UnidentifiedImageError(f"cannot identify image file {image_path!r}") from None
+
+    @staticmethod
+    def aspect_ratio(image_path: str, data: Optional[bytes] = None) -> float:
+        """Return width / height after camera orientation, read from the image header."""
+        width, height = oriented_size(io.BytesIO(data) if data is not None else image_source(image_path))
+        return width / max(1, height)
 
     @staticmethod
     def similarity_score(left: VisualFingerprint, right: VisualFingerprint) -> float:
@@ -60,28 +228,188 @@ class ImageScanner:
         phash_similarity = 1.0 - (left.phash - right.phash) / left.phash.hash.size
         whash_similarity = 1.0 - (left.whash - right.whash) / left.whash.hash.size
         color_similarity = 1.0 - (left.colorhash - right.colorhash) / left.colorhash.hash.size
-        score = (0.60 * phash_similarity) + (0.25 * whash_similarity) + (0.15 * color_similarity)
+        phash_weight, whash_weight, color_weight = ImageScanner.SCORE_WEIGHTS
+        score = (
+            (phash_weight * phash_similarity)
+            + (whash_weight * whash_similarity)
+            + (color_weight * color_similarity)
+        )
         return max(0.0, min(100.0, score * 100.0))
 
+    @staticmethod
+    def similarity_scores(left_rows, right_rows):
+        """Return similarity_score() for every pair of two blocks of packed fingerprints.
+
+        Rows are ``VisualFingerprint.pack()`` bytes; the result has one row per
+        left fingerprint and one column per right fingerprint.
+        """
+        different = left_rows[:, None, :] ^ right_rows[None, :, :]
+        score = None
+        for weight, (start, stop, bits) in zip(ImageScanner.SCORE_WEIGHTS, ImageScanner.PACKED_SEGMENTS):
+            distance = _POPCOUNT[different[:, :, start:stop]].sum(axis=2, dtype=np.int64)
+            term = weight * (1.0 - distance / bits)
+            score = term if score is None else score + term
+        return np.clip(score * 100.0, 0.0, 100.0)
+
+    @staticmethod
+    def max_phash_distance(similarity: float, phash_bits: int = 256) -> int:
+        """Return the largest phash distance that can still reach ``similarity``.
+
+        This assumes perfect wavelet and colour agreement, so it is a safe
+        bound for candidate lookups that are verified with similarity_score().
+        """
+        phash_weight = ImageScanner.SCORE_WEIGHTS[0]
+        required = (similarity / 100.0 - (1.0 - phash_weight)) / phash_weight
+        return max(0, min(phash_bits, int(phash_bits * (1.0 - required) + 1e-9)))
+
+    @staticmethod
+    def scan_roots(folder_paths) -> list[str]:
+        """Return the folders to scan, without duplicates or folders inside another root.
+
+        ``folder_paths`` is one folder or a list of them. Roots are compared
+        by their resolved paths, so a symlink to a folder already being
+        scanned is dropped as well.
+        """
+        if isinstance(folder_paths, (str, os.PathLike)):
+            folder_paths = [folder_paths]
+        roots = []
+        for folder_path in folder_paths:
+            if not os.path.isdir(folder_path):
+                if len(folder_paths) == 1:
+                    raise ValueError("The selected folder no longer exists or is not accessible.")
+                raise ValueError(f"The folder {folder_path} no longer exists or is not accessible.")
+            roots.append((os.fspath(folder_path), os.path.normcase(os.path.realpath(folder_path))))
+
+        def inside(path, parent):
+            try:
+                return os.path.commonpath([path, parent]) == parent
+            except ValueError:
+                # Paths on different drives share no common path.
+                return False
+
+        kept = []
+        for index, (root, resolved) in enumerate(roots):
+            if any(
+                inside(resolved, other) and (resolved != other or other_index < index)
+                for other_index, (_, other) in enumerate(roots)
+                if other_index != index
+            ):
+                continue
+            kept.append(root)
+        if not kept:
+            raise ValueError("Select at least one folder to scan.")
+        return kept
+
     @staticmethod
     def _collect_images(
-        folder_path: str,
+        folder_path,
         discovery_callback=None,
         cancel_check=None,
+        archives=False,
     ) -> list[str]:
-        if not os.path.isdir(folder_path):
-            raise ValueError("The selected folder no longer exists or is not accessible.")
-
-        image_files = []
-        for root, dirs, files in os.walk(folder_path):
-            ImageScanner._check_cancelled(cancel_check)
-            dirs.sort(key=str.casefold)
-            for filename in sorted(files, key=str.casefold):
-                if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
-                    image_files.append(os.path.join(root, filename))
-            if discovery_callback:
-                discovery_callback(len(image_files), root)
-        return image_files
+        """List the images below one or more folders in discovery order.
+
+        Several roots are walked concurrently and listed in the order given.
+        Paths that reach a file already listed, through a symlink or, across
+        roots, a hardlink, are left out so each file is scanned once. With
+        ``archives`` the images inside ZIP and TAR archives are listed in
+        archive order, in place of the archive; archives that cannot be read
+        are left out.
+        """
+        roots = ImageScanner.scan_roots(folder_path)
+        found = 0
+        lock = threading.Lock()
+
+        def identity(entry, member=None):
+            # Across roots a file is identified by its inode, which the walk
+            # reads as it goes; within one root only symlinks can repeat a
+            # file, and they are resolved to the path they point to.
+            try:
+                if len(roots) > 1:
+                    stat = os.stat(entry.path) if os.name == "nt" else entry.stat()
+                    # Some file systems report no inode numbers; their files are kept.
+                    return (stat.st_dev, stat.st_ino, member) if stat.st_ino else None
+                if entry.is_symlink():
+                    return (os.path.normcase(os.path.realpath(entry.path)), member)
+            except OSError:
+                return None
+            return False
+
+        def walk(root):
+            nonlocal found
+            listed_files = []
+            pending = [root]
+            while pending:
+                folder = pending.pop()
+                ImageScanner._check_cancelled(cancel_check)
+                try:
+                    with os.scandir(folder) as scanned:
+                        entries = sorted(scanned, key=lambda entry: entry.name.casefold())
+                except OSError:
+                    continue
+                subfolders = []
+                listed = len(listed_files)
+                for entry in entries:
+                    try:
+                        is_folder = entry.is_dir()
+                    except OSError:
+                        is_folder = False
+                    if is_folder:
+                        # Symlinked folders are not followed.
+                        if not entry.is_symlink():
+                            subfolders.append(entry.path)
+                        continue
+                    if os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                        listed_files.append((entry.path, identity(entry)))
+                    elif archives and is_archive(entry.name):
+                        try:
+                            members = list_members(entry.path)
+                        except OSError:
+                            continue
+                        listed_files.extend(
+                            (member, identity(entry, split_member(member)[1]))
+                            for member in members
+                            if os.path.splitext(member)[1].lower() in IMAGE_EXTENSIONS
+                        )
+                    if len(roots) > 1:
+                        ImageScanner._check_cancelled(cancel_check)
+                # Subfolders are walked depth first in name order, as os.walk does.
+                pending.extend(reversed(subfolders))
+                with lock:
+                    found += len(listed_files) - listed
+                    if discovery_callback:
+                        discovery_callback(found, folder)
+            return listed_files
+
+        if len(roots) == 1:
+            listed_files = walk(roots[0])
+        else:
+            with ThreadPoolExecutor(len(roots), thread_name_prefix="twinhunter-discovery") as pool:
+                listed_files = [item for listed in pool.map(walk, roots) for item in listed]
+
+        if len(roots) == 1:
+            if not any(key for _, key in listed_files):
+                return [path for path, _ in listed_files]
+            # Symlinks are dropped when the file they point to is listed, or an earlier symlink to it.
+            real_root = os.path.realpath(roots[0])
+            seen = set()
+            for path, key in listed_files:
+                if key is False:
+                    archive_path, member = split_member(path)
+                    real_path = os.path.join(real_root, os.path.relpath(archive_path, roots[0]))
+                    seen.add((os.path.normcase(real_path), member))
+            listed_files = [(path, key or None) for path, key in listed_files]
+        else:
+            seen = set()
+
+        unique_files = []
+        for path, key in listed_files:
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            unique_files.append(path)
+        return unique_files
 
     @staticmethod
     def _check_cancelled(cancel_check: Optional[Callable[[], bool]]) -> None:
@@ -95,57 +423,869 @@ class ImageScanner:
         similarity=100,
         cancel_check=None,
         discovery_callback=None,
+        collapse_exact=True,
+        matrix_path=None,
+        checkpoint_path=None,
+        pixel_identical=False,
     ):
-        """Scan a folder recursively.
+        """Scan one folder, or a list of folders as one set, recursively.
+
+        ``similarity=100`` uses SHA-256 and returns only byte-identical files,
+        plus a group per digest of ``known_digests`` found among the files.
+        With ``pixel_identical`` it instead groups files whose decoded pixels
+        are identical, such as copies with rewritten metadata or lossless
+        re-saves. Lower values use visual fingerprints; 85 is a useful
+        balanced default.
+        With ``collapse_exact`` visual scans fingerprint one file per set of
+        byte-identical copies. ``matrix_path`` keeps packed fingerprints in a
+        memory-mapped file instead of RAM and reuses the rows of unchanged
+        files from an earlier scan; only pairs at or above ``similarity`` are
+        then kept, so regroup() can raise but not lower the threshold.
 
-        ``similarity=100`` uses SHA-256 and returns only byte-identical files.
-        Lower values use visual fingerprints; 85 is a useful balanced default.
+        ``checkpoint_path`` saves progress every ``checkpoint_interval``
+        seconds and when the scan is cancelled or fails. Scanning the same
+        folder with the same path and options resumes from it; it is removed
+        once the scan completes. A checkpoint saved with other options, or one
+        that cannot be read, is ignored and the reason is recorded in
+        ``metrics["checkpoint_ignored"]``.
         """
         if not 0 <= similarity <= 100:
             raise ValueError("Similarity must be between 0 and 100.")
+        if pixel_identical and similarity != 100:
+            raise ValueError("Pixel-identical matching requires a similarity of 100.")
+        if self.comparison_scope not in COMPARISON_SCOPES:
+            raise ValueError(f"Unknown comparison scope {self.comparison_scope!r}.")
 
-        image_files = self._collect_images(folder_path, discovery_callback, cancel_check)
-        total_files = len(image_files)
+        checkpoint = None
+        if checkpoint_path:
+            from core.checkpoint import ScanCheckpoint
+
+            roots = self.scan_roots(folder_path)
+            options = self._checkpoint_options(similarity, pixel_identical, collapse_exact)
+            checkpoint = ScanCheckpoint(checkpoint_path, roots, self.checkpoint_interval, options)
+        if checkpoint is not None and checkpoint.image_files is not None:
+            # Resumed scans keep the file list discovered by the interrupted run.
+            image_files = checkpoint.image_files
+        else:
+            image_files = self._collect_images(
+                folder_path, discovery_callback, cancel_check, self.scan_archives
+            )
+            if checkpoint is not None:
+                checkpoint.image_files = image_files
         self.skipped_files = []
-        self._check_cancelled(cancel_check)
+        self.metrics = {}
+        if checkpoint is not None and checkpoint.ignored:
+            self.metrics["checkpoint_ignored"] = checkpoint.ignored
+        self.clear_visual_state()
+        partitions = self.scope_partitions(image_files, self.scan_roots(folder_path))
+        try:
+            self._check_cancelled(cancel_check)
+            if pixel_identical:
+                duplicates = self._scan_pixels(image_files, callback, cancel_check, checkpoint, partitions)
+            elif similarity == 100:
+                duplicates = self._scan_exact(image_files, callback, cancel_check, checkpoint, partitions)
+            else:
+                duplicates = self._scan_visual(
+                    image_files,
+                    callback,
+                    similarity,
+                    cancel_check,
+                    collapse_exact,
+                    matrix_path,
+                    checkpoint,
+                    partitions,
+                )
+        except BaseException:
+            # Pausing is cancelling with a checkpoint; it is also kept on errors.
+            if checkpoint is not None:
+                checkpoint.save()
+            raise
+        finally:
+            close_archives()
+        if checkpoint is not None:
+            checkpoint.discard()
+        if self.autotune:
+            self.metrics["tuning"] = self.tuning()
+        return duplicates
+
+    def _checkpoint_options(self, similarity, pixel_identical, collapse_exact) -> dict:
+        """Return the options a checkpoint must have been saved with to be resumed."""
+        return {
+            "similarity": similarity,
+            "pixel_identical": pixel_identical,
+            "collapse_exact": collapse_exact,
+            "archives": self.scan_archives,
+            "comparison_scope": self.comparison_scope,
+            "aspect_blocking": self.aspect_blocking,
+            "coarse_to_fine": self.coarse_to_fine,
+            "known_digests": [os.path.abspath(digest_set.set_path) for digest_set in self.known_digests],
+        }
+
+    def plan_scan(
+        self,
+        folder_path,
+        similarity=100,
+        pixel_identical=False,
+        collapse_exact=True,
+        matrix_path=None,
+        sample_files=32,
+        discovery_callback=None,
+        cancel_check=None,
+    ):
+        """Predict the phase times, pair comparisons and peak memory of scan_directory().
+
+        Files are discovered and a small sample is measured; nothing else is
+        read. Returns a core.planner.ScanPlan.
+        """
+        from core.planner import plan_scan
+
+        try:
+            return plan_scan(
+                self,
+                folder_path,
+                similarity,
+                pixel_identical,
+                collapse_exact,
+                matrix_path,
+                sample_files,
+                discovery_callback=discovery_callback,
+                cancel_check=cancel_check,
+            )
+        finally:
+            close_archives()
+
+    def tuning(self) -> dict:
+        """Return the read-ahead and tile settings, to pass to apply_tuning() on a later scan."""
+        from core.autotune import TUNED_SETTINGS
+
+        return {name: getattr(self, name) for name in TUNED_SETTINGS}
+
+    def apply_tuning(self, tuning: dict) -> None:
+        """Start from settings an earlier autotuned scan recorded in ``metrics["tuning"]``."""
+        from core.autotune import TUNED_SETTINGS
 
-        if similarity == 100:
-            # Size is a cheap pre-filter. Only same-sized files can be byte-identical.
-            files_by_size = defaultdict(list)
-            for path in image_files:
+        for name in TUNED_SETTINGS:
+            if name in tuning:
+                value = int(tuning[name])
+                # A read-ahead depth or thread count of 0 disables read-ahead; tiles need a side.
+                minimum = 1 if name == "comparison_block_size" else 0
+                if value < minimum:
+                    raise ValueError(f"Tuned setting {name} must be at least {minimum}.")
+                setattr(self, name, value)
+
+    def _scan_exact(self, image_files, callback, cancel_check, checkpoint, partitions=None):
+        candidates = self._size_candidates(image_files, True, self.known_digests, partitions)
+        positions = [position for position, path in enumerate(image_files) if path in candidates]
+        digests = {}
+        failures = {}
+        if checkpoint is not None:
+            wanted = set(positions)
+            for position, digest, _, _ in checkpoint.restored():
+                if position in wanted and digest is not None:
+                    digests[position] = digest
+            positions = [position for position in positions if position not in digests]
+            self.metrics["resumed_files"] = len(digests)
+        candidate_files = [image_files[position] for position in positions]
+        order = [positions[index] for index in self._processing_order(candidate_files)]
+        with self._read_ahead([image_files[position] for position in order]) as contents:
+            for count, (position, (path, data, read_error)) in enumerate(zip(order, contents), start=1):
+                self._check_cancelled(cancel_check)
+                if callback:
+                    callback(count, len(order), path)
                 try:
-                    files_by_size[os.path.getsize(path)].append(path)
+                    if read_error:
+                        raise read_error
+                    digests[position] = self.calculate_exact_hash(path, data)
                 except OSError as error:
-                    self.skipped_files.append((path, str(error)))
+                    failures[position] = str(error)
+                    continue
+                if checkpoint is not None:
+                    checkpoint.record(position, path, digests[position])
+                    checkpoint.save_if_due()
+        self._record_read_ahead(contents)
+        # Results are assembled in discovery order whatever order files were read in.
+        for position in sorted(failures):
+            self.skipped_files.append((image_files[position], failures[position]))
+        hashed = ((image_files[position], digests[position]) for position in sorted(digests))
+        duplicates = self._scope_groups(self.group_digests(hashed), image_files, partitions)
+        if self.known_digests:
+            duplicates.update(self._known_groups(image_files, digests))
+        return duplicates
 
-            candidates = {path for paths in files_by_size.values() if len(paths) > 1 for path in paths}
-            hashes = defaultdict(list)
-            for index, path in enumerate(image_files, start=1):
+    def _known_groups(self, image_files, digests):
+        """Group hashed files by the known digest sets and digests they match."""
+        from core.digestset import known_group_id
+
+        groups = defaultdict(list)
+        for position in sorted(digests):
+            for digest_set in self.known_digests:
+                if digests[position] in digest_set:
+                    groups[known_group_id(digest_set.name, digests[position])].append(image_files[position])
+        self.metrics["known_matches"] = sum(len(paths) for paths in groups.values())
+        return dict(groups)
+
+    def _scan_pixels(self, image_files, callback, cancel_check, checkpoint, partitions=None):
+        # Byte-identical copies have identical pixels, so each set is decoded once.
+        candidates = self._size_candidates(image_files, report_errors=False)
+        pixel_hashes = {}
+        failures = {}
+        pixels_by_digest = {}
+        copies = 0
+        pending = list(range(len(image_files)))
+        if checkpoint is not None:
+            for position, digest, _, pixels in checkpoint.restored():
+                if pixels is not None:
+                    pixel_hashes[position] = pixels
+                    if digest is not None:
+                        pixels_by_digest.setdefault(digest, pixels)
+            pending = [position for position in pending if position not in pixel_hashes]
+            self.metrics["resumed_files"] = len(pixel_hashes)
+        pending_files = [image_files[position] for position in pending]
+        order = [pending[index] for index in self._processing_order(pending_files)]
+        with self._read_ahead([image_files[position] for position in order]) as contents:
+            for count, (position, (path, data, read_error)) in enumerate(zip(order, contents), start=1):
                 self._check_cancelled(cancel_check)
                 if callback:
-                    callback(index, total_files, path)
-                if path not in candidates:
+                    callback(len(image_files) - len(order) + count, len(image_files), path)
+                try:
+                    if read_error:
+                        raise read_error
+                    digest = self.calculate_exact_hash(path, data) if path in candidates else None
+                    pixels = pixels_by_digest.get(digest) if digest is not None else None
+                    if pixels is None:
+                        pixels = self.calculate_pixel_hash(path, self.decode_scheduler, data)
+                    else:
+                        copies += 1
+                except (OSError, ValueError, Image.DecompressionBombError) as error:
+                    failures[position] = str(error)
+                    continue
+                pixel_hashes[position] = pixels
+                if digest is not None:
+                    pixels_by_digest[digest] = pixels
+                if checkpoint is not None:
+                    checkpoint.record(position, path, digest, pixels=pixels)
+                    checkpoint.save_if_due()
+        self._record_read_ahead(contents)
+        self.metrics["identical_copies"] = copies
+        for position in sorted(failures):
+            self.skipped_files.append((image_files[position], failures[position]))
+        hashed = ((image_files[position], pixel_hashes[position]) for position in sorted(pixel_hashes))
+        return self._scope_groups(self.group_digests(hashed), image_files, partitions)
+
+    def _scan_visual(
+        self,
+        image_files,
+        callback,
+        similarity,
+        cancel_check,
+        collapse_exact,
+        matrix_path,
+        checkpoint,
+        partitions=None,
+    ):
+        total_files = len(image_files)
+        # Byte-identical copies share the fingerprint of the first copy, so each
+        # identical set is decoded and compared once and expanded when grouping.
+        candidates = self._size_candidates(image_files, report_errors=False) if collapse_exact else set()
+        if matrix_path:
+            from core.matrix import FingerprintMatrixWriter
+
+            fingerprints = FingerprintMatrixWriter(matrix_path, total_files)
+        else:
+            fingerprints = []
+            staged = [None] * total_files
+        digests = {}
+        failures = {}
+        decoded_by_digest = {}
+        aspects = {}
+        pending = list(range(total_files))
+        restored = {}
+        if checkpoint is not None:
+            copies = {}
+            for position, digest, packed, _ in checkpoint.restored():
+                if digest is None and image_files[position] in candidates:
+                    continue
+                if packed is None:
+                    copies[position] = digest
                     continue
+                if self.aspect_blocking:
+                    try:
+                        aspects[position] = self.aspect_ratio(image_files[position])
+                    except (OSError, ValueError, Image.DecompressionBombError):
+                        continue
+                fingerprint = VisualFingerprint.unpack(bytes.fromhex(packed))
+                if matrix_path:
+                    fingerprints.stage(position, fingerprint)
+                else:
+                    staged[position] = fingerprint
+                restored[position] = bytes.fromhex(packed)
+                digests[position] = digest
+                if digest is not None:
+                    decoded_by_digest.setdefault(digest, position)
+            # Copies are only resumable when a file with their content was fingerprinted.
+            digests.update(
+                (position, digest) for position, digest in copies.items() if digest in decoded_by_digest
+            )
+            for position, digest in copies.items():
+                if position in digests:
+                    restored[position] = restored[decoded_by_digest[digest]]
+            pending = [position for position in pending if position not in digests]
+            self.metrics["resumed_files"] = len(digests)
+        reduced_before = self.decode_scheduler.reduced_decodes
+        shortlist, decoded = None, {}
+        if self.coarse_to_fine:
+            shortlist, decoded = self._coarse_pass(
+                image_files, restored, aspects, similarity, callback, cancel_check, partitions
+            )
+            pending = [position for position in pending if position in shortlist]
+        pending_files = [image_files[position] for position in pending]
+        order = [pending[index] for index in self._processing_order(pending_files)]
+        batch = FingerprintBatcher(self.decode_scheduler, self.fingerprint_batch_size)
+
+        def finish(position, fingerprint):
+            if matrix_path:
+                fingerprints.stage(position, fingerprint)
+            else:
+                staged[position] = fingerprint
+            if checkpoint is not None:
+                checkpoint.record(position, image_files[position], digests[position], fingerprint)
+
+        with self._read_ahead([image_files[position] for position in order]) as contents:
+            for count, (position, (path, data, read_error)) in enumerate(zip(order, contents), start=1):
+                self._check_cancelled(cancel_check)
+                if callback:
+                    callback(total_files - len(order) + count, total_files, path)
+                finished = []
                 try:
-                    hashes[self.calculate_exact_hash(path)].append(path)
-                except OSError as error:
+                    if read_error:
+                        raise read_error
+                    digest = self.calculate_exact_hash(path, data) if path in candidates else None
+                    digests[position] = digest
+                    if digest in decoded_by_digest:
+                        if checkpoint is not None:
+                            checkpoint.record(position, path, digest)
+                        continue
+                    fingerprint = decoded.get(position)
+                    if fingerprint is None and matrix_path:
+                        fingerprint = fingerprints.lookup(path)
+                    if fingerprint is None:
+                        prepared = self.prepare_fingerprint_input(path, self.decode_scheduler, data)
+                    if self.aspect_blocking:
+                        aspects[position] = self.aspect_ratio(path, data)
+                    if fingerprint is None:
+                        finished = batch.add(position, prepared)
+                except (OSError, ValueError, Image.DecompressionBombError) as error:
+                    digests.pop(position, None)
+                    failures[position] = str(error)
+                    continue
+                if fingerprint is not None:
+                    finish(position, fingerprint)
+                for finished_position, packed in finished:
+                    finish(finished_position, VisualFingerprint.unpack(packed))
+                if digest is not None:
+                    decoded_by_digest[digest] = position
+                if checkpoint is not None:
+                    checkpoint.save_if_due()
+        for finished_position, packed in batch.flush():
+            finish(finished_position, VisualFingerprint.unpack(packed))
+        self._record_read_ahead(contents)
+
+        # Assemble in discovery order so groups do not depend on processing order.
+        representatives = array("q")
+        aspect_ratios = array("d") if self.aspect_blocking else None
+        fingerprint_partitions = array("q") if partitions is not None else None
+        first_by_digest = {}
+        first_copy = {}
+        for position, path in enumerate(image_files):
+            if position in failures:
+                self.skipped_files.append((path, failures[position]))
+                continue
+            if shortlist is not None and position not in shortlist:
+                continue
+            digest = digests[position]
+            if fingerprint_partitions is not None:
+                fingerprint_partitions.append(partitions[position])
+            # Under a comparison scope, copies are only collapsed within a folder.
+            key = digest if partitions is None else (partitions[position], digest)
+            if key in first_by_digest:
+                representative = first_by_digest[key]
+                representatives.append(representative)
+                fingerprints.append((path, fingerprints[representative][1]))
+                if aspect_ratios is not None:
+                    aspect_ratios.append(aspect_ratios[representative])
+                continue
+            if digest in first_copy:
+                # A copy in another folder reuses the fingerprint but is compared.
+                fingerprints.append((path, fingerprints[first_copy[digest]][1]))
+                if aspect_ratios is not None:
+                    aspect_ratios.append(aspect_ratios[first_copy[digest]])
+            else:
+                source = decoded_by_digest.get(digest, position) if digest is not None else position
+                if matrix_path:
+                    fingerprints.append_staged(path, source)
+                else:
+                    fingerprints.append((path, staged[source]))
+                if aspect_ratios is not None:
+                    aspect_ratios.append(aspects[source])
+            if digest is not None:
+                first_by_digest[key] = len(fingerprints) - 1
+                first_copy.setdefault(digest, len(fingerprints) - 1)
+            representatives.append(len(fingerprints) - 1)
+
+        self.metrics["reduced_decodes"] = self.decode_scheduler.reduced_decodes - reduced_before
+        self.metrics["identical_copies"] = sum(
+            1 for position, first in enumerate(representatives) if first != position
+        )
+        if matrix_path:
+            self.metrics["reused_fingerprints"] = fingerprints.reused
+            fingerprints = fingerprints.finish()
+        edge_floor = similarity if matrix_path else None
+        if shortlist is not None:
+            # Images outside candidate pairs were only compared at the coarse threshold.
+            edge_floor = max(edge_floor or 0, similarity - self.coarse_margin)
+        return self.group_fingerprints(
+            fingerprints,
+            similarity,
+            cancel_check,
+            representatives,
+            edge_floor,
+            checkpoint,
+            aspect_ratios,
+            fingerprint_partitions,
+        )
+
+    def _coarse_pass(
+        self, image_files, restored, aspects, similarity, callback, cancel_check, partitions=None
+    ):
+        """Return the positions worth a full fingerprint, and fingerprints the pass completed.
+
+        Every image not in ``restored``, which maps positions to packed
+        fingerprints from a checkpoint, is fingerprinted from its embedded
+        thumbnail or a draft decode. These are compared at ``coarse_margin``
+        below ``similarity``, and members of a pair become candidates, as
+        do images that could not be read so the full pass reports them.
+        Formats without partial decoding are decoded in full here, and the
+        fingerprints of those candidates are returned for reuse.
+        """
+        from core.batch import reduce_image
+
+        total_files = len(image_files)
+        rows = np.zeros((total_files, self.PACKED_SEGMENTS[-1][1]), dtype=np.uint8)
+        ratios = np.ones(total_files)
+        compared = np.zeros(total_files, dtype=bool)
+        for position, packed in restored.items():
+            rows[position] = np.frombuffer(packed, dtype=np.uint8)
+            compared[position] = True
+            if self.aspect_blocking:
+                ratios[position] = aspects[position]
+        candidates = set()
+        full = []
+        kinds = defaultdict(int)
+        pending = [position for position in range(total_files) if position not in restored]
+        order = [pending[index] for index in self._processing_order([image_files[p] for p in pending])]
+        batch = FingerprintBatcher(self.decode_scheduler, self.fingerprint_batch_size)
+
+        def finish(finished):
+            for position, packed in finished:
+                rows[position] = np.frombuffer(packed, dtype=np.uint8)
+                compared[position] = True
+
+        with self._read_ahead([image_files[position] for position in order]) as contents:
+            for count, (position, (path, data, read_error)) in enumerate(zip(order, contents), start=1):
+                self._check_cancelled(cancel_check)
+                if callback:
+                    callback(count, len(order), path)
+                try:
+                    if read_error:
+                        raise read_error
+                    source = io.BytesIO(data) if data is not None else image_source(path)
+                    with self.decode_scheduler.open_preview(source) as (preview, kind):
+                        prepared = reduce_image(preview)
+                    if self.aspect_blocking:
+                        ratios[position] = self.aspect_ratio(path, data)
+                except (OSError, ValueError, Image.DecompressionBombError):
+                    candidates.add(position)
+                    continue
+                kinds[kind] += 1
+                if kind == "full":
+                    full.append(position)
+                finish(batch.add(position, prepared))
+        finish(batch.flush())
+        self._record_read_ahead(contents)
+
+        # Positions without a coarse fingerprint are left out of the comparison.
+        self.representatives = array("q", np.where(compared, np.arange(total_files), -1).tolist())
+        aspect_ratios = ratios if self.aspect_blocking else None
+        edges = self._score_pairs(
+            rows, similarity - self.coarse_margin, cancel_check, None, aspect_ratios, partitions
+        )
+        candidates.update(edges.lefts.tolist())
+        candidates.update(edges.rights.tolist())
+        self.metrics["coarse_pair_comparisons"] = self.metrics.pop("pair_comparisons")
+        self.metrics["coarse_thumbnails"] = kinds["thumbnail"]
+        self.metrics["coarse_drafts"] = kinds["draft"]
+        self.metrics["coarse_full_decodes"] = kinds["full"]
+        self.metrics["coarse_candidates"] = len(candidates)
+        decoded = {
+            position: VisualFingerprint.unpack(rows[position].tobytes())
+            for position in full
+            if position in candidates
+        }
+        return candidates, decoded
+
+    def _processing_order(self, paths):
+        """Return the positions of ``paths`` in the order they should be read.
+
+        ``"inode"`` follows inode numbers, which approximate on-disk placement
+        and cut seeking on spinning disks. ``"directory"`` keeps each folder's
+        files together as a batch and orders them by inode. Members of an
+        archive stay together in archive order under both.
+        """
+        if self.processing_order == "discovery":
+            return list(range(len(paths)))
+        if self.processing_order not in PROCESSING_ORDERS:
+            raise ValueError(f"Unknown processing order {self.processing_order!r}.")
+
+        def inode(position):
+            try:
+                stat = file_stat(paths[position])
+            except OSError:
+                return 1, 0, 0
+            return 0, stat.st_dev, stat.st_ino
+
+        inodes = [inode(position) for position in range(len(paths))]
+        if self.processing_order == "inode":
+            return sorted(range(len(paths)), key=lambda position: (inodes[position], position))
+        folders = {}
+
+        def folder(path):
+            archive_path, member = split_member(path)
+            return archive_path if member is not None else os.path.dirname(path)
+
+        for path in paths:
+            folders.setdefault(folder(path), len(folders))
+        return sorted(
+            range(len(paths)),
+            key=lambda position: (folders[folder(paths[position])], inodes[position], position),
+        )
+
+    def _read_ahead(self, paths):
+        tuner = None
+        if self.autotune:
+            from core.autotune import ReadAheadTuner
+
+            tuner = ReadAheadTuner()
+        return ReadAhead(paths, self.read_ahead_threads, self.read_ahead_depth, self.read_ahead_bytes, tuner)
+
+    def _record_read_ahead(self, contents):
+        self.metrics.update(contents.stats())
+        if contents.tuner is not None:
+            # Later stages and scans start from the settings the tuner chose.
+            self.read_ahead_threads, self.read_ahead_depth = contents.readers, contents.depth
+
+    def clear_visual_state(self):
+        """Forget the fingerprints and pair scores of the last visual scan."""
+        self.fingerprints, self.representatives, self.edges, self.edge_floor = [], [], [], None
+        self.partition_scope, self.partitions = "all", None
+        self._edge_scores = None
+        self._fingerprint_index = None
+
+    def _size_candidates(self, image_files, report_errors=True, known_digests=(), partitions=None):
+        """Return files sharing their size with another file or with a file in ``known_digests``.
+
+        Size is a cheap pre-filter. Only same-sized files can be byte-identical.
+        With ``partitions``, the folder labels of scope_partitions(), only
+        files sharing their size with a file in scope are returned.
+        """
+        files_by_size = defaultdict(list)
+        for position, path in enumerate(image_files):
+            try:
+                files_by_size[file_size(path)].append(position)
+            except OSError as error:
+                if report_errors:
                     self.skipped_files.append((path, str(error)))
-            self.duplicates = {key: paths for key, paths in hashes.items() if len(paths) > 1}
-            return self.duplicates
+        candidates = set()
+        for size, positions in files_by_size.items():
+            if any(digest_set.may_contain_size(size) for digest_set in known_digests):
+                candidates.update(image_files[position] for position in positions)
+                continue
+            if partitions is None or self.comparison_scope == "cross-folder":
+                folders = len(positions) if partitions is None else len({partitions[p] for p in positions})
+                if folders > 1:
+                    candidates.update(image_files[position] for position in positions)
+                continue
+            by_folder = defaultdict(list)
+            for position in positions:
+                by_folder[partitions[position]].append(image_files[position])
+            candidates.update(path for paths in by_folder.values() if len(paths) > 1 for path in paths)
+        return candidates
+
+    def scope_partitions(self, image_files, roots):
+        """Label each file with the folder comparison_scope compares it within or across.
 
-        fingerprints = []
-        for index, path in enumerate(image_files, start=1):
+        Returns None for the ``"all"`` scope. Across folders, files are
+        labelled by their root when there are several roots, and otherwise
+        by their top-level folder below the root, where files directly in
+        the root share a label. Within folders, files are labelled by the
+        folder, or archive folder, that holds them.
+        """
+        if self.comparison_scope not in COMPARISON_SCOPES:
+            raise ValueError(f"Unknown comparison scope {self.comparison_scope!r}.")
+        if self.comparison_scope == "all":
+            return None
+
+        def top_folder(path):
+            for index, root in enumerate(roots):
+                try:
+                    relative = os.path.relpath(path, root)
+                except ValueError:
+                    # Paths on different drives share no common path.
+                    continue
+                if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+                    continue
+                if len(roots) > 1:
+                    return index
+                return relative.split(os.sep)[0] if os.sep in relative else ""
+            return path
+
+        folder = os.path.dirname if self.comparison_scope == "within-folder" else top_folder
+        labels = {}
+        return array("q", (labels.setdefault(folder(path), len(labels)) for path in image_files))
+
+    def _scope_groups(self, groups, image_files, partitions):
+        """Split or drop groups of identical files whose members are out of comparison_scope.
+
+        Within folders a group is split into one group per folder, keyed
+        ``<hash>_<n>`` when it spans several; across folders only groups
+        spanning at least two folders are kept.
+        """
+        if partitions is None:
+            return groups
+        labels = {path: partitions[position] for position, path in enumerate(image_files)}
+        scoped = {}
+        for key, paths in groups.items():
+            if self.comparison_scope == "cross-folder":
+                if len({labels[path] for path in paths}) > 1:
+                    scoped[key] = paths
+                continue
+            by_folder = defaultdict(list)
+            for path in paths:
+                by_folder[labels[path]].append(path)
+            split = [members for members in by_folder.values() if len(members) > 1]
+            for number, members in enumerate(split, start=1):
+                scoped[key if len(split) == 1 else f"{key}_{number}"] = members
+        self.duplicates = scoped
+        return scoped
+
+    def group_digests(self, hashed):
+        """Group ``(path, digest)`` pairs, given in scan order, into exact duplicates."""
+        hashes = defaultdict(list)
+        for path, digest in hashed:
+            hashes[digest].append(path)
+        self.duplicates = {key: paths for key, paths in hashes.items() if len(paths) > 1}
+        return self.duplicates
+
+    def group_fingerprints(
+        self,
+        fingerprints,
+        similarity,
+        cancel_check=None,
+        representatives=None,
+        edge_floor=None,
+        checkpoint=None,
+        aspect_ratios=None,
+        partitions=None,
+    ):
+        """Group ``(path, fingerprint)`` pairs, given in scan order, by visual similarity.
+
+        ``representatives`` maps each position to the position of the first
+        byte-identical copy; only those first copies are compared. Pairs
+        scoring at least ``edge_floor`` are kept for regroup(). A
+        ``ScanCheckpoint`` records finished comparison blocks. With
+        ``aspect_ratios`` only images of similar shape are compared, and
+        with ``partitions`` only pairs within comparison_scope.
+        """
+        self.fingerprints = fingerprints
+        self.representatives = representatives or array("q", range(len(fingerprints)))
+        self.edge_floor = min(EDGE_FLOOR, similarity) if edge_floor is None else edge_floor
+        self.partition_scope = self.comparison_scope if partitions is not None else "all"
+        self.partitions = partitions
+        self.edges = self._score_pairs(
+            fingerprints, self.edge_floor, cancel_check, checkpoint, aspect_ratios, partitions
+        )
+        self._edge_scores = None
+        self._fingerprint_index = None
+        return self.regroup(similarity)
+
+    def _comparison_buckets(self, positions, aspect_ratios=None, partitions=None):
+        """Return the aspect bucket and folder label of each of ``positions``."""
+        buckets = np.zeros(len(positions), dtype=np.int64)
+        if aspect_ratios is not None:
+            ratios = np.array(aspect_ratios, dtype=np.float64)[positions]
+            buckets = np.floor(np.log(ratios) / np.log1p(self.aspect_tolerance)).astype(np.int64)
+        labels = np.zeros(len(positions), dtype=np.int64)
+        if partitions is not None:
+            labels = np.asarray(partitions, dtype=np.int64)[positions]
+        return buckets, labels
+
+    def _comparison_rows(self, positions, aspect_ratios=None, partitions=None):
+        """Yield the tiles to score as ``(left_positions, [(right_positions, diagonal), ...])`` rows.
+
+        Without aspect ratios every pair of ``positions`` is covered. With
+        them positions are bucketed by log aspect ratio in steps of
+        ``aspect_tolerance``, and only pairs in the same or adjacent buckets
+        are covered. ``partitions`` further splits each bucket by folder
+        label: within folders only pairs with the same label are covered,
+        across folders only pairs with different labels. Rows are generated
+        as they are scored, so the plan never has to fit in memory.
+        """
+        block = self.comparison_block_size
+        buckets, labels = self._comparison_buckets(positions, aspect_ratios, partitions)
+        cross = partitions is not None and self.comparison_scope == "cross-folder"
+
+        # Runs of positions sharing a bucket and label, in position order within each run.
+        order = np.lexsort((labels, buckets))
+        keys = np.stack((buckets[order], labels[order]), axis=1)
+        starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]).any(axis=1)]) if len(order) else []
+        members = defaultdict(dict)
+        for start, end in zip(starts, [*starts[1:], len(order)]):
+            members[int(keys[start, 0])][int(keys[start, 1])] = positions[order[start:end]]
+
+        for bucket in sorted(members):
+            adjacent = members.get(bucket + 1, {})
+            for label, group in members[bucket].items():
+                if cross:
+                    others = [other for other_label, other in members[bucket].items() if other_label > label]
+                    others += [other for other_label, other in adjacent.items() if other_label != label]
+                    neighbours = np.concatenate(others) if others else None
+                else:
+                    neighbours = adjacent.get(label)
+                for start in range(0, len(group), block):
+                    tiles = []
+                    if not cross:
+                        tiles.extend(
+                            (group[right:right + block], right == start)
+                            for right in range(start, len(group), block)
+                        )
+                    if neighbours is not None:
+                        tiles.extend(
+                            (neighbours[right:right + block], False)
+                            for right in range(0, len(neighbours), block)
+                        )
+                    if tiles:
+                        yield group[start:start + block], tiles
+
+    def _score_pairs(
+        self, fingerprints, floor, cancel_check=None, checkpoint=None, aspect_ratios=None, partitions=None
+    ):
+        """Return the pairs scoring at or above ``floor`` as PackedEdges.
+
+        Fingerprints are compared as packed rows in square tiles, so memory
+        stays bounded by the tile size and memory-mapped matrices are read
+        block by block. Edges are sorted by descending score so regrouping
+        can stop at the first edge below the requested threshold.
+        ``fingerprints`` may also be an array of packed rows.
+        """
+        from core.matrix import PackedEdges
+
+        representatives = np.frombuffer(array("q", self.representatives), dtype=np.int64)
+        positions = np.flatnonzero(representatives == np.arange(len(representatives)))
+        rows = fingerprints if isinstance(fingerprints, np.ndarray) else getattr(fingerprints, "rows", None)
+        if rows is None:
+            packed = b"".join(fingerprint.pack() for _, fingerprint in fingerprints)
+            rows = np.frombuffer(packed, dtype=np.uint8).reshape(len(fingerprints), -1)
+
+        if checkpoint is not None and checkpoint.block_size:
+            # A resumed comparison keeps the tiles its finished blocks were scored in.
+            self.comparison_block_size = checkpoint.block_size
+        elif self.autotune:
+            from core.autotune import fastest_block_size
+
+            self.comparison_block_size = (
+                fastest_block_size(self.similarity_scores, rows, positions) or self.comparison_block_size
+            )
+        if checkpoint is not None:
+            checkpoint.block_size = self.comparison_block_size
+        first_row = 0
+        scores, lefts, rights = [], [], []
+        if checkpoint is not None:
+            pair_key = self._pair_key(rows, positions, floor, aspect_ratios, partitions)
+            first_row, finished = checkpoint.resume_pairs(pair_key)
+            for row_scores, row_lefts, row_rights in finished:
+                scores.append(row_scores)
+                lefts.append(row_lefts)
+                rights.append(row_rights)
+            self.metrics["resumed_pair_blocks"] = len(finished)
+        compared = 0
+        comparisons = self._comparison_rows(positions, aspect_ratios, partitions)
+        for row, (left_positions, tiles) in enumerate(comparisons):
+            compared += sum(
+                len(right) * (len(right) - 1) // 2 if diagonal else len(left_positions) * len(right)
+                for right, diagonal in tiles
+            )
+            if row < first_row:
+                continue
             self._check_cancelled(cancel_check)
-            if callback:
-                callback(index, total_files, path)
-            try:
-                fingerprints.append((path, self.calculate_visual_fingerprint(path)))
-            except (OSError, ValueError, Image.DecompressionBombError) as error:
-                self.skipped_files.append((path, str(error)))
+            left_rows = np.asarray(rows[left_positions])
+            row_scores, row_lefts, row_rights = [], [], []
+            for right_positions, diagonal in tiles:
+                tile = self.similarity_scores(left_rows, np.asarray(rows[right_positions]))
+                keep = tile >= floor
+                if diagonal:
+                    keep &= np.triu(np.ones(keep.shape, dtype=bool), k=1)
+                left_index, right_index = np.nonzero(keep)
+                row_scores.append(tile[left_index, right_index])
+                # Pairs across aspect buckets are stored with the lower position first.
+                row_lefts.append(np.minimum(left_positions[left_index], right_positions[right_index]))
+                row_rights.append(np.maximum(left_positions[left_index], right_positions[right_index]))
+            scores.append(np.concatenate(row_scores))
+            lefts.append(np.concatenate(row_lefts))
+            rights.append(np.concatenate(row_rights))
+            if checkpoint is not None:
+                checkpoint.record_pairs(row + 1, scores[-1], lefts[-1], rights[-1])
+                checkpoint.save_if_due()
+
+        self.metrics["pair_comparisons"] = compared
+        if aspect_ratios is not None or partitions is not None:
+            self.metrics["skipped_comparisons"] = len(positions) * (len(positions) - 1) // 2 - compared
+        if not scores:
+            return PackedEdges()
+
+        scores, lefts, rights = np.concatenate(scores), np.concatenate(lefts), np.concatenate(rights)
+        order = np.lexsort((rights, lefts, -scores))
+        return PackedEdges(scores[order], lefts[order], rights[order])
+
+    def _pair_key(self, rows, positions, floor, aspect_ratios=None, partitions=None):
+        """Identify the comparison a checkpoint's finished pair blocks belong to.
+
+        The tile plan follows from the block size, the scope and each
+        position's aspect bucket and folder label, so those are hashed
+        instead of the plan itself.
+        """
+        buckets, labels = self._comparison_buckets(positions, aspect_ratios, partitions)
+        scope = self.comparison_scope if partitions is not None else "all"
+        key = hashlib.blake2b(digest_size=16)
+        key.update(f"{floor!r}:{len(rows)}:{self.comparison_block_size}:{scope}".encode())
+        for values in (positions, buckets, labels):
+            key.update(b"|" + np.asarray(values, dtype=np.int64).tobytes())
+        for start in range(0, len(positions), self.comparison_block_size):
+            key.update(np.asarray(rows[positions[start:start + self.comparison_block_size]]).tobytes())
+        return key.hexdigest()
+
+    def regroup(self, similarity):
+        """Re-run grouping of the last visual scan at a new threshold.
+
+        Only the stored edge list is used, so this is cheap compared with a
+        rescan. Thresholds below the stored edge floor need a new scan.
+        """
+        if self.edge_floor is None:
+            raise ValueError("Regrouping requires a completed visual scan.")
+        if not self.edge_floor <= similarity <= 100:
+            raise ValueError(f"Similarity must be between {self.edge_floor} and 100 to regroup.")
 
         # Build deterministic connected components of all matching pairs. This
         # includes chains of related edits rather than depending on os.walk order.
-        parent = list(range(len(fingerprints)))
+        parent = array("q", range(len(self.fingerprints)))
 
         def find(item):
             while parent[item] != item:
@@ -158,18 +1298,55 @@ class ImageScanner:
             if left_root != right_root:
                 parent[right_root] = left_root
 
-        for left in range(len(fingerprints)):
-            self._check_cancelled(cancel_check)
-            for right in range(left + 1, len(fingerprints)):
-                if self.similarity_score(fingerprints[left][1], fingerprints[right][1]) >= similarity:
-                    union(left, right)
+        for index, representative in enumerate(self.representatives):
+            if representative != index:
+                union(representative, index)
+        for left, right in self.edges.above(similarity):
+            union(left, right)
 
         groups = defaultdict(list)
-        for index, (path, _) in enumerate(fingerprints):
+        folders = defaultdict(set)
+        cross = self.partitions is not None and self.partition_scope == "cross-folder"
+        for index, path in enumerate(self._fingerprint_paths()):
             groups[find(index)].append(path)
+            if cross:
+                folders[find(index)].add(self.partitions[index])
+        # Across folders, identical copies within one folder do not form a group on their own.
+        matched = [
+            paths
+            for root, paths in groups.items()
+            if len(paths) > 1 and (not cross or len(folders[root]) > 1)
+        ]
         self.duplicates = {
-            f"similar_{group_number}": paths
-            for group_number, paths in enumerate(groups.values(), start=1)
-            if len(paths) > 1
+            f"similar_{group_number}": paths for group_number, paths in enumerate(matched, start=1)
         }
         return self.duplicates
+
+    def _fingerprint_paths(self):
+        paths = getattr(self.fingerprints, "paths", None)
+        return paths if paths is not None else [path for path, _ in self.fingerprints]
+
+    def pair_score(self, left_path, right_path):
+        """Return the visual score between two files from the last visual scan."""
+        if self._edge_scores is None:
+            self._edge_scores = {(left, right): score for score, left, right in self.edges}
+            self._fingerprint_index = {path: index for index, path in enumerate(self._fingerprint_paths())}
+        left = self.representatives[self._fingerprint_index[left_path]]
+        right = self.representatives[self._fingerprint_index[right_path]]
+        if left > right:
+            left, right = right, left
+        score = self._edge_scores.get((left, right))
+        if score is None:
+            # Pairs below the floor were not kept; score them on demand.
+            score = self.similarity_score(self.fingerprints[left][1], self.fingerprints[right][1])
+        return score
+
+    def rank_group(self, paths):
+        """Order group members by mean similarity to the rest of the group."""
+        if len(paths) < 2:
+            return list(paths)
+        means = {
+            path: sum(self.pair_score(path, other) for other in paths if other != path) / (len(paths) - 1)
+            for path in paths
+        }
+        return sorted(paths, key=lambda path: (-means[path], paths.index(path)))
@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+from core.archives import file_size
+from core.index import ReferenceIndex
+from core.scanner import ImageScanner
+
+
+DEFAULT_PORT = 8765
+
+
+class LookupService:
+    """Answer duplicate lookups against a reference index kept in memory.
+
+    Lookups take a file path or the image's bytes. ``similarity=100``
+    matches byte-identical files by digest; lower values match fingerprints
+    scored with ImageScanner.similarity_score(). Files are hashed and
+    fingerprinted outside the index lock, so concurrent lookups only
+    serialise on the in-memory match itself.
+    """
+
+    def __init__(self, index: ReferenceIndex, exact=True, visual=True, index_path: Optional[str] = None):
+        if not (exact or visual):
+            raise ValueError("A lookup service needs digests, fingerprints, or both.")
+        self.index = index
+        self.exact = exact
+        self.visual = visual
+        self.index_path = index_path
+        self.modified = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, folder_paths, exact=True, visual=True, index_path=None, callback=None):
+        """Index every image below one or more folders and serve lookups against them."""
+        return cls(ReferenceIndex.build(folder_paths, callback, exact, visual), exact, visual, index_path)
+
+    @classmethod
+    def load(cls, index_path: str):
+        """Serve lookups against a saved reference index; save() writes updates back to it."""
+        index = ReferenceIndex.load(index_path)
+        exact, visual = index.has_digests, index.has_fingerprints
+        if not (exact or visual):
+            # An empty index can take either kind of entry.
+            exact = visual = True
+        return cls(index, exact, visual, index_path)
+
+    def _check_similarity(self, similarity) -> None:
+        if not 0 <= similarity <= 100:
+            raise ValueError("Similarity must be between 0 and 100.")
+        if similarity == 100 and not self.exact:
+            raise ValueError("This lookup service was started without digests.")
+        if similarity < 100 and not self.visual:
+            raise ValueError("This lookup service was started without visual fingerprints.")
+
+    def lookup(self, path=None, data: Optional[bytes] = None, similarity=100) -> list[tuple[str, float]]:
+        """Return ``(path, score)`` for library images matching a file or its contents, best first."""
+        if (path is None) == (data is None):
+            raise ValueError("A lookup needs either a file path or image data.")
+        self._check_similarity(similarity)
+        if similarity == 100:
+            size = len(data) if data is not None else file_size(path)
+            with self._lock:
+                # Only hash queries whose size occurs in the library.
+                if not self.index._by_size.get(size):
+                    return []
+            digest = ImageScanner.calculate_exact_hash(path, data)
+            with self._lock:
+                matches = [(match, 100.0) for match in self.index.match_exact(path, digest)]
+        else:
+            fingerprint = ImageScanner.calculate_visual_fingerprint(path or "image data", data=data)
+            with self._lock:
+                matches = self.index.match_similar(fingerprint, similarity)
+        if path is not None:
+            matches = [match for match in matches if os.path.normcase(match[0]) != os.path.normcase(path)]
+        return matches
+
+    def add(self, path: str) -> None:
+        """Index one file, replacing its entry if it was indexed before."""
+        size = file_size(path)
+        digest = ImageScanner.calculate_exact_hash(path) if self.exact else None
+        fingerprint = ImageScanner.calculate_visual_fingerprint(path) if self.visual else None
+        with self._lock:
+            self.index.add(path, size, digest, fingerprint)
+            self.modified = True
+
+    def remove(self, path: str) -> bool:
+        """Drop one file from the index; return whether it was indexed."""
+        with self._lock:
+            removed = self.index.remove(path)
+            self.modified = self.modified or removed
+        return removed
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"images": len(self.index), "exact": self.exact, "visual": self.visual}
+
+    def save(self) -> None:
+        """Write the index, with any additions and removals, back to ``index_path``."""
+        if self.index_path is None:
+            return
+        with self._lock:
+            self.index.save(self.index_path)
+            self.modified = False
+
+
+class _LookupHandler(BaseHTTPRequestHandler):
+    # Keep-alive connections let clients skip a TCP handshake per lookup, and
+    # without Nagle's algorithm small replies are not held back for an ACK.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server_version = "TwinHunter"
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/status":
+            self._reply(200, self.server.service.status())
+        else:
+            self._reply(404, {"error": "Unknown endpoint."})
+
+    def do_POST(self):
+        started = time.perf_counter()
+        url = urlparse(self.path)
+        service = self.server.service
+        try:
+            body = self._body()
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                request = json.loads(body or b"{}")
+                if not isinstance(request, dict):
+                    raise ValueError("Expected a JSON object.")
+                path, data = request.get("path"), None
+                similarity = request.get("similarity", 100)
+            else:
+                # Any other body is the image itself, with options in the query string.
+                request = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                path, data = None, body
+                similarity = request.get("similarity", 100)
+            similarity = float(similarity)
+            if url.path == "/lookup":
+                matches = service.lookup(path, data, similarity)
+                payload = {"matches": [{"path": match, "score": round(score, 2)} for match, score in matches]}
+            elif url.path in ("/add", "/remove") and not path:
+                raise ValueError("Updates need a JSON body with the file path.")
+            elif url.path == "/add":
+                service.add(path)
+                payload = {"added": path}
+            elif url.path == "/remove":
+                payload = {"removed": service.remove(path)}
+            else:
+                self._reply(404, {"error": "Unknown endpoint."})
+                return
+        except (OSError, ValueError, TypeError, Image.DecompressionBombError) as error:
+            self._reply(400, {"error": str(error)})
+            return
+        payload["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        self._reply(200, payload)
+
+    def log_message(self, format, *args):
+        # Lookups are too frequent to log one line each.
+        pass
+
+
+def make_server(service: LookupService, host="127.0.0.1", port=DEFAULT_PORT) -> ThreadingHTTPServer:
+    """Return an HTTP server answering lookups for ``service``; call serve_forever() to run it.
+
+    Endpoints: ``POST /lookup`` with the image bytes as the body and
+    ``?similarity=`` in the URL, or a JSON body ``{"path": ..., "similarity": ...}``;
+    ``POST /add`` and ``POST /remove`` with ``{"path": ...}``; ``GET /status``.
+    """
+    server = ThreadingHTTPServer((host, port), _LookupHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
@@ -0,0 +1,109 @@
+from core.archives import file_stat
+from core.storage import read_records, write_records
+
+
+SESSION_KIND = "scan-session"
+
+
+class ScanSession:
+    """Results and review state of one scan, saved so it can be reopened.
+
+    Each file is stored with the size and modification time it had when
+    the scan ran and with its digest or packed fingerprint. Reopening a
+    session only stats the files; check_files() reports those that changed
+    or disappeared since.
+    """
+
+    def __init__(self, roots: list[str], similarity: int, groups: dict, pixel_identical: bool = False):
+        self.roots = roots
+        self.similarity = similarity
+        self.pixel_identical = pixel_identical
+        self.groups = groups
+        self.signatures = {}
+        self.hashes = {}
+        self.keepers = {}
+        self.selected = set()
+
+    @classmethod
+    def from_scan(cls, scanner, roots, similarity, duplicates, pixel_identical=False):
+        """Capture the groups of a completed scan and each member's digest or fingerprint."""
+        groups = {key: list(paths) for key, paths in duplicates.items()}
+        session = cls(list(roots), similarity, groups, pixel_identical)
+        fingerprint_index = {}
+        if scanner is not None and scanner.edge_floor is not None:
+            fingerprint_index = {path: index for index, path in enumerate(scanner._fingerprint_paths())}
+        for group_id, paths in session.groups.items():
+            for path in paths:
+                try:
+                    stat = file_stat(path)
+                except OSError:
+                    continue
+                session.signatures[path] = (stat.st_size, stat.st_mtime_ns)
+                if path in fingerprint_index:
+                    session.hashes[path] = scanner.fingerprints[fingerprint_index[path]][1].pack().hex()
+                elif similarity == 100:
+                    # Exact and pixel groups are keyed by the hash their members share, with a
+                    # "_<n>" suffix when a comparison scope split them by folder; the groups
+                    # of known digest sets end with it.
+                    session.hashes[path] = group_id.rpartition(":")[2].partition("_")[0]
+        return session
+
+    def set_review(self, keepers: dict, selected) -> None:
+        """Replace the keepers and selected files; signatures and hashes are kept as saved.
+
+        A reopened session is saved again through this, so files that changed
+        since the scan stay flagged and no fingerprint is lost.
+        """
+        self.keepers = {group_id: keeper for group_id, keeper in keepers.items() if keeper is not None}
+        self.selected = set(selected)
+
+    def save(self, session_path: str) -> None:
+        header = {
+            "roots": self.roots,
+            "similarity": self.similarity,
+            "pixel_identical": self.pixel_identical,
+            "groups": len(self.groups),
+        }
+        records = (
+            [
+                group_id,
+                self.keepers.get(group_id),
+                [
+                    [path, *self.signatures.get(path, (None, None)), self.hashes.get(path), path in self.selected]
+                    for path in paths
+                ],
+            ]
+            for group_id, paths in self.groups.items()
+        )
+        write_records(session_path, SESSION_KIND, header, records)
+
+    @classmethod
+    def load(cls, session_path: str):
+        header, records = read_records(session_path, SESSION_KIND)
+        session = cls(header["roots"], header["similarity"], {}, header["pixel_identical"])
+        for group_id, keeper, members in records:
+            session.groups[group_id] = [member[0] for member in members]
+            if keeper is not None:
+                session.keepers[group_id] = keeper
+            for path, size, mtime_ns, file_hash, selected in members:
+                if size is not None:
+                    session.signatures[path] = (size, mtime_ns)
+                if file_hash is not None:
+                    session.hashes[path] = file_hash
+                if selected:
+                    session.selected.add(path)
+        return session
+
+    def check_files(self) -> dict:
+        """Return ``{path: "missing" | "changed"}`` for files that differ from the saved scan."""
+        statuses = {}
+        for paths in self.groups.values():
+            for path in paths:
+                try:
+                    stat = file_stat(path)
+                except OSError:
+                    statuses[path] = "missing"
+                    continue
+                if self.signatures.get(path) != (stat.st_size, stat.st_mtime_ns):
+                    statuses[path] = "changed"
+        return statuses
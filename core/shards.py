@@ -0,0 +1,203 @@
+import hashlib
+import os
+from typing import Callable, Optional
+
+from PIL import Image
+
+from core.archives import file_size
+from core.batch import FingerprintBatcher
+from core.scanner import COMPARISON_SCOPES, ImageScanner, VisualFingerprint
+from core.storage import read_records, write_records
+
+
+SHARD_KIND = "scan-shard"
+
+
+def shard_of(relative_path: str, shard_count: int) -> int:
+    """Return the stable shard number of a path relative to the scan root.
+
+    Separators are normalised so machines that mount the same library on
+    different drive letters or operating systems agree on the split.
+    """
+    key = relative_path.replace(os.sep, "/").casefold().encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big") % shard_count
+
+
+def walk_order_key(path: str):
+    """Sort key reproducing the order in which ImageScanner discovers files.
+
+    Discovery lists a folder's files before descending into its subfolders,
+    each in case-folded name order, so merged shards keep monolithic order.
+    """
+    folders, filename = os.path.split(os.path.normpath(path))
+    parts = [part for part in folders.replace("\\", "/").split("/") if part]
+    return tuple((1, part.casefold(), part) for part in parts) + ((0, filename.casefold(), filename),)
+
+
+def _merged_roots(headers) -> list[str]:
+    """Return the shards' roots without duplicates or roots inside another root.
+
+    Shards are often merged on a machine where their roots are not mounted,
+    so roots are compared as recorded instead of resolved on disk.
+    """
+    roots = {}
+    for header in headers:
+        roots.setdefault(os.path.normcase(os.path.normpath(header["root"])), header["root"])
+
+    def inside(path, parent):
+        try:
+            return path != parent and os.path.commonpath([path, parent]) == parent
+        except ValueError:
+            # Paths on different drives share no common path.
+            return False
+
+    return [root for key, root in roots.items() if not any(inside(key, other) for other in roots)]
+
+
+def scan_shard(
+    folder_path,
+    output_path,
+    shard_index=0,
+    shard_count=1,
+    exact=True,
+    visual=True,
+    callback=None,
+    cancel_check: Optional[Callable[[], bool]] = None,
+    discovery_callback=None,
+) -> int:
+    """Hash and fingerprint one shard of ``folder_path`` into ``output_path``.
+
+    With ``shard_count=1`` the whole folder is one shard, which is how
+    subtree shards are produced. Exact shards hash every file because size
+    collisions with other shards are unknown until the merge. Returns the
+    number of files recorded.
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError("Shard index must be between 0 and the shard count.")
+    if not (exact or visual):
+        raise ValueError("A shard needs digests, fingerprints, or both.")
+
+    root = os.path.abspath(folder_path)
+    image_files = [
+        path
+        for path in ImageScanner._collect_images(root, discovery_callback, cancel_check)
+        if shard_of(os.path.relpath(path, root), shard_count) == shard_index
+    ]
+    records = []
+    skipped_files = []
+    batch = FingerprintBatcher()
+    for position, path in enumerate(image_files, start=1):
+        ImageScanner._check_cancelled(cancel_check)
+        if callback:
+            callback(position, len(image_files), path)
+        try:
+            size = file_size(path)
+            digest = ImageScanner.calculate_exact_hash(path) if exact else None
+            prepared = ImageScanner.prepare_fingerprint_input(path) if visual else None
+            aspect_ratio = ImageScanner.aspect_ratio(path) if visual else None
+        except (OSError, ValueError, Image.DecompressionBombError) as error:
+            skipped_files.append((path, str(error)))
+            continue
+        records.append([path, size, digest, None, aspect_ratio])
+        # Fingerprints are filled in as their batch completes.
+        finished = batch.add(len(records) - 1, prepared) if visual else []
+        for record, packed in finished:
+            records[record][3] = packed.hex()
+    for record, packed in batch.flush():
+        records[record][3] = packed.hex()
+
+    header = {
+        "root": root,
+        "shard_index": shard_index,
+        "shard_count": shard_count,
+        "exact": exact,
+        "visual": visual,
+        "count": len(records),
+        "skipped": skipped_files,
+    }
+    write_records(output_path, SHARD_KIND, header, records)
+    return len(records)
+
+
+def merge_shards(
+    shard_paths,
+    similarity=100,
+    scanner: Optional[ImageScanner] = None,
+    cancel_check: Optional[Callable[[], bool]] = None,
+):
+    """Group the files of several shards as one ``scan_directory`` run would.
+
+    Hash-partitioned shards of one root must all be present. Subtree shards
+    may overlap; files recorded by more than one shard are kept once.
+    ``scanner`` receives the merged skipped files and visual pair scores,
+    and its comparison_scope and known_digests apply as in a scan of the
+    shards' roots.
+    """
+    if not 0 <= similarity <= 100:
+        raise ValueError("Similarity must be between 0 and 100.")
+    scanner = scanner or ImageScanner()
+    if scanner.comparison_scope not in COMPARISON_SCOPES:
+        raise ValueError(f"Unknown comparison scope {scanner.comparison_scope!r}.")
+    headers = []
+    entries = {}
+    skipped_files = []
+    for shard_path in shard_paths:
+        header, records = read_records(shard_path, SHARD_KIND)
+        if similarity == 100 and not header["exact"]:
+            raise ValueError(f"{shard_path} was scanned without digests.")
+        if similarity < 100 and not header["visual"]:
+            raise ValueError(f"{shard_path} was scanned without visual fingerprints.")
+        headers.append(header)
+        skipped_files.extend(tuple(item) for item in header["skipped"])
+        for path, _, digest, packed, *aspect_ratio in records:
+            entries.setdefault(os.path.normcase(path), (path, digest, packed, *aspect_ratio[:1]))
+
+    partitions = {}
+    for header in headers:
+        if header["shard_count"] > 1:
+            partitions.setdefault((header["root"], header["shard_count"]), set()).add(header["shard_index"])
+    for (root, shard_count), present in partitions.items():
+        if present != set(range(shard_count)):
+            missing = ", ".join(str(index) for index in sorted(set(range(shard_count)) - present))
+            raise ValueError(f"Shards {missing} of {shard_count} for {root} are missing.")
+
+    ordered = sorted(entries.values(), key=lambda entry: walk_order_key(entry[0]))
+    scanner.skipped_files = sorted(set(skipped_files), key=lambda item: walk_order_key(item[0]))
+    image_files = [entry[0] for entry in ordered]
+    partitions = None
+    if scanner.comparison_scope != "all":
+        partitions = scanner.scope_partitions(image_files, _merged_roots(headers))
+    ImageScanner._check_cancelled(cancel_check)
+    if similarity == 100:
+        scanner.clear_visual_state()
+        digests = {position: digest for position, (_, digest, *_) in enumerate(ordered)}
+        duplicates = scanner._scope_groups(
+            scanner.group_digests(zip(image_files, digests.values())), image_files, partitions
+        )
+        if scanner.known_digests:
+            duplicates.update(scanner._known_groups(image_files, digests))
+        return duplicates
+
+    # Digests, when recorded, let byte-identical copies share one comparison;
+    # under a comparison scope only copies within a folder are collapsed.
+    fingerprints = []
+    representatives = []
+    first_by_digest = {}
+    for position, (path, digest, packed, *_) in enumerate(ordered):
+        key = digest if partitions is None else (partitions[position], digest)
+        representative = first_by_digest.setdefault(key, position) if digest else position
+        representatives.append(representative)
+        fingerprint = fingerprints[representative][1] if representative != position else None
+        fingerprints.append((path, fingerprint or VisualFingerprint.unpack(bytes.fromhex(packed))))
+    # Shards written before aspect ratios were recorded are compared unblocked.
+    aspect_ratios = None
+    if scanner.aspect_blocking and all(len(entry) > 3 for entry in ordered):
+        aspect_ratios = [ordered[representative][3] for representative in representatives]
+    return scanner.group_fingerprints(
+        fingerprints,
+        similarity,
+        cancel_check,
+        representatives,
+        aspect_ratios=aspect_ratios,
+        partitions=partitions,
+    )
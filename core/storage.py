@@ -0,0 +1,46 @@
+import gzip
+import json
+import os
+from typing import Any, Iterable, Iterator
+
+
+FORMAT_VERSION = 1
+
+
+def write_records(path: str, kind: str, header: dict, records: Iterable[Any]) -> None:
+    """Write a self-describing, gzip-compressed JSON-lines file.
+
+    The first line identifies the file kind and format version so index,
+    shard and session files cannot be mistaken for each other. The file is
+    written next to its destination and moved into place when complete.
+    """
+    temporary_path = f"{path}.partial"
+    with gzip.open(temporary_path, "wt", encoding="utf-8") as output:
+        output.write(json.dumps({"kind": kind, "version": FORMAT_VERSION, **header}) + "\n")
+        for record in records:
+            output.write(json.dumps(record, separators=(",", ":")) + "\n")
+    os.replace(temporary_path, path)
+
+
+def read_records(path: str, kind: str) -> tuple[dict, Iterator[Any]]:
+    """Return the header and a record iterator for a file written by write_records()."""
+    stream = gzip.open(path, "rt", encoding="utf-8")
+    try:
+        header = json.loads(stream.readline() or "null")
+    except (OSError, ValueError) as error:
+        stream.close()
+        raise ValueError(f"{path} is not a TwinHunter {kind} file.") from error
+    if not isinstance(header, dict) or header.get("kind") != kind:
+        stream.close()
+        raise ValueError(f"{path} is not a TwinHunter {kind} file.")
+    if header.get("version") != FORMAT_VERSION:
+        stream.close()
+        raise ValueError(f"{path} uses unsupported format version {header.get('version')}.")
+
+    def records():
+        with stream:
+            for line in stream:
+                if line.strip():
+                    yield json.loads(line)
+
+    return header, records()
@@ -1,6 +1,8 @@
 import os
 import send2trash
 
+from core.archives import file_size, image_source, is_member
+
 def format_size(size_bytes):
     """Formats file size in bytes to human readable string."""
     for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
@@ -9,8 +11,22 @@ def format_size(size_bytes):
         size_bytes /= 1024.0
     return f"{size_bytes:.2f} PB"
 
+def format_duration(seconds):
+    """Formats a duration in seconds as a short string such as ``4m 05s``."""
+    seconds = max(0, int(round(seconds)))
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m {seconds:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m"
+
 def safe_delete(file_path):
     """Sends the file to the recycle bin."""
+    if is_member(file_path):
+        print(f"Error deleting {file_path}: images inside archives cannot be deleted individually")
+        return False
     try:
         # Normalize path to fix mixed slashes and ensure absolute path
         file_path = os.path.normpath(os.path.abspath(file_path))
@@ -23,7 +39,7 @@ def safe_delete(file_path):
 def get_file_size(file_path):
     """Returns file size in bytes."""
     try:
-        return os.path.getsize(file_path)
+        return file_size(file_path)
     except OSError:
         return 0
 
@@ -31,8 +47,8 @@ def get_image_quality(file_path):
     """Return metadata used to choose a sensible default keeper."""
     try:
         from PIL import Image
-        with Image.open(file_path) as image:
+        with Image.open(image_source(file_path)) as image:
             pixels = image.width * image.height
-        return pixels, os.path.getsize(file_path), -len(file_path), file_path.casefold()
+        return pixels, file_size(file_path), -len(file_path), file_path.casefold()
     except (OSError, ValueError):
         return 0, get_file_size(file_path), -len(file_path), file_path.casefold()
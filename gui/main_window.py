@@ -1,13 +1,19 @@
+import hashlib
+import json
 import os
 import sys
 import time
 from PyQt5.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                              QPushButton, QFileDialog, QScrollArea, QLabel, 
-                             QProgressBar, QMessageBox, QCheckBox, QSlider, QSpinBox, QFrame)
+                             QProgressBar, QMessageBox, QCheckBox, QSlider, QSpinBox, QFrame, QComboBox)
 from PyQt5.QtGui import QPixmap, QIcon
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtCore import Qt, QSettings, QStandardPaths, QThread, QTimer, pyqtSignal
+from core.archives import close_archives
+from core.checkpoint import discard_checkpoint
+from core.digestset import DigestSet
 from core.scanner import ImageScanner, ScanCancelled
-from core.utils import format_size, safe_delete
+from core.session import ScanSession
+from core.utils import format_duration, format_size, safe_delete
 from gui.widgets import DuplicateGroupWidget
 
 class ScanThread(QThread):
@@ -16,13 +22,27 @@ class ScanThread(QThread):
     scan_complete = pyqtSignal(dict)
     scan_failed = pyqtSignal(str)
     scan_cancelled = pyqtSignal()
+    scan_paused = pyqtSignal()
     skipped_files = pyqtSignal(list)
 
-    def __init__(self, folder_path, threshold=0):
+    def __init__(
+        self, folder_paths, threshold=0, disk_order=False, checkpoint_path=None, pixel_identical=False
+    ):
         super().__init__()
-        self.folder_path = folder_path
+        self.folder_paths = folder_paths
         self.threshold = threshold
+        self.pixel_identical = pixel_identical
+        self.checkpoint_path = checkpoint_path
+        self.pause_requested = False
         self.scanner = ImageScanner()
+        self.scanner.autotune = True
+        if disk_order:
+            self.scanner.processing_order = "directory"
+
+    def pause(self):
+        """Stop the scan, keeping its checkpoint so a later scan resumes it."""
+        self.pause_requested = True
+        self.requestInterruption()
 
     def run(self):
         def callback(current, total, current_file):
@@ -30,19 +50,51 @@ class ScanThread(QThread):
         
         try:
             duplicates = self.scanner.scan_directory(
-                self.folder_path,
+                self.folder_paths,
                 callback,
                 similarity=self.threshold,
                 cancel_check=self.isInterruptionRequested,
                 discovery_callback=lambda count, folder: self.discovery_update.emit(count, folder),
+                checkpoint_path=self.checkpoint_path,
+                pixel_identical=self.pixel_identical,
             )
             self.skipped_files.emit(self.scanner.skipped_files)
             self.scan_complete.emit(duplicates)
         except ScanCancelled:
+            if self.pause_requested and self.checkpoint_path:
+                self.scan_paused.emit()
+                return
+            if self.checkpoint_path:
+                discard_checkpoint(self.checkpoint_path)
             self.scan_cancelled.emit()
         except Exception as error:
             self.scan_failed.emit(str(error))
 
+class EstimateThread(QThread):
+    plan_ready = pyqtSignal(object)
+    plan_failed = pyqtSignal(str)
+
+    def __init__(self, folder_paths, threshold=0, pixel_identical=False):
+        super().__init__()
+        self.folder_paths = folder_paths
+        self.threshold = threshold
+        self.pixel_identical = pixel_identical
+        self.scanner = ImageScanner()
+
+    def run(self):
+        try:
+            plan = self.scanner.plan_scan(
+                self.folder_paths,
+                similarity=self.threshold,
+                pixel_identical=self.pixel_identical,
+                cancel_check=self.isInterruptionRequested,
+            )
+            self.plan_ready.emit(plan)
+        except ScanCancelled:
+            pass
+        except Exception as error:
+            self.plan_failed.emit(str(error))
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -64,6 +116,16 @@ class MainWindow(QMainWindow):
         self.skipped_count = 0
         self.scan_started_at = None
         self.hashing_started_at = None
+        # Scanner of the last completed scan, kept so the threshold can be
+        # changed by regrouping its stored pair scores instead of rescanning.
+        self.last_scanner = None
+        # Session shown by Open Session, saved again with only its review state updated.
+        self.reopened_session = None
+        self.settings = QSettings("TwinHunter", "TwinHunter")
+        self.regroup_timer = QTimer(self)
+        self.regroup_timer.setSingleShot(True)
+        self.regroup_timer.setInterval(250)
+        self.regroup_timer.timeout.connect(self.regroup_results)
         self.init_ui()
 
     def get_dark_theme(self):
@@ -216,20 +278,43 @@ class MainWindow(QMainWindow):
         top_bar = QHBoxLayout(toolbar_card)
         top_bar.setContentsMargins(14, 12, 14, 12)
         top_bar.setSpacing(10)
-        self.path_label = QLabel("No folder selected (Drag folder here)")
+        self.path_label = QLabel("No folder selected (Drag folders here)")
         self.path_label.setObjectName("pathPill")
-        self.path_label.setToolTip("Choose a folder or drag one anywhere onto this window")
+        self.path_label.setToolTip("Choose a folder or drag one or more anywhere onto this window")
         
         select_btn = QPushButton("Select Folder")
         select_btn.clicked.connect(self.select_folder)
+
+        self.add_folder_btn = QPushButton("Add Folder")
+        self.add_folder_btn.setToolTip("Also scan another folder, to find duplicates across both")
+        self.add_folder_btn.clicked.connect(self.add_folder)
+        self.add_folder_btn.setEnabled(False)
         
         self.scan_btn = QPushButton("Scan Now")
         self.scan_btn.setObjectName("primaryButton")
         self.scan_btn.clicked.connect(self.start_scan)
         self.scan_btn.setEnabled(False)
+
+        self.estimate_btn = QPushButton("Estimate")
+        self.estimate_btn.setToolTip("Predict how long the scan will take and how much memory it needs")
+        self.estimate_btn.clicked.connect(self.estimate_scan)
+        self.estimate_btn.setEnabled(False)
         
+        open_session_btn = QPushButton("Open Session")
+        open_session_btn.setToolTip("Reopen saved results without rescanning")
+        open_session_btn.clicked.connect(self.open_session)
+
+        self.save_session_btn = QPushButton("Save Session")
+        self.save_session_btn.setToolTip("Save these results, keepers and selections to review later")
+        self.save_session_btn.clicked.connect(self.save_session)
+        self.save_session_btn.setEnabled(False)
+
         top_bar.addWidget(self.path_label, 1)
         top_bar.addWidget(select_btn)
+        top_bar.addWidget(self.add_folder_btn)
+        top_bar.addWidget(open_session_btn)
+        top_bar.addWidget(self.save_session_btn)
+        top_bar.addWidget(self.estimate_btn)
         top_bar.addWidget(self.scan_btn)
         
         main_layout.addWidget(toolbar_card)
@@ -262,7 +347,55 @@ class MainWindow(QMainWindow):
         # Sync slider and spinbox
         self.threshold_slider.valueChanged.connect(self.threshold_spin.setValue)
         self.threshold_spin.valueChanged.connect(self.threshold_slider.setValue)
+        self.threshold_spin.valueChanged.connect(lambda _: self.regroup_timer.start())
         
+        self.pixels_check = QCheckBox("Identical pixels")
+        self.pixels_check.setToolTip(
+            "Match files with the same decoded image even if their metadata or lossless encoding differs"
+        )
+        self.pixels_check.toggled.connect(self.pixel_mode_toggled)
+        settings_layout.addWidget(self.pixels_check)
+
+        self.shape_check = QCheckBox("Same shape only")
+        self.shape_check.setToolTip(
+            "Compare only images of similar shape. Scans faster but misses crops and stretched copies"
+        )
+        settings_layout.addWidget(self.shape_check)
+
+        self.coarse_check = QCheckBox("Thumbnail pre-pass")
+        self.coarse_check.setToolTip(
+            "Compare embedded camera thumbnails first and fully decode only likely matches. "
+            "Much faster on large photo libraries"
+        )
+        settings_layout.addWidget(self.coarse_check)
+
+        self.archives_check = QCheckBox("Look inside archives")
+        self.archives_check.setToolTip(
+            "Also scan images inside ZIP and TAR files, read in place without extracting them"
+        )
+        settings_layout.addWidget(self.archives_check)
+
+        self.scope_combo = QComboBox()
+        # Item data holds the ImageScanner.comparison_scope value.
+        self.scope_combo.addItem("Compare all pairs", "all")
+        self.scope_combo.addItem("Across folders only", "cross-folder")
+        self.scope_combo.addItem("Within folders only", "within-folder")
+        self.scope_combo.setToolTip(
+            "Across folders compares only images in different selected folders, or in different "
+            "top-level subfolders of a single folder. Within folders compares only images in the same folder"
+        )
+        settings_layout.addWidget(self.scope_combo)
+
+        self.known_btn = QPushButton("Known digests…")
+        self.known_btn.clicked.connect(self.choose_known_digests)
+        settings_layout.addWidget(self.known_btn)
+        self.known_digests = []
+        # QSettings may return a single saved path as a plain string.
+        known_paths = self.settings.value("known_digests", []) or []
+        if isinstance(known_paths, str):
+            known_paths = [known_paths]
+        self.set_known_digests(known_paths, report_errors=False)
+
         settings_layout.addSpacing(8)
         mode_hint = QLabel("100% = identical files   •   85% = balanced visual matching   •   75% = broader scene matching")
         mode_hint.setObjectName("appSubtitle")
@@ -293,7 +426,18 @@ class MainWindow(QMainWindow):
         self.cancel_btn = QPushButton("Cancel Scan")
         self.cancel_btn.clicked.connect(self.cancel_scan)
         self.cancel_btn.setVisible(False)
-        progress_layout.addWidget(self.cancel_btn, 0, Qt.AlignCenter)
+
+        self.pause_btn = QPushButton("Pause Scan")
+        self.pause_btn.setToolTip("Stop now and continue from the same point with Resume Scan")
+        self.pause_btn.clicked.connect(self.pause_scan)
+        self.pause_btn.setVisible(False)
+
+        scan_controls = QHBoxLayout()
+        scan_controls.addStretch()
+        scan_controls.addWidget(self.pause_btn)
+        scan_controls.addWidget(self.cancel_btn)
+        scan_controls.addStretch()
+        progress_layout.addLayout(scan_controls)
         
         self.status_label = QLabel("")
         self.status_label.setAlignment(Qt.AlignCenter)
@@ -302,6 +446,10 @@ class MainWindow(QMainWindow):
         self.preview_check = QCheckBox("Show Live Preview (May slow down scanning)")
         self.preview_check.setChecked(True)
         progress_layout.addWidget(self.preview_check, 0, Qt.AlignCenter)
+
+        self.disk_order_check = QCheckBox("Read files in on-disk order (faster on hard drives and NAS)")
+        self.disk_order_check.setToolTip("Results are identical; only the order files are read in changes")
+        progress_layout.addWidget(self.disk_order_check, 0, Qt.AlignCenter)
         
         main_layout.addLayout(progress_layout)
 
@@ -370,16 +518,49 @@ class MainWindow(QMainWindow):
                 # We should remove that and use the global stylesheet with class selector.
                 pass
 
+    @staticmethod
+    def roots_key(folder_paths):
+        """Return a stable key for scans of ``folder_paths``."""
+        roots = "\n".join(os.path.normcase(os.path.abspath(path)) for path in folder_paths)
+        return hashlib.sha1(roots.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def checkpoint_path(folder_paths):
+        """Return where progress of scans of ``folder_paths`` is saved."""
+        data_dir = QStandardPaths.writableLocation(QStandardPaths.GenericDataLocation) or os.path.expanduser("~")
+        checkpoint_dir = os.path.join(data_dir, "TwinHunter", "checkpoints")
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        return os.path.join(checkpoint_dir, f"{MainWindow.roots_key(folder_paths)}.twinstate")
+
+    def update_scan_button(self):
+        paused = os.path.exists(self.checkpoint_path(self.folder_paths))
+        self.scan_btn.setText("Resume Scan" if paused else "Scan Now")
+
+    def set_folders(self, folder_paths):
+        """Scan ``folder_paths`` together; nested and repeated folders are scanned once."""
+        self.folder_paths = list(folder_paths)
+        self.path_label.setText("  •  ".join(self.folder_paths))
+        self.path_label.setToolTip("\n".join(self.folder_paths))
+        self.scan_btn.setEnabled(True)
+        self.estimate_btn.setEnabled(True)
+        self.add_folder_btn.setEnabled(True)
+        self.update_scan_button()
+        self.last_scanner = None
+        self.clear_results()
+
     def select_folder(self):
         folder = QFileDialog.getExistingDirectory(self, "Select Folder")
         if folder:
-            self.folder_path = folder
-            self.path_label.setText(folder)
-            self.scan_btn.setEnabled(True)
-            self.clear_results()
+            self.set_folders([folder])
+
+    def add_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Add Folder")
+        if folder and folder not in self.folder_paths:
+            self.set_folders(self.folder_paths + [folder])
 
     def start_scan(self):
         self.clear_results()
+        self.last_scanner = None
         self.skipped_count = 0
         self.scan_started_at = time.monotonic()
         self.hashing_started_at = None
@@ -389,29 +570,68 @@ class MainWindow(QMainWindow):
         if self.preview_check.isChecked():
             self.preview_label.setVisible(True)
         self.scan_btn.setEnabled(False)
+        self.estimate_btn.setEnabled(False)
         self.cancel_btn.setVisible(True)
+        self.pause_btn.setVisible(True)
         self.stats_label.setText("Scanning...")
         
-        threshold = self.threshold_slider.value()
-        self.thread = ScanThread(self.folder_path, threshold)
+        pixel_identical = self.pixels_check.isChecked()
+        threshold = 100 if pixel_identical else self.threshold_slider.value()
+        self.thread = ScanThread(
+            self.folder_paths,
+            threshold,
+            self.disk_order_check.isChecked(),
+            self.checkpoint_path(self.folder_paths),
+            pixel_identical,
+        )
+        self.apply_scan_options(self.thread.scanner)
         self.thread.progress_update.connect(self.update_progress)
         self.thread.discovery_update.connect(self.update_discovery)
         self.thread.scan_complete.connect(self.scan_finished)
         self.thread.scan_failed.connect(self.scan_failed)
         self.thread.scan_cancelled.connect(self.scan_cancelled)
+        self.thread.scan_paused.connect(self.scan_paused)
         self.thread.skipped_files.connect(self.record_skipped_files)
         self.thread.start()
 
-    @staticmethod
-    def format_duration(seconds):
-        seconds = max(0, int(round(seconds)))
-        if seconds < 60:
-            return f"{seconds}s"
-        minutes, seconds = divmod(seconds, 60)
-        if minutes < 60:
-            return f"{minutes}m {seconds:02d}s"
-        hours, minutes = divmod(minutes, 60)
-        return f"{hours}h {minutes:02d}m"
+    def apply_scan_options(self, scanner):
+        """Set up ``scanner`` with the options chosen in the window and the saved tuning."""
+        scanner.aspect_blocking = self.shape_check.isChecked()
+        scanner.scan_archives = self.archives_check.isChecked()
+        scanner.coarse_to_fine = self.coarse_check.isChecked()
+        scanner.known_digests = self.known_digests
+        scanner.comparison_scope = self.scope_combo.currentData()
+        tuning = self.settings.value(f"tuning/{self.roots_key(self.folder_paths)}")
+        if tuning:
+            try:
+                scanner.apply_tuning(json.loads(tuning))
+            except ValueError:
+                # Settings saved by another version are ignored; tuning starts afresh.
+                pass
+
+    def estimate_scan(self):
+        pixel_identical = self.pixels_check.isChecked()
+        threshold = 100 if pixel_identical else self.threshold_slider.value()
+        self.estimate_thread = EstimateThread(self.folder_paths, threshold, pixel_identical)
+        self.apply_scan_options(self.estimate_thread.scanner)
+        self.estimate_thread.plan_ready.connect(self.estimate_finished)
+        self.estimate_thread.plan_failed.connect(self.estimate_failed)
+        # A scan started meanwhile keeps the button disabled until it ends.
+        self.estimate_thread.finished.connect(lambda: self.estimate_btn.setEnabled(self.scan_btn.isEnabled()))
+        self.estimate_btn.setEnabled(False)
+        self.stats_label.setText("Estimating scan cost from a sample of images…")
+        self.estimate_thread.start()
+
+    def estimate_finished(self, plan):
+        self.stats_label.setText(
+            f"Estimated scan: {format_duration(plan.total_seconds)} • "
+            f"{format_size(plan.peak_memory_bytes)} peak memory"
+        )
+        QMessageBox.information(self, "Scan Estimate", "\n".join(plan.describe()))
+
+    def estimate_failed(self, message):
+        self.stats_label.setText("Estimate failed")
+        QMessageBox.critical(self, "Estimate Failed", message or "The scan could not be estimated.")
 
     def update_discovery(self, count, folder):
         self.status_label.setText(
@@ -422,8 +642,16 @@ class MainWindow(QMainWindow):
         if hasattr(self, "thread") and self.thread.isRunning():
             self.thread.requestInterruption()
             self.cancel_btn.setEnabled(False)
+            self.pause_btn.setEnabled(False)
             self.status_label.setText("Cancelling…")
 
+    def pause_scan(self):
+        if hasattr(self, "thread") and self.thread.isRunning():
+            self.thread.pause()
+            self.cancel_btn.setEnabled(False)
+            self.pause_btn.setEnabled(False)
+            self.status_label.setText("Saving progress…")
+
     def record_skipped_files(self, skipped_files):
         self.skipped_count = len(skipped_files)
 
@@ -432,8 +660,12 @@ class MainWindow(QMainWindow):
         self.preview_label.setVisible(False)
         self.cancel_btn.setVisible(False)
         self.cancel_btn.setEnabled(True)
+        self.pause_btn.setVisible(False)
+        self.pause_btn.setEnabled(True)
         self.status_label.setText("")
         self.scan_btn.setEnabled(True)
+        self.estimate_btn.setEnabled(True)
+        self.update_scan_button()
 
     def scan_failed(self, message):
         self.reset_scan_controls()
@@ -444,6 +676,10 @@ class MainWindow(QMainWindow):
         self.reset_scan_controls()
         self.stats_label.setText("Scan cancelled")
 
+    def scan_paused(self):
+        self.reset_scan_controls()
+        self.stats_label.setText("Scan paused • Resume Scan continues where it stopped")
+
     def update_progress(self, current, total, current_file):
         if self.hashing_started_at is None:
             self.hashing_started_at = time.monotonic()
@@ -452,7 +688,7 @@ class MainWindow(QMainWindow):
         elapsed = time.monotonic() - self.hashing_started_at
         if current >= 3 and elapsed > 0:
             remaining = (elapsed / current) * (total - current)
-            eta = f"ETA {self.format_duration(remaining)}"
+            eta = f"ETA {format_duration(remaining)}"
         else:
             eta = "Estimating time…"
         self.progress_bar.setFormat(f"{current:,} / {total:,}   •   {eta}")
@@ -463,22 +699,154 @@ class MainWindow(QMainWindow):
             if not pixmap.isNull():
                 self.preview_label.setPixmap(pixmap.scaled(100, 100, Qt.KeepAspectRatio))
 
+    def choose_known_digests(self):
+        set_paths, _ = QFileDialog.getOpenFileNames(
+            self, "Known Digests", "", "TwinHunter digest sets (*.twindigests)"
+        )
+        self.set_known_digests(set_paths)
+
+    def set_known_digests(self, set_paths, report_errors=True):
+        """Check exact scans against the digest sets at ``set_paths``; an empty list stops checking."""
+        known_digests = []
+        for set_path in set_paths:
+            try:
+                known_digests.append(DigestSet.open(set_path))
+            except (OSError, ValueError) as error:
+                if report_errors:
+                    QMessageBox.critical(
+                        self, "Open Failed", f"The digest set could not be opened.\n\n{error}"
+                    )
+        self.known_digests = known_digests
+        self.settings.setValue("known_digests", [digest_set.set_path for digest_set in known_digests])
+        names = ", ".join(digest_set.name for digest_set in known_digests)
+        label = f"Known digests ({len(known_digests)})" if known_digests else "Known digests…"
+        self.known_btn.setText(label)
+        self.known_btn.setToolTip(
+            (f"Checking {names}. " if known_digests else "")
+            + "Exact scans also report files listed in digest sets made with import-digests. "
+            "Cancel the dialog to stop checking"
+        )
+
+    def pixel_mode_toggled(self, checked):
+        # Pixel matching is all-or-nothing, so the similarity threshold does not apply.
+        self.threshold_slider.setEnabled(not checked)
+        self.threshold_spin.setEnabled(not checked)
+        self.shape_check.setEnabled(not checked)
+        self.coarse_check.setEnabled(not checked)
+
+    def can_regroup(self, threshold):
+        scanner = self.last_scanner
+        return (
+            scanner is not None
+            and scanner.edge_floor is not None
+            and scanner.edge_floor <= threshold < 100
+            and not self.pixels_check.isChecked()
+            and not (hasattr(self, "thread") and self.thread.isRunning())
+        )
+
+    def regroup_results(self):
+        threshold = self.threshold_slider.value()
+        if not self.can_regroup(threshold):
+            return
+        started_at = time.monotonic()
+        duplicates = self.last_scanner.regroup(threshold)
+        self.clear_results()
+        self.show_results(duplicates, time.monotonic() - started_at, regrouped=True)
+
     def scan_finished(self, duplicates):
-        self.duplicates = duplicates
+        self.last_scanner = self.thread.scanner
+        tuning = self.last_scanner.metrics.get("tuning")
+        if tuning:
+            # The next scan of these folders starts from the settings tuned for their disk.
+            self.settings.setValue(f"tuning/{self.roots_key(self.folder_paths)}", json.dumps(tuning))
         self.reset_scan_controls()
-        
+        elapsed = time.monotonic() - self.scan_started_at if self.scan_started_at else 0
+        self.show_results(duplicates, elapsed)
+        ignored = self.last_scanner.metrics.get("checkpoint_ignored")
+        if ignored:
+            QMessageBox.information(self, "Paused Scan Not Resumed", ignored)
+
+    def group_widgets(self):
+        for i in range(self.results_layout.count()):
+            widget = self.results_layout.itemAt(i).widget()
+            if isinstance(widget, DuplicateGroupWidget):
+                yield widget
+
+    def save_session(self):
+        if not self.duplicates:
+            return
+        session_path, _ = QFileDialog.getSaveFileName(
+            self, "Save Session", "", "TwinHunter sessions (*.twinsession)"
+        )
+        if not session_path:
+            return
+        session = self.reopened_session
+        if session is None:
+            pixel_identical = self.pixels_check.isChecked()
+            similarity = 100 if pixel_identical else self.threshold_slider.value()
+            session = ScanSession.from_scan(
+                self.last_scanner, self.folder_paths, similarity, self.duplicates, pixel_identical
+            )
+        keepers = {}
+        selected = set()
+        for widget in self.group_widgets():
+            keepers[widget.group_id] = widget.keeper_path()
+            selected.update(widget.get_selected_files())
+        session.set_review(keepers, selected)
+        try:
+            session.save(session_path)
+        except OSError as error:
+            QMessageBox.critical(self, "Save Failed", f"The session could not be saved.\n\n{error}")
+            return
+        self.stats_label.setText(f"Session saved to {os.path.basename(session_path)}")
+
+    def open_session(self):
+        session_path, _ = QFileDialog.getOpenFileName(
+            self, "Open Session", "", "TwinHunter sessions (*.twinsession)"
+        )
+        if not session_path:
+            return
+        started_at = time.monotonic()
+        try:
+            session = ScanSession.load(session_path)
+        except (OSError, ValueError) as error:
+            QMessageBox.critical(self, "Open Failed", f"The session could not be opened.\n\n{error}")
+            return
+        self.set_folders(session.roots)
+        self.skipped_count = 0
+        self.pixels_check.setChecked(session.pixel_identical)
+        self.threshold_slider.setValue(session.similarity)
+        self.show_results(session.groups, time.monotonic() - started_at, session=session)
+        # Saving again starts from the loaded session, not from a rescan of the files.
+        self.reopened_session = session
+
+    def show_results(self, duplicates, elapsed, regrouped=False, session=None):
+        self.duplicates = duplicates
+        self.save_session_btn.setEnabled(bool(duplicates))
+        action = f"Regrouped at {self.threshold_slider.value()}%" if regrouped else ""
+        statuses = {}
+        if session is not None:
+            # Only a stat per file; reopened results are never rehashed.
+            statuses = session.check_files()
+            action = "Reopened session"
+            if statuses:
+                action += f" • {len(statuses)} files changed or missing"
         total_dupes = 0
         total_size = 0
         
         if not duplicates:
-            QMessageBox.information(self, "Scan Complete", "No duplicate images found.")
+            if not regrouped and session is None:
+                QMessageBox.information(self, "Scan Complete", "No duplicate images found.")
             skipped = f" ({self.skipped_count} unreadable files skipped)" if self.skipped_count else ""
-            elapsed = time.monotonic() - self.scan_started_at if self.scan_started_at else 0
-            self.stats_label.setText(f"No matches found{skipped} • {self.format_duration(elapsed)}")
+            prefix = f"{action} • " if action else ""
+            self.stats_label.setText(f"{prefix}No matches found{skipped} • {format_duration(elapsed)}")
             return
 
         for hash_val, files in duplicates.items():
-            group_widget = DuplicateGroupWidget(hash_val, files)
+            keeper = session.keepers.get(hash_val) if session is not None else None
+            group_widget = DuplicateGroupWidget(hash_val, files, keeper=keeper)
+            if session is not None:
+                group_widget.restore_review(session.selected, statuses)
             self.results_layout.addWidget(group_widget)
             
             # Stats (count all but one as potential savings)
@@ -494,13 +862,19 @@ class MainWindow(QMainWindow):
             # Estimate saved space: sum of all files - sum of 1 file per group (approx)
             # Let's just show total size of ALL duplicates for now.
             total_size += group_size
+        # Thumbnails are loaded; let go of archives so they can be moved or deleted.
+        close_archives()
 
         skipped = f" • {self.skipped_count} skipped" if self.skipped_count else ""
-        elapsed = time.monotonic() - self.scan_started_at if self.scan_started_at else 0
+        prefix = f"{action} • " if action else ""
         self.stats_label.setText(
-            f"Found {len(duplicates)} groups ({total_dupes} files) • Reviewed size: "
-            f"{format_size(total_size)} • {self.format_duration(elapsed)}{skipped}"
+            f"{prefix}Found {len(duplicates)} groups ({total_dupes} files) • Reviewed size: "
+            f"{format_size(total_size)} • {format_duration(elapsed)}{skipped}"
         )
+        bottleneck = self.last_scanner.metrics.get("bottleneck") if self.last_scanner else None
+        if bottleneck and not regrouped and session is None:
+            limit = "disk reads" if bottleneck == "io" else "image decoding"
+            self.stats_label.setToolTip(f"Scanning was limited by {limit}")
 
     def clear_results(self):
         while self.results_layout.count():
@@ -508,24 +882,23 @@ class MainWindow(QMainWindow):
             if child.widget():
                 child.widget().deleteLater()
         self.duplicates = {}
+        self.reopened_session = None
+        self.save_session_btn.setEnabled(False)
 
     def delete_selected(self):
-        files_to_delete = []
-        for i in range(self.results_layout.count()):
-            widget = self.results_layout.itemAt(i).widget()
-            if isinstance(widget, DuplicateGroupWidget):
-                files_to_delete.extend(widget.get_selected_files())
-        
+        # A file can appear in several groups, such as an exact group and a known digest set.
+        files_to_delete = list(
+            dict.fromkeys(path for widget in self.group_widgets() for path in widget.get_selected_files())
+        )
+
         if not files_to_delete:
             QMessageBox.warning(self, "No Selection", "Please select images to delete.")
             return
 
-        for i in range(self.results_layout.count()):
-            widget = self.results_layout.itemAt(i).widget()
-            if isinstance(widget, DuplicateGroupWidget):
-                if widget.keeper_path() in widget.get_selected_files():
-                    QMessageBox.critical(self, "Unsafe Selection", "Every group must retain its chosen keeper.")
-                    return
+        selected = set(files_to_delete)
+        if any(widget.keeper_path() in selected for widget in self.group_widgets()):
+            QMessageBox.critical(self, "Unsafe Selection", "Every group must retain its chosen keeper.")
+            return
 
         confirm = QMessageBox.question(self, "Confirm Delete", 
                                      f"Are you sure you want to delete {len(files_to_delete)} files?\nThey will be moved to the Recycle Bin.",
@@ -559,10 +932,13 @@ class MainWindow(QMainWindow):
         if not self.duplicates:
             return
             
-        for i in range(self.results_layout.count()):
-            widget = self.results_layout.itemAt(i).widget()
-            if isinstance(widget, DuplicateGroupWidget):
-                widget.select_all_except_first()
+        # Files of known digest sets can also sit in an ordinary group, whose
+        # keeper decides which copy stays; they are left to that group.
+        grouped = {
+            path for widget in self.group_widgets() if widget.known_set is None for path in widget.files
+        }
+        for widget in self.group_widgets():
+            widget.select_all_except_keeper(grouped if widget.known_set is not None else ())
 
     def deselect_all_duplicates(self):
         if not self.duplicates:
@@ -583,13 +959,11 @@ class MainWindow(QMainWindow):
         event.ignore()
 
     def dropEvent(self, event):
-        for url in event.mimeData().urls():
-            if url.isLocalFile():
-                path = url.toLocalFile()
-                if os.path.isdir(path):
-                    self.folder_path = path
-                    self.path_label.setText(path)
-                    self.scan_btn.setEnabled(True)
-                    self.clear_results()
-                    # Optional: Auto-start scan? Let's wait for user to click scan.
-                    break
+        # Every dropped folder is scanned; duplicates are found across all of them.
+        folders = [
+            url.toLocalFile()
+            for url in event.mimeData().urls()
+            if url.isLocalFile() and os.path.isdir(url.toLocalFile())
+        ]
+        if folders:
+            self.set_folders(folders)
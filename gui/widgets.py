@@ -14,9 +14,23 @@ from PyQt5.QtWidgets import (
     QWidget,
 )
 
+from core.archives import image_source, is_member, read_bytes
+from core.digestset import known_set_name
 from core.utils import format_size, get_file_size, get_image_quality
 
 
+def load_pixmap(file_path):
+    """Load an image file, or an image inside an archive, for display."""
+    if not is_member(file_path):
+        return QPixmap(file_path)
+    pixmap = QPixmap()
+    try:
+        pixmap.loadFromData(read_bytes(file_path))
+    except OSError:
+        pass
+    return pixmap
+
+
 class HoverImageLabel(QLabel):
     """Thumbnail that shows a larger, non-interactive preview on hover."""
 
@@ -26,7 +40,7 @@ class HoverImageLabel(QLabel):
         self.popup = None
 
     def enterEvent(self, event):
-        pixmap = QPixmap(self.file_path)
+        pixmap = load_pixmap(self.file_path)
         if pixmap.isNull():
             return super().enterEvent(event)
 
@@ -60,6 +74,8 @@ class ImageItemWidget(QWidget):
     def __init__(self, file_path, parent=None):
         super().__init__(parent)
         self.file_path = file_path
+        # Archives are rewritten as a whole, so their images cannot be deleted one by one.
+        self.deletable = not is_member(file_path)
         self.setObjectName("imageCard")
         self.setFixedWidth(202)
         self.init_ui()
@@ -74,7 +90,7 @@ class ImageItemWidget(QWidget):
         self.image_label.setObjectName("imageLabel")
         self.image_label.setToolTip("Hover to enlarge")
 
-        pixmap = QPixmap(self.file_path)
+        pixmap = load_pixmap(self.file_path)
         if not pixmap.isNull():
             self.image_label.setPixmap(
                 pixmap.scaled(168, 148, Qt.KeepAspectRatio, Qt.SmoothTransformation)
@@ -99,7 +115,7 @@ class ImageItemWidget(QWidget):
 
         try:
             from PIL import Image
-            with Image.open(self.file_path) as image:
+            with Image.open(image_source(self.file_path)) as image:
                 dimensions = f"{image.width} × {image.height}"
         except (OSError, ValueError):
             dimensions = "Unknown dimensions"
@@ -116,7 +132,8 @@ class ImageItemWidget(QWidget):
         self.keep_radio = QRadioButton("Keep this image")
         self.keep_radio.toggled.connect(self._keeper_changed)
         layout.addWidget(self.keep_radio)
-        self.checkbox = QCheckBox("Move to Recycle Bin")
+        self.checkbox = QCheckBox("Move to Recycle Bin" if self.deletable else "Inside an archive")
+        self.checkbox.setEnabled(self.deletable)
         layout.addWidget(self.checkbox)
 
     def _keeper_changed(self, checked):
@@ -125,17 +142,30 @@ class ImageItemWidget(QWidget):
             self.checkbox.setEnabled(False)
             self.keeper_selected.emit(self)
         else:
-            self.checkbox.setEnabled(True)
+            self.checkbox.setEnabled(self.deletable)
 
     def is_checked(self):
         return self.checkbox.isChecked()
 
+    def mark_status(self, status):
+        """Flag a file that changed or disappeared since a saved session."""
+        label = QLabel("Missing since saved" if status == "missing" else "Changed since saved")
+        label.setObjectName("infoLabel")
+        label.setStyleSheet("color: #e0a43c;")
+        self.layout().insertWidget(self.layout().count() - 2, label)
+        if status == "missing":
+            self.checkbox.setChecked(False)
+            self.checkbox.setEnabled(False)
+
 
 class DuplicateGroupWidget(QFrame):
-    def __init__(self, group_id, files, parent=None):
+    def __init__(self, group_id, files, parent=None, keeper=None):
         super().__init__(parent)
         self.group_id = group_id
         self.files = sorted(files, key=str.casefold)
+        self.initial_keeper = keeper
+        # Files matching a known digest set duplicate a file kept elsewhere, so none needs keeping here.
+        self.known_set = known_set_name(group_id)
         self.setObjectName("duplicateGroup")
         self.setFrameShape(QFrame.StyledPanel)
         self.init_ui()
@@ -145,14 +175,17 @@ class DuplicateGroupWidget(QFrame):
         layout.setContentsMargins(16, 14, 16, 16)
         layout.setSpacing(12)
         header_layout = QHBoxLayout()
-        header = QLabel(f"Match group  ·  {len(self.files)} images")
+        if self.known_set is not None:
+            header = QLabel(f"Known file in {self.known_set}  ·  {len(self.files)} images")
+        else:
+            header = QLabel(f"Match group  ·  {len(self.files)} images")
         header.setObjectName("groupHeader")
         header.setStyleSheet("font-weight: bold;")
         header_layout.addWidget(header)
         header_layout.addStretch()
 
         select_copies_btn = QPushButton("Select copies")
-        select_copies_btn.clicked.connect(self.select_all_except_keeper)
+        select_copies_btn.clicked.connect(lambda: self.select_all_except_keeper())
         header_layout.addWidget(select_copies_btn)
         deselect_btn = QPushButton("Deselect All")
         deselect_btn.clicked.connect(self.deselect_all)
@@ -171,18 +204,23 @@ class DuplicateGroupWidget(QFrame):
             widget = ImageItemWidget(file_path)
             widget.keeper_selected.connect(self._keeper_selected)
             self.keeper_group.addButton(widget.keep_radio)
+            widget.keep_radio.setVisible(self.known_set is None)
             images_layout.addWidget(widget)
             self.image_widgets.append(widget)
         layout.addLayout(images_layout)
 
+        if self.known_set is not None:
+            return
         # Default to the highest-resolution/largest image, never traversal order.
-        keeper = max(self.image_widgets, key=lambda item: get_image_quality(item.file_path))
+        keeper = next((item for item in self.image_widgets if item.file_path == self.initial_keeper), None)
+        if keeper is None:
+            keeper = max(self.image_widgets, key=lambda item: get_image_quality(item.file_path))
         keeper.keep_radio.setChecked(True)
 
     def _keeper_selected(self, keeper):
         for widget in self.image_widgets:
             if widget is not keeper:
-                widget.checkbox.setEnabled(True)
+                widget.checkbox.setEnabled(widget.deletable)
 
     def get_selected_files(self):
         return [widget.file_path for widget in self.image_widgets if widget.is_checked()]
@@ -193,9 +231,12 @@ class DuplicateGroupWidget(QFrame):
                 return widget.file_path
         return None
 
-    def select_all_except_keeper(self):
+    def select_all_except_keeper(self, excluded=()):
+        """Select every deletable file except the keeper and the files in ``excluded``."""
         for widget in self.image_widgets:
-            widget.checkbox.setChecked(not widget.keep_radio.isChecked())
+            widget.checkbox.setChecked(
+                widget.deletable and not widget.keep_radio.isChecked() and widget.file_path not in excluded
+            )
 
     # Compatibility with the main-window action name.
     select_all_except_first = select_all_except_keeper
@@ -203,3 +244,11 @@ class DuplicateGroupWidget(QFrame):
     def deselect_all(self):
         for widget in self.image_widgets:
             widget.checkbox.setChecked(False)
+
+    def restore_review(self, selected, statuses):
+        """Reapply saved selections and flag files that changed since the session was saved."""
+        for widget in self.image_widgets:
+            if widget.file_path in statuses:
+                widget.mark_status(statuses[widget.file_path])
+            if widget.file_path in selected and widget.checkbox.isEnabled():
+                widget.checkbox.setChecked(True)
@@ -0,0 +1,86 @@
+"""Measure lookup latency of the duplicate-lookup service from a local client.
+
+Indexes a folder, serves it on a local port and sends every image in the
+folder back as a lookup over one keep-alive connection, once as uploaded
+bytes and once by path, for exact and similar matching::
+
+    python scripts/benchmark_lookup_service.py D:\\Photos --similarity 90 --rounds 3
+"""
+
+import argparse
+import http.client
+import json
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core.scanner import ImageScanner  # noqa: E402
+from core.service import LookupService, make_server  # noqa: E402
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _measure(connection, requests):
+    latencies = []
+    for url, body, content_type in requests:
+        started = time.perf_counter()
+        connection.request("POST", url, body, {"Content-Type": content_type})
+        response = connection.getresponse()
+        payload = json.loads(response.read())
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status != 200:
+            raise SystemExit(f"Lookup failed: {payload['error']}")
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("folder")
+    parser.add_argument("--similarity", type=int, default=90)
+    parser.add_argument("--rounds", type=int, default=1, help="times to send every image")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    service = LookupService.build(args.folder)
+    print(f"Indexed {len(service.index):,} images in {time.perf_counter() - started:.1f} s")
+    paths = ImageScanner._collect_images(args.folder)
+    if not paths:
+        raise SystemExit("No images found.")
+
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    try:
+        for similarity in (100, args.similarity):
+            by_bytes = [
+                (f"/lookup?similarity={similarity}", Path(path).read_bytes(), "application/octet-stream")
+                for path in paths
+            ]
+            by_path = [
+                ("/lookup", json.dumps({"path": path, "similarity": similarity}), "application/json")
+                for path in paths
+            ]
+            for label, requests in (("bytes", by_bytes), ("path", by_path)):
+                latencies = _measure(connection, requests * args.rounds)
+                print(
+                    f"similarity {similarity:>3} by {label:<5}  n={len(latencies):<6}"
+                    f" mean {statistics.fmean(latencies):7.2f} ms"
+                    f"  p50 {_percentile(latencies, 0.5):7.2f} ms"
+                    f"  p95 {_percentile(latencies, 0.95):7.2f} ms"
+                    f"  p99 {_percentile(latencies, 0.99):7.2f} ms"
+                )
+    finally:
+        connection.close()
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,32 @@
+import http.client
+import io
+import itertools
+import json
 import os
 import shutil
+import struct
+import tarfile
 import tempfile
+import threading
 import unittest
+import zipfile
+import zlib
 
-from PIL import Image, ImageDraw, ImageEnhance
+import numpy as np
+from PIL import Image, ImageDraw, ImageEnhance, PngImagePlugin
 
-from core.scanner import ImageScanner, ScanCancelled
-from core.utils import format_size, get_image_quality
+from core.archives import split_member
+from core.autotune import ReadAheadTuner, fastest_block_size
+from core.batch import FingerprintBatcher
+from core.decode import DecodeScheduler
+from core.digestset import DigestSet, known_set_name
+from core.index import ReferenceIndex
+from core.pipeline import ReadAhead
+from core.scanner import ImageScanner, ScanCancelled, VisualFingerprint
+from core.service import LookupService, make_server
+from core.session import ScanSession
+from core.shards import merge_shards, scan_shard
+from core.utils import format_duration, format_size, get_file_size, get_image_quality
 
 
 class TestCore(unittest.TestCase):
@@ -52,6 +72,838 @@ class TestCore(unittest.TestCase):
         second = scanner.scan_directory(self.test_dir, similarity=100)
         self.assertEqual(first, second)
 
+    def test_regroup_matches_a_fresh_scan_at_the_new_threshold(self):
+        reencoded = os.path.join(self.test_dir, "reencoded.jpg")
+        other = os.path.join(self.test_dir, "other.png")
+        with Image.open(self.original) as image:
+            image.save(reencoded, quality=90)
+        Image.new("RGB", (160, 100), "darkgreen").save(other)
+
+        scanner = ImageScanner()
+        scanner.scan_directory(self.test_dir, similarity=95)
+        for threshold in (70, 85, 99):
+            self.assertEqual(
+                ImageScanner().scan_directory(self.test_dir, similarity=threshold),
+                scanner.regroup(threshold),
+            )
+        with self.assertRaises(ValueError):
+            scanner.regroup(60)
+
+    def test_pair_scores_rank_group_members(self):
+        reencoded = os.path.join(self.test_dir, "reencoded.jpg")
+        with Image.open(self.original) as image:
+            image.save(reencoded, quality=90)
+        scanner = ImageScanner()
+        group = next(iter(scanner.scan_directory(self.test_dir, similarity=85).values()))
+        self.assertEqual(scanner.pair_score(reencoded, self.original), scanner.pair_score(self.original, reencoded))
+        self.assertEqual(set(group), set(scanner.rank_group(group)))
+
+    def test_fingerprint_pack_round_trip(self):
+        fingerprint = ImageScanner.calculate_visual_fingerprint(self.original)
+        packed = fingerprint.pack()
+        self.assertEqual(70, len(packed))
+        self.assertEqual(fingerprint, VisualFingerprint.unpack(packed))
+
+    def test_batched_fingerprints_match_single_image_fingerprints(self):
+        rng = np.random.default_rng(7)
+        images = [
+            Image.open(self.original),
+            Image.fromarray(rng.integers(0, 256, (120, 90, 3), dtype=np.uint8)),
+            Image.fromarray(rng.integers(0, 256, (300, 40), dtype=np.uint8)).convert("RGB"),
+            Image.new("RGB", (12, 9), "gray"),
+            Image.new("RGB", (700, 520), (200, 30, 90)),
+            ImageEnhance.Brightness(Image.open(self.original)).enhance(0.2).resize((1024, 640)),
+        ]
+        paths = []
+        for number, image in enumerate(images):
+            paths.append(os.path.join(self.test_dir, f"image_{number}.png"))
+            image.save(paths[-1])
+
+        batch = FingerprintBatcher(batch_size=4)
+        rows = [row for path in paths for row in batch.add(path, ImageScanner.prepare_fingerprint_input(path))]
+        rows += batch.flush()
+        self.assertEqual(paths, [path for path, _ in rows])
+        for path, packed in rows:
+            self.assertEqual(ImageScanner.calculate_visual_fingerprint(path).pack(), packed)
+
+    def test_reference_index_matches_query_folder(self):
+        archive = os.path.join(self.test_dir, "archive")
+        incoming = os.path.join(self.test_dir, "incoming")
+        os.makedirs(archive)
+        os.makedirs(incoming)
+        shutil.move(self.original, os.path.join(archive, "original.png"))
+        reference = os.path.join(archive, "original.png")
+        Image.new("RGB", (160, 100), "darkgreen").save(os.path.join(archive, "other.png"))
+        copy = os.path.join(incoming, "copy.png")
+        reencoded = os.path.join(incoming, "reencoded.jpg")
+        shutil.copy2(reference, copy)
+        with Image.open(reference) as image:
+            image.save(reencoded, quality=90)
+
+        index_path = os.path.join(self.test_dir, "archive.twinidx")
+        ReferenceIndex.build(archive).save(index_path)
+        index = ReferenceIndex.load(index_path)
+        self.assertEqual(2, len(index))
+        self.assertEqual([[copy, reference]], list(index.query_directory(incoming, similarity=100).values()))
+        similar = index.query_directory(incoming, similarity=90)
+        self.assertEqual({copy, reencoded}, {group[0] for group in similar.values()})
+        self.assertTrue(all(group[1:] == [reference] for group in similar.values()))
+
+    def test_reference_index_matches_below_the_probe_radius(self):
+        # Three phash bits differ in every chunk, beyond the buckets probed
+        # per chunk, for a score of 88.75.
+        packed = bytearray(ImageScanner.calculate_visual_fingerprint(self.original).pack())
+        for chunk in range(ReferenceIndex.CHUNKS):
+            packed[2 * chunk] ^= 0b111
+        variant = os.path.join(self.test_dir, "variant.png")
+        index = ReferenceIndex()
+        index.add(variant, fingerprint=VisualFingerprint.unpack(bytes(packed)))
+        fingerprint = ImageScanner.calculate_visual_fingerprint(self.original)
+        self.assertEqual([(variant, 88.75)], index.match_similar(fingerprint, 85))
+        self.assertEqual([], index.match_similar(fingerprint, 89))
+        index.remove(variant)
+        self.assertEqual([], index.match_similar(fingerprint, 85))
+
+    def test_lookup_service_answers_and_applies_updates_over_http(self):
+        reencoded = os.path.join(self.test_dir, "reencoded.jpg")
+        with Image.open(self.original) as image:
+            image.save(reencoded, quality=90)
+        server = make_server(LookupService.build(self.test_dir), port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        connection = http.client.HTTPConnection(*server.server_address[:2])
+        self.addCleanup(connection.close)
+
+        def post(url, body, content_type="application/json"):
+            connection.request("POST", url, body, {"Content-Type": content_type})
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+
+        with open(self.original, "rb") as image_file:
+            data = image_file.read()
+        status, exact = post("/lookup?similarity=100", data, "image/png")
+        self.assertEqual((200, [{"path": self.original, "score": 100.0}]), (status, exact["matches"]))
+        _, similar = post("/lookup", json.dumps({"path": reencoded, "similarity": 90}))
+        self.assertEqual([self.original], [match["path"] for match in similar["matches"]])
+
+        self.assertTrue(post("/remove", json.dumps({"path": self.original}))[1]["removed"])
+        self.assertEqual([], post("/lookup?similarity=100", data, "image/png")[1]["matches"])
+        copy = os.path.join(self.test_dir, "copy.png")
+        shutil.copy2(self.original, copy)
+        self.assertEqual(200, post("/add", json.dumps({"path": copy}))[0])
+        self.assertEqual([copy], [match["path"] for match in post("/lookup", data, "image/png")[1]["matches"]])
+        self.assertEqual(400, post("/lookup?similarity=120", data, "image/png")[0])
+
+    def test_lookup_service_finds_matches_below_the_probe_radius(self):
+        packed = bytearray(ImageScanner.calculate_visual_fingerprint(self.original).pack())
+        for chunk in range(ReferenceIndex.CHUNKS):
+            packed[2 * chunk] ^= 0b111
+        variant = os.path.join(self.test_dir, "variant.png")
+        index = ReferenceIndex()
+        index.add(variant, fingerprint=VisualFingerprint.unpack(bytes(packed)))
+        service = LookupService(index, exact=False)
+        with open(self.original, "rb") as image_file:
+            data = image_file.read()
+        self.assertEqual([(variant, 88.75)], service.lookup(self.original, similarity=85))
+        self.assertEqual([(variant, 88.75)], service.lookup(data=data, similarity=85))
+        self.assertEqual([], service.lookup(self.original, similarity=90))
+
+    def test_merged_shards_match_a_monolithic_scan(self):
+        nested = os.path.join(self.test_dir, "b", "nested")
+        os.makedirs(nested)
+        os.makedirs(os.path.join(self.test_dir, "A"))
+        shutil.copy2(self.original, os.path.join(nested, "copy.png"))
+        shutil.copy2(self.original, os.path.join(self.test_dir, "A", "Z.png"))
+        with Image.open(self.original) as image:
+            image.save(os.path.join(self.test_dir, "b", "reencoded.jpg"), quality=90)
+            image.save(os.path.join(self.test_dir, "c.jpg"), quality=80)
+        Image.new("RGB", (160, 100), "darkgreen").save(os.path.join(nested, "other.png"))
+
+        shard_dir = tempfile.mkdtemp(prefix="twinhunter_shards_")
+        self.addCleanup(shutil.rmtree, shard_dir, ignore_errors=True)
+        shard_paths = [os.path.join(shard_dir, f"{index}.twinshard") for index in range(3)]
+        for index, shard_path in enumerate(shard_paths):
+            scan_shard(self.test_dir, shard_path, index, 3)
+
+        for similarity in (100, 85):
+            expected = ImageScanner().scan_directory(self.test_dir, similarity=similarity)
+            self.assertTrue(expected)
+            self.assertEqual(list(expected.items()), list(merge_shards(shard_paths, similarity=similarity).items()))
+        with self.assertRaises(ValueError):
+            merge_shards(shard_paths[1:], similarity=85)
+
+        digest_list = os.path.join(shard_dir, "known.txt")
+        with open(digest_list, "w", encoding="utf-8") as listing:
+            listing.write(ImageScanner.calculate_exact_hash(self.original) + "\n")
+        known = DigestSet.build(os.path.join(shard_dir, "known.twindset"), [digest_list])
+        self.addCleanup(known.close)
+        merged_results = {}
+        for scope, known_digests in (("cross-folder", [known]), ("within-folder", ()), ("all", [known])):
+            for similarity in (100, 85):
+                monolithic, merged = ImageScanner(), ImageScanner()
+                for scanner in (monolithic, merged):
+                    scanner.comparison_scope = scope
+                    scanner.known_digests = known_digests
+                expected = monolithic.scan_directory(self.test_dir, similarity=similarity)
+                self.assertEqual(list(expected.items()), list(merge_shards(shard_paths, similarity, merged).items()))
+                merged_results[scope, similarity] = expected
+
+        # Shards are merged from their records, so the scanned root need not exist any more.
+        shutil.rmtree(self.test_dir)
+        for (scope, similarity), expected in merged_results.items():
+            merged = ImageScanner()
+            merged.comparison_scope = scope
+            merged.known_digests = [known] if scope != "within-folder" else ()
+            self.assertEqual(list(expected.items()), list(merge_shards(shard_paths, similarity, merged).items()))
+
+    def test_visual_scan_compares_identical_copies_once(self):
+        for name in ("backup-1.png", "backup-2.png"):
+            shutil.copy2(self.original, os.path.join(self.test_dir, name))
+        with Image.open(self.original) as image:
+            image.save(os.path.join(self.test_dir, "reencoded.jpg"), quality=90)
+
+        collapsed = ImageScanner()
+        expected = ImageScanner().scan_directory(self.test_dir, similarity=85, collapse_exact=False)
+        self.assertEqual(list(expected.items()), list(collapsed.scan_directory(self.test_dir, similarity=85).items()))
+        self.assertEqual(2, collapsed.metrics["identical_copies"])
+        self.assertEqual(1, collapsed.metrics["pair_comparisons"])
+        self.assertEqual(100.0, collapsed.pair_score(self.original, os.path.join(self.test_dir, "backup-2.png")))
+
+    def test_block_scores_match_pairwise_scores(self):
+        paths = [self.original]
+        for name, factor in (("darker.png", 0.6), ("brighter.png", 1.4)):
+            paths.append(os.path.join(self.test_dir, name))
+            with Image.open(self.original) as image:
+                ImageEnhance.Brightness(image).enhance(factor).save(paths[-1])
+        fingerprints = [ImageScanner.calculate_visual_fingerprint(path) for path in paths]
+        rows = np.frombuffer(b"".join(item.pack() for item in fingerprints), dtype=np.uint8).reshape(3, -1)
+        scores = ImageScanner.similarity_scores(rows, rows)
+        for left, right in itertools.product(range(3), repeat=2):
+            self.assertEqual(ImageScanner.similarity_score(fingerprints[left], fingerprints[right]), scores[left, right])
+
+    def test_memory_mapped_scan_matches_in_memory_scan_and_is_reused(self):
+        shutil.copy2(self.original, os.path.join(self.test_dir, "copy.png"))
+        with Image.open(self.original) as image:
+            image.save(os.path.join(self.test_dir, "reencoded.jpg"), quality=90)
+        Image.new("RGB", (160, 100), "darkgreen").save(os.path.join(self.test_dir, "other.png"))
+        matrix_dir = tempfile.mkdtemp(prefix="twinhunter_matrix_")
+        self.addCleanup(shutil.rmtree, matrix_dir, ignore_errors=True)
+        matrix_path = os.path.join(matrix_dir, "fingerprints.npy")
+
+        expected = ImageScanner().scan_directory(self.test_dir, similarity=85)
+        scanner = ImageScanner()
+        scanner.comparison_block_size = 2
+        self.assertEqual(expected, scanner.scan_directory(self.test_dir, similarity=85, matrix_path=matrix_path))
+        self.assertEqual(0, scanner.metrics["reused_fingerprints"])
+        self.assertEqual(expected, scanner.scan_directory(self.test_dir, similarity=85, matrix_path=matrix_path))
+        self.assertEqual(3, scanner.metrics["reused_fingerprints"])
+        with self.assertRaises(ValueError):
+            scanner.regroup(80)
+
+    def test_oversized_images_are_fingerprinted_from_a_reduced_decode(self):
+        large = os.path.join(self.test_dir, "large.jpg")
+        with Image.open(self.original) as image:
+            image.resize((1600, 1000)).save(large, quality=95)
+        scheduler = DecodeScheduler(budget_bytes=4 * 1024 * 1024)
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = 100_000
+        try:
+            scanner = ImageScanner(decode_scheduler=scheduler)
+            duplicates = scanner.scan_directory(self.test_dir, similarity=85)
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+        self.assertEqual([], scanner.skipped_files)
+        self.assertEqual(1, scanner.metrics["reduced_decodes"])
+        self.assertEqual({self.original, large}, set(next(iter(duplicates.values()))))
+        self.assertEqual(0, scheduler.in_flight_bytes)
+
+    def test_only_formats_with_reduced_decoding_may_exceed_the_pixel_limit(self):
+        # An uncompressed tiled TIFF, which Pillow cannot write, is decoded one tile at a time.
+        with Image.open(self.original) as image:
+            pixels = np.asarray(image.convert("RGB").resize((1600, 1000)))
+        tile = 256
+        tiles = []
+        for top in range(0, 1000, tile):
+            for left in range(0, 1600, tile):
+                block = np.zeros((tile, tile, 3), dtype=np.uint8)
+                part = pixels[top:top + tile, left:left + tile]
+                block[:part.shape[0], :part.shape[1]] = part
+                tiles.append(block.tobytes())
+        tags = [(256, 4, 1, 1600), (257, 4, 1, 1000), (258, 3, 3, 146), (259, 3, 1, 1), (262, 3, 1, 2),
+                (277, 3, 1, 3), (284, 3, 1, 1), (322, 4, 1, tile), (323, 4, 1, tile),
+                (324, 4, len(tiles), 154), (325, 4, len(tiles), 154 + 4 * len(tiles))]
+        data_start = 154 + 8 * len(tiles)
+        tiff = bytearray(b"II*\0" + struct.pack("<IH", 8, len(tags)))
+        for tag, kind, count, value in tags:
+            tiff += struct.pack("<HHI", tag, kind, count)
+            tiff += struct.pack("<H2x", value) if kind == 3 and count == 1 else struct.pack("<I", value)
+        tiff += struct.pack("<I3H2x", 0, 8, 8, 8)
+        tiff += struct.pack(f"<{len(tiles)}I", *(data_start + len(tiles[0]) * n for n in range(len(tiles))))
+        tiff += struct.pack(f"<{len(tiles)}I", *(len(data) for data in tiles))
+        tiled = os.path.join(self.test_dir, "tiled.tif")
+        with open(tiled, "wb") as output:
+            output.write(bytes(tiff) + b"".join(tiles))
+
+        # A PNG header claiming a huge image cannot be decoded at reduced size, so it is skipped.
+        def chunk(kind, payload):
+            return struct.pack(">I", len(payload)) + kind + payload + struct.pack(">I", zlib.crc32(kind + payload))
+
+        bomb = os.path.join(self.test_dir, "bomb.png")
+        with open(bomb, "wb") as output:
+            header = chunk(b"IHDR", struct.pack(">IIBBBBB", 30000, 30000, 8, 2, 0, 0, 0))
+            output.write(b"\x89PNG\r\n\x1a\n" + header + chunk(b"IDAT", zlib.compress(b"\0" * 1024)) + chunk(b"IEND", b""))
+
+        scheduler = DecodeScheduler(budget_bytes=4 * 1024 * 1024)
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = 100_000
+        try:
+            scanner = ImageScanner(decode_scheduler=scheduler)
+            duplicates = scanner.scan_directory(self.test_dir, similarity=85)
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+        self.assertEqual([bomb], [path for path, _ in scanner.skipped_files])
+        self.assertIn("exceeds limit", scanner.skipped_files[0][1])
+        self.assertEqual(1, scanner.metrics["reduced_decodes"])
+        self.assertEqual([{self.original, tiled}], [set(paths) for paths in duplicates.values()])
+        with scheduler.open_normalized(tiled) as reduced, Image.open(tiled) as image:
+            self.assertEqual((1600, 1000), image.size)
+            full = np.asarray(image.convert("RGB").reduce(1600 // reduced.width), dtype=np.int16)
+            self.assertLessEqual(np.abs(np.asarray(reduced, dtype=np.int16) - full).max(), 1)
+
+    def test_read_ahead_preserves_order_within_its_limits(self):
+        paths = []
+        for number in range(6):
+            paths.append(os.path.join(self.test_dir, f"{number}.bin"))
+            with open(paths[-1], "wb") as output:
+                output.write(bytes([number]) * (number + 1) * 100)
+        missing = os.path.join(self.test_dir, "missing.bin")
+        with ReadAhead(paths + [missing], readers=3, depth=2, max_bytes=250) as contents:
+            results = list(contents)
+        self.assertEqual(paths + [missing], [path for path, _, _ in results])
+        self.assertEqual([bytes([n]) * (n + 1) * 100 for n in range(2)], [data for _, data, _ in results[:2]])
+        self.assertIsNone(results[2][1])
+        self.assertIsInstance(results[-1][2], OSError)
+        self.assertIn(contents.stats()["bottleneck"], ("io", "cpu"))
+
+    def test_read_ahead_reports_unexpected_reader_errors_as_os_errors(self):
+        import core.pipeline
+
+        def read_bytes(path):
+            raise NotImplementedError("unsupported compression")
+
+        member = os.path.join(self.test_dir, "photos.zip") + "!/a.png"
+        originals = core.pipeline.read_bytes, core.pipeline.file_size
+        core.pipeline.read_bytes, core.pipeline.file_size = read_bytes, lambda path: 10
+        try:
+            for readers in (2, 0):
+                with ReadAhead([member, member], readers=readers) as contents:
+                    results = list(contents)
+                self.assertEqual([member, member], [path for path, _, _ in results])
+                for _, data, error in results:
+                    self.assertIsNone(data)
+                    self.assertIsInstance(error, OSError)
+                    self.assertIsInstance(error.__cause__, NotImplementedError)
+        finally:
+            core.pipeline.read_bytes, core.pipeline.file_size = originals
+
+    def test_scans_match_with_and_without_read_ahead(self):
+        shutil.copy2(self.original, os.path.join(self.test_dir, "copy.png"))
+        with Image.open(self.original) as image:
+            image.save(os.path.join(self.test_dir, "reencoded.jpg"), quality=90)
+        direct = ImageScanner()
+        direct.read_ahead_depth = 0
+        for similarity in (100, 85):
+            scanner = ImageScanner()
+            self.assertEqual(
+                direct.scan_directory(self.test_dir, similarity=similarity),
+                scanner.scan_directory(self.test_dir, similarity=similarity),
+            )
+            self.assertGreater(scanner.metrics["read_ahead_bytes"], 0)
+
+    def test_autotuning_resizes_read_ahead_without_changing_results(self):
+        paths = []
+        for number in range(20):
+            paths.append(os.path.join(self.test_dir, f"{number}.bin"))
+            with open(paths[-1], "wb") as output:
+                output.write(bytes([number]) * 100)
+        tuner = ReadAheadTuner(window=2, sample_files=12, max_readers=4)
+        with ReadAhead(paths, readers=1, depth=1, tuner=tuner) as contents:
+            for number, (path, data, error) in enumerate(contents):
+                self.assertEqual((paths[number], bytes([number]) * 100, None), (path, data, error))
+                if number == 8:
+                    contents.resize(1, 1)
+        self.assertTrue(tuner.settled)
+        self.assertIn("images_per_second", contents.stats())
+
+        rows = np.frombuffer(os.urandom(70 * 10), dtype=np.uint8).reshape(10, 70)
+        fastest = fastest_block_size(ImageScanner.similarity_scores, rows, np.arange(10), (2, 4, 8, 16))
+        self.assertIn(fastest, (2, 4, 8))
+
+        with Image.open(self.original) as image:
+            image.save(os.path.join(self.test_dir, "reencoded.jpg"), quality=90)
+        tuned = ImageScanner()
+        tuned.autotune = True
+        self.assertEqual(
+            ImageScanner().scan_directory(self.test_dir, similarity=85),
+            tuned.scan_directory(self.test_dir, similarity=85),
+        )
+        reused = ImageScanner()
+        reused.apply_tuning(tuned.metrics["tuning"])
+        self.assertEqual(tuned.metrics["tuning"], reused.tuning())
+        reused.apply_tuning({"read_ahead_threads": 0, "read_ahead_depth": 0})
+        self.assertEqual((0, 0), (reused.read_ahead_threads, reused.read_ahead_depth))
+        for setting in ({"read_ahead_threads": -1}, {"comparison_block_size": 0}):
+            with self.assertRaises(ValueError):
+                reused.apply_tuning(setting)
+
+    def test_processing_order_does_not_change_groups(self):
+        for folder in ("b", "a"):
+            os.makedirs(os.path.join(self.test_dir, folder))
+            shutil.copy2(self.original, os.path.join(self.test_dir, folder, "copy.png"))
+            with Image.open(self.original) as image:
+                image.save(os.path.join(self.test_dir, folder, "reencoded.jpg"), quality=90)
+        with open(os.path.join(self.test_dir, "a", "broken.jpg"), "wb") as output:
+            output.write(b"not an image")
+        matrix_dir = tempfile.mkdtemp(prefix="twinhunter_matrix_")
+        self.addCleanup(shutil.rmtree, matrix_dir, ignore_errors=True)
+
+        for similarity in (100, 85):
+            expected = ImageScanner()
+            expected_groups = list(expected.scan_directory(self.test_dir, similarity=similarity).items())
+            for order in ("inode", "directory"):
+                for matrix_path in (None, os.path.join(matrix_dir, f"{order}.npy")):
+                    scanner = ImageScanner()
+                    scanner.processing_order = order
+                    groups = scanner.scan_directory(self.test_dir, similarity=similarity, matrix_path=matrix_path)
+                    self.assertEqual(expected_groups, list(groups.items()))
+                    self.assertEqual(expected.skipped_files, scanner.skipped_files)
+
+    def test_paused_scans_resume_to_the_same_groups(self):
+        shutil.copy2(self.original, os.path.join(self.test_dir, "copy.png"))
+        for name, factor in (("darker.png", 0.8), ("brighter.jpg", 1.2)):
+            with Image.open(self.original) as image:
+                ImageEnhance.Brightness(image).enhance(factor).save(os.path.join(self.test_dir, name))
+        Image.new("RGB", (160, 100), "darkgreen").save(os.path.join(self.test_dir, "other.png"))
+        with open(os.path.join(self.test_dir, "broken.jpg"), "wb") as output:
+            output.write(b"not an image")
+        checkpoint_dir = tempfile.mkdtemp(prefix="twinhunter_checkpoint_")
+        self.addCleanup(shutil.rmtree, checkpoint_dir, ignore_errors=True)
+        checkpoint_path = os.path.join(checkpoint_dir, "scan.twinstate")
+
+        resumed_work = {"resumed_files": 0, "resumed_pair_blocks": 0}
+        for similarity, pixels in ((100, False), (100, True), (85, False)):
+            expected = ImageScanner()
+            expected_groups = list(
+                expected.scan_directory(self.test_dir, similarity=similarity, pixel_identical=pixels).items()
+            )
+            # Pause after every possible number of cancellation checks, then resume.
+            for pause_after in range(1, 12):
+                calls = itertools.count(1)
+                scanner = ImageScanner()
+                scanner.comparison_block_size = 1
+                try:
+                    scanner.scan_directory(
+                        self.test_dir,
+                        similarity=similarity,
+                        cancel_check=lambda: next(calls) > pause_after,
+                        checkpoint_path=checkpoint_path,
+                        pixel_identical=pixels,
+                    )
+                except ScanCancelled:
+                    self.assertTrue(os.path.exists(checkpoint_path))
+                resumed = ImageScanner()
+                resumed.comparison_block_size = 1
+                groups = resumed.scan_directory(
+                    self.test_dir, similarity=similarity, checkpoint_path=checkpoint_path, pixel_identical=pixels
+                )
+                self.assertEqual(expected_groups, list(groups.items()))
+                self.assertEqual(expected.skipped_files, resumed.skipped_files)
+                self.assertFalse(os.path.exists(checkpoint_path))
+                for key in resumed_work:
+                    resumed_work[key] += resumed.metrics.get(key, 0)
+        self.assertTrue(all(resumed_work.values()))
+
+    def test_checkpoints_of_other_options_or_unreadable_ones_are_not_resumed(self):
+        checkpoint_path = os.path.join(tempfile.mkdtemp(prefix="twinhunter_checkpoint_"), "scan.twinstate")
+        self.addCleanup(shutil.rmtree, os.path.dirname(checkpoint_path), ignore_errors=True)
+        calls = itertools.count()
+        with self.assertRaises(ScanCancelled):
+            ImageScanner().scan_directory(
+                self.test_dir, cancel_check=lambda: next(calls) > 0, checkpoint_path=checkpoint_path
+            )
+        self.assertTrue(os.path.exists(checkpoint_path))
+        with zipfile.ZipFile(os.path.join(self.test_dir, "backup.zip"), "w") as archive:
+            archive.write(self.original, "original.png")
+
+        # The paused scan did not look inside archives, so its file list is not reused.
+        scanner = ImageScanner()
+        scanner.scan_archives = True
+        duplicates = scanner.scan_directory(self.test_dir, checkpoint_path=checkpoint_path)
+        self.assertEqual(1, len(duplicates))
+        self.assertIn("other scan options", scanner.metrics["checkpoint_ignored"])
+
+        with open(checkpoint_path, "wb") as output:
+            output.write(b"not a checkpoint")
+        scanner = ImageScanner()
+        scanner.scan_archives = True
+        self.assertEqual(duplicates, scanner.scan_directory(self.test_dir, checkpoint_path=checkpoint_path))
+        self.assertIn("not a TwinHunter", scanner.metrics["checkpoint_ignored"])
+        self.assertFalse(os.path.exists(checkpoint_path))
+
+    def test_pixel_mode_matches_identical_pixels_despite_metadata_and_encoding(self):
+        metadata = PngImagePlugin.PngInfo()
+        metadata.add_text("Comment", "rewritten metadata")
+        tagged = os.path.join(self.test_dir, "tagged.png")
+        lossless = os.path.join(self.test_dir, "lossless.bmp")
+        rotated = os.path.join(self.test_dir, "rotated.png")
+        copy = os.path.join(self.test_dir, "copy.png")
+        shutil.copy2(self.original, copy)
+        with Image.open(self.original) as image:
+            image.save(tagged, pnginfo=metadata)
+            image.save(lossless)
+            exif = Image.Exif()
+            exif[0x0112] = 6
+            image.transpose(Image.Transpose.ROTATE_90).save(rotated, exif=exif)
+            image.save(os.path.join(self.test_dir, "reencoded.jpg"), quality=90)
+
+        self.assertEqual(1, len(ImageScanner().scan_directory(self.test_dir, similarity=100)))
+        scanner = ImageScanner()
+        duplicates = scanner.scan_directory(self.test_dir, similarity=100, pixel_identical=True)
+        self.assertEqual([[copy, lossless, self.original, rotated, tagged]], list(duplicates.values()))
+        self.assertEqual(1, scanner.metrics["identical_copies"])
+        with self.assertRaises(ValueError):
+            scanner.scan_directory(self.test_dir, similarity=85, pixel_identical=True)
+
+    def test_aspect_blocking_skips_comparisons_between_different_shapes(self):
+        reencoded = os.path.join(self.test_dir, "reencoded.jpg")
+        stretched = os.path.join(self.test_dir, "stretched.png")
+        with Image.open(self.original) as image:
+            image.save(reencoded, quality=90)
+            image.resize((160, 160)).save(stretched)
+            exif = Image.Exif()
+            exif[0x0112] = 6
+            image.transpose(Image.Transpose.ROTATE_90).save(os.path.join(self.test_dir, "rotated.jpg"), exif=exif)
+        Image.new("RGB", (90, 160), "darkgreen").save(os.path.join(self.test_dir, "screenshot.png"))
+
+        blocked = ImageScanner()
+        blocked.aspect_blocking = True
+        duplicates = blocked.scan_directory(self.test_dir, similarity=85)
+        self.assertEqual([{self.original, reencoded, os.path.join(self.test_dir, "rotated.jpg")}],
+                         [set(group) for group in duplicates.values()])
+        self.assertEqual(10, blocked.metrics["pair_comparisons"] + blocked.metrics["skipped_comparisons"])
+        self.assertGreater(blocked.metrics["skipped_comparisons"], 0)
+
+        crop_tolerant = ImageScanner()
+        duplicates = crop_tolerant.scan_directory(self.test_dir, similarity=85)
+        self.assertIn(stretched, next(iter(duplicates.values())))
+        self.assertEqual(10, crop_tolerant.metrics["pair_comparisons"])
+
+    def test_saved_session_restores_groups_review_state_and_flags_changes(self):
+        reencoded = os.path.join(self.test_dir, "reencoded.jpg")
+        copy = os.path.join(self.test_dir, "copy.png")
+        shutil.copy2(self.original, copy)
+        with Image.open(self.original) as image:
+            image.save(reencoded, quality=90)
+        session_path = os.path.join(tempfile.mkdtemp(prefix="twinhunter_session_"), "review.twinsession")
+        self.addCleanup(shutil.rmtree, os.path.dirname(session_path), ignore_errors=True)
+
+        scanner = ImageScanner()
+        duplicates = scanner.scan_directory(self.test_dir, similarity=85)
+        group_id = next(iter(duplicates))
+        session = ScanSession.from_scan(scanner, [self.test_dir], 85, duplicates)
+        session.keepers[group_id] = self.original
+        session.selected.add(copy)
+        session.save(session_path)
+
+        os.remove(copy)
+        with Image.open(self.original) as image:
+            image.save(reencoded, quality=70)
+        reopened = ScanSession.load(session_path)
+        self.assertEqual(duplicates, reopened.groups)
+        self.assertEqual((85, [self.test_dir]), (reopened.similarity, reopened.roots))
+        self.assertEqual({group_id: self.original}, reopened.keepers)
+        self.assertEqual({copy}, reopened.selected)
+        fingerprint = ImageScanner.calculate_visual_fingerprint(self.original)
+        self.assertEqual(fingerprint, VisualFingerprint.unpack(bytes.fromhex(reopened.hashes[self.original])))
+        self.assertEqual({copy: "missing", reencoded: "changed"}, reopened.check_files())
+
+        # Saving a reopened session updates only the review state.
+        reopened.set_review({group_id: reencoded}, set())
+        reopened.save(session_path)
+        again = ScanSession.load(session_path)
+        self.assertEqual(({group_id: reencoded}, set()), (again.keepers, again.selected))
+        self.assertEqual((reopened.signatures, reopened.hashes), (again.signatures, again.hashes))
+        self.assertEqual({copy: "missing", reencoded: "changed"}, again.check_files())
+
+    def test_multiple_roots_scan_as_one_set_without_scanning_overlaps_twice(self):
+        album = os.path.join(self.test_dir, "album")
+        other_root = tempfile.mkdtemp(prefix="twinhunter_other_")
+        self.addCleanup(shutil.rmtree, other_root, ignore_errors=True)
+        os.makedirs(album)
+        copy = os.path.join(other_root, "copy.png")
+        shutil.copy2(self.original, copy)
+        os.link(self.original, os.path.join(album, "hardlink.png"))
+
+        scanner = ImageScanner()
+        self.assertEqual([self.test_dir, other_root], scanner.scan_roots([self.test_dir, album, other_root]))
+        duplicates = scanner.scan_directory([self.test_dir, album, other_root, self.test_dir], similarity=100)
+        self.assertEqual(1, len(duplicates))
+        self.assertEqual({self.original, copy}, set(next(iter(duplicates.values()))))
+        self.assertEqual(2, len(ImageScanner._collect_images([self.test_dir, other_root])))
+        # Within one root only symlinks are resolved; discovery stops as soon as it is cancelled.
+        os.symlink(self.original, os.path.join(album, "symlink.png"))
+        self.assertEqual([self.original], ImageScanner._collect_images(self.test_dir)[:1])
+        self.assertNotIn(os.path.join(album, "symlink.png"), ImageScanner._collect_images(self.test_dir))
+        checks = []
+        with self.assertRaises(ScanCancelled):
+            ImageScanner._collect_images(
+                [self.test_dir, other_root], cancel_check=lambda: checks.append(1) or len(checks) > 1
+            )
+        with self.assertRaises(ValueError):
+            scanner.scan_directory([self.test_dir, os.path.join(other_root, "missing")])
+
+    def test_coarse_pass_decodes_only_candidates_and_keeps_groups(self):
+        def save_with_thumbnail(image, path):
+            thumbnail = image.copy()
+            thumbnail.thumbnail((160, 120))
+            canvas = Image.new("RGB", (160, 120))
+            canvas.paste(thumbnail, ((160 - thumbnail.width) // 2, (120 - thumbnail.height) // 2))
+            buffer = io.BytesIO()
+            canvas.save(buffer, "JPEG")
+            data = buffer.getvalue()
+            # A big-endian TIFF header, an empty IFD0 and an IFD1 pointing at the thumbnail.
+            ifd1 = struct.pack(">HHHII", 2, 0x0201, 4, 1, 44) + struct.pack(">HHII", 0x0202, 4, 1, len(data))
+            exif = b"Exif\x00\x00MM\x00*\x00\x00\x00\x08" + struct.pack(">HI", 0, 14) + ifd1 + b"\x00" * 4
+            image.save(path, quality=90, exif=exif + data)
+
+        photo = Image.open(self.original).resize((1600, 1000))
+        save_with_thumbnail(photo, os.path.join(self.test_dir, "photo.jpg"))
+        save_with_thumbnail(photo.resize((800, 500)), os.path.join(self.test_dir, "smaller.jpg"))
+        rng = np.random.default_rng(11)
+        Image.fromarray(rng.integers(0, 256, (400, 640, 3), dtype=np.uint8)).save(
+            os.path.join(self.test_dir, "noise.jpg")
+        )
+
+        full = ImageScanner().scan_directory(self.test_dir, similarity=85)
+        scanner = ImageScanner()
+        scanner.coarse_to_fine = True
+        coarse = scanner.scan_directory(self.test_dir, similarity=85)
+        self.assertEqual(list(map(set, full.values())), list(map(set, coarse.values())))
+        self.assertEqual(2, scanner.metrics["coarse_thumbnails"])
+        self.assertEqual(1, scanner.metrics["coarse_drafts"])
+        self.assertEqual(1, scanner.metrics["coarse_full_decodes"])
+        self.assertEqual(3, scanner.metrics["coarse_candidates"])
+        self.assertEqual(coarse, scanner.regroup(80))
+
+    def test_images_inside_archives_are_scanned_in_place(self):
+        with open(self.original, "rb") as source:
+            data = source.read()
+        stored = os.path.join(self.test_dir, "stored.zip")
+        with zipfile.ZipFile(stored, "w", zipfile.ZIP_STORED) as archive:
+            archive.writestr("2019/copy.png", data)
+            archive.writestr("notes.txt", "not an image")
+        compressed = os.path.join(self.test_dir, "backup.tar.gz")
+        with tarfile.open(compressed, "w:gz") as archive:
+            member = tarfile.TarInfo("./album/copy.png")
+            member.size = len(data)
+            archive.addfile(member, io.BytesIO(data))
+        with open(os.path.join(self.test_dir, "broken.zip"), "wb") as broken:
+            broken.write(b"PK\x03\x04 truncated")
+        members = {stored + "!/2019/copy.png", compressed + "!/album/copy.png"}
+
+        scanner = ImageScanner()
+        self.assertEqual({}, scanner.scan_directory(self.test_dir, similarity=100))
+        scanner.scan_archives = True
+        for similarity in (100, 90):
+            duplicates = scanner.scan_directory(self.test_dir, similarity=similarity)
+            self.assertEqual([{self.original} | members], [set(paths) for paths in duplicates.values()])
+        self.assertEqual([], scanner.skipped_files)
+        self.assertEqual((compressed, "album/copy.png"), split_member(compressed + "!/album/copy.png"))
+        self.assertEqual(len(data), get_file_size(stored + "!/2019/copy.png"))
+
+        session = ScanSession.from_scan(scanner, [self.test_dir], 90, duplicates)
+        self.assertEqual({}, session.check_files())
+        with zipfile.ZipFile(stored, "a") as archive:
+            archive.writestr("later.png", data)
+        self.assertEqual("changed", session.check_files()[stored + "!/2019/copy.png"])
+
+    def test_compressed_tars_are_decompressed_once_to_list_and_once_to_read(self):
+        with open(self.original, "rb") as source:
+            data = source.read()
+        # More archives than are kept open at once.
+        for number in range(10):
+            with tarfile.open(os.path.join(self.test_dir, f"backup-{number}.tar.gz"), "w:gz") as archive:
+                member = tarfile.TarInfo(f"copy-{number}.png")
+                member.size = len(data)
+                archive.addfile(member, io.BytesIO(data))
+        decompressions = []
+        tar_open = tarfile.open
+
+        def recording_open(name=None, mode="r", *args, **kwargs):
+            if mode in ("r:*", "r|*"):
+                decompressions.append(name)
+            return tar_open(name, mode, *args, **kwargs)
+
+        scanner = ImageScanner()
+        scanner.scan_archives = True
+        tarfile.open = recording_open
+        try:
+            for similarity in (100, 85):
+                decompressions.clear()
+                duplicates = scanner.scan_directory(self.test_dir, similarity=similarity)
+                self.assertEqual(11, len(next(iter(duplicates.values()))))
+                self.assertEqual(20, len(decompressions))
+                self.assertEqual(10, len(set(decompressions)))
+        finally:
+            tarfile.open = tar_open
+
+    def test_unsupported_archive_members_are_skipped(self):
+        with open(self.original, "rb") as source:
+            data = source.read()
+        archive_path = os.path.join(self.test_dir, "deflate64.zip")
+        with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_STORED) as archive:
+            archive.writestr("copy.png", data)
+        with open(archive_path, "rb") as source:
+            raw = bytearray(source.read())
+        # Mark the member as Deflate64 (method 9), which zipfile cannot decompress.
+        struct.pack_into("<H", raw, 8, 9)
+        struct.pack_into("<H", raw, raw.rindex(b"PK\x01\x02") + 10, 9)
+        with open(archive_path, "wb") as output:
+            output.write(raw)
+
+        scanner = ImageScanner()
+        scanner.scan_archives = True
+        for readers in (2, 0):
+            scanner.read_ahead_threads = readers
+            self.assertEqual({}, scanner.scan_directory(self.test_dir, similarity=90))
+            self.assertEqual([archive_path + "!/copy.png"], [path for path, _ in scanner.skipped_files])
+
+        # Streamed members that are neither images nor the one requested are never read.
+        compressed = os.path.join(self.test_dir, "videos.tar.gz")
+        with tarfile.open(compressed, "w:gz") as archive:
+            for name, payload in (("clip.mp4", b"\0" * 4096), ("copy.png", data)):
+                member = tarfile.TarInfo(name)
+                member.size = len(payload)
+                archive.addfile(member, io.BytesIO(payload))
+        extracted = []
+        extractfile = tarfile.TarFile.extractfile
+
+        def recording_extractfile(archive, member):
+            extracted.append(member.name)
+            return extractfile(archive, member)
+
+        tarfile.TarFile.extractfile = recording_extractfile
+        try:
+            duplicates = scanner.scan_directory(self.test_dir, similarity=100)
+        finally:
+            tarfile.TarFile.extractfile = extractfile
+        self.assertEqual([[self.original, compressed + "!/copy.png"]], list(duplicates.values()))
+        self.assertNotIn("clip.mp4", extracted)
+
+    def test_plan_predicts_phases_and_pairs_without_scanning(self):
+        shutil.copy(self.original, os.path.join(self.test_dir, "copy.png"))
+        with Image.open(self.original) as image:
+            image.save(os.path.join(self.test_dir, "reencoded.jpg"), quality=90)
+        Image.new("RGB", (90, 160), "darkgreen").save(os.path.join(self.test_dir, "screenshot.png"))
+        scanner = ImageScanner()
+        scanner.aspect_blocking = False
+
+        exact = scanner.plan_scan(self.test_dir)
+        self.assertEqual(("exact", 4, 4), (exact.mode, exact.files, exact.sampled_files))
+        self.assertEqual(["discovery", "hashing"], list(exact.phase_seconds))
+        self.assertEqual(0, exact.pair_comparisons)
+
+        visual = scanner.plan_scan(self.test_dir, similarity=85)
+        self.assertEqual(["discovery", "fingerprinting", "comparison"], list(visual.phase_seconds))
+        self.assertEqual(6, visual.pair_comparisons)
+        self.assertGreater(visual.peak_memory_bytes, 0)
+        self.assertEqual({".jpg": 1, ".png": 3}, {ext: info["files"] for ext, info in visual.formats.items()})
+        self.assertEqual(visual.as_dict()["total_seconds"], round(visual.total_seconds, 2))
+        self.assertFalse(scanner.metrics)
+        with self.assertRaises(ValueError):
+            scanner.plan_scan(self.test_dir, similarity=120)
+
+    def test_known_digest_sets_flag_listed_files_and_skip_unlisted_sizes(self):
+        other = os.path.join(self.test_dir, "other.png")
+        Image.new("RGB", (40, 40), "teal").save(other)
+        digest = ImageScanner.calculate_exact_hash(self.original)
+        lists_dir = tempfile.mkdtemp(prefix="twinhunter_lists_")
+        self.addCleanup(shutil.rmtree, lists_dir, True)
+        listing = os.path.join(lists_dir, "archived.txt")
+        with open(listing, "w", encoding="utf-8") as output:
+            output.write(f"# sha256,size\n{digest.upper()},{os.path.getsize(self.original)}\n{'ab' * 32},7\n")
+        digest_set = DigestSet.build(os.path.join(lists_dir, "archived.twindigests"), [listing])
+        self.assertEqual(("archived", 2, True), (digest_set.name, len(digest_set), digest_set.sizes_known))
+        self.assertIn(digest, digest_set)
+        self.assertNotIn(ImageScanner.calculate_exact_hash(other), digest_set)
+
+        scanner = ImageScanner()
+        scanner.known_digests = [DigestSet.open(digest_set.set_path)]
+        hashed = []
+
+        def calculate_exact_hash(path, data=None):
+            hashed.append(path)
+            return ImageScanner.calculate_exact_hash(path, data)
+
+        scanner.calculate_exact_hash = calculate_exact_hash
+        duplicates = scanner.scan_directory(self.test_dir)
+        self.assertEqual({f"known:archived:{digest}": [self.original]}, duplicates)
+        self.assertEqual("archived", known_set_name(next(iter(duplicates))))
+        self.assertEqual([self.original], hashed)
+        self.assertEqual(1, scanner.metrics["known_matches"])
+
+        with open(listing, "a", encoding="utf-8") as output:
+            output.write(f"{'cd' * 32}  unsized.png\n")
+        self.assertFalse(DigestSet.build(digest_set.set_path + "2", [listing]).sizes_known)
+        with open(listing, "a", encoding="utf-8") as output:
+            output.write("not-a-digest\n")
+        with self.assertRaises(ValueError):
+            DigestSet.build(digest_set.set_path + "3", [listing])
+
+    def test_comparison_scopes_compare_only_pairs_in_scope(self):
+        archive = os.path.join(self.test_dir, "archive")
+        incoming = os.path.join(self.test_dir, "incoming")
+        os.makedirs(archive)
+        os.makedirs(incoming)
+        paths = {name: os.path.join(archive if name.startswith("archive") else incoming, f"{name}.png")
+                 for name in ("archive_a", "archive_copy", "incoming_exact", "incoming_b", "incoming_b_copy")}
+        paths["archive_burst"] = os.path.join(archive, "burst.jpg")
+        paths["incoming_a"] = os.path.join(incoming, "a.jpg")
+        for name in ("archive_a", "archive_copy", "incoming_exact"):
+            shutil.copy(self.original, paths[name])
+        with Image.open(self.original) as image:
+            image.save(paths["archive_burst"], quality=90)
+            image.save(paths["incoming_a"], quality=80)
+        other = Image.new("RGB", (160, 100), "white")
+        ImageDraw.Draw(other).rectangle((0, 0, 80, 50), fill="black")
+        other.save(paths["incoming_b"])
+        shutil.copy(paths["incoming_b"], paths["incoming_b_copy"])
+
+        def scan(scope, similarity):
+            scanner = ImageScanner()
+            scanner.comparison_scope = scope
+            groups = scanner.scan_directory([incoming, archive], similarity=similarity)
+            names = {path: name for name, path in paths.items()}
+            return sorted(sorted(names[path] for path in group) for group in groups.values()), scanner.metrics
+
+        a_group = ["archive_a", "archive_burst", "archive_copy", "incoming_a", "incoming_exact"]
+        b_group = ["incoming_b", "incoming_b_copy"]
+        groups, metrics = scan("all", 85)
+        self.assertEqual(([a_group, b_group], 6), (groups, metrics["pair_comparisons"]))
+        groups, metrics = scan("cross-folder", 85)
+        self.assertEqual(([a_group], 6), (groups, metrics["pair_comparisons"]))
+        groups, metrics = scan("within-folder", 85)
+        self.assertEqual(
+            [["archive_a", "archive_burst", "archive_copy"], ["incoming_a", "incoming_exact"], b_group], groups
+        )
+        self.assertEqual(4, metrics["pair_comparisons"])
+
+        self.assertEqual([["archive_a", "archive_copy", "incoming_exact"]], scan("cross-folder", 100)[0])
+        self.assertEqual([["archive_a", "archive_copy"], b_group], scan("within-folder", 100)[0])
+        with self.assertRaises(ValueError):
+            scan("nearby", 85)
+
     def test_corrupt_image_is_reported_as_skipped(self):
         corrupt = os.path.join(self.test_dir, "broken.jpg")
         with open(corrupt, "wb") as output:
@@ -87,6 +939,11 @@ class TestCore(unittest.TestCase):
         self.assertEqual(format_size(1024), "1.00 KB")
         self.assertEqual(format_size(1024 * 1024), "1.00 MB")
 
+    def test_format_duration(self):
+        self.assertEqual(format_duration(59.4), "59s")
+        self.assertEqual(format_duration(245), "4m 05s")
+        self.assertEqual(format_duration(3 * 3600 + 7 * 60), "3h 07m")
+
 
 if __name__ == "__main__":
     unittest.main()